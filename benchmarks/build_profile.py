@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Times build_profile, write and signing over a synthetic app corpus.
+
+The corpus is a mix of .app bundles, bare executables and shell scripts.
+None of the executables are really signed, so every requirement comes from
+stub `codesign` and `security` scripts that sleep for --latency seconds,
+which makes the benchmark runnable on Linux. Each size runs in its own
+process so peak RSS is measured per size.
+
+    ./benchmarks/build_profile.py [--sizes 10,100,1000,10000]
+        [--latency 0.005] [--jobs 8] [--output results.json]
+
+Results (wall time per phase, subprocesses started and peak RSS) are
+written as JSON so runs against different versions can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+
+INFO_PLIST = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+    <key>CFBundleExecutable</key>
+    <string>{name}</string>
+    <key>CFBundleIdentifier</key>
+    <string>com.example.{name}</string>
+    <key>CFBundleVersion</key>
+    <string>1.0</string>
+</dict>
+</plist>
+'''
+
+# Thin 64-bit Mach-O header with no load commands, i.e. an unsigned binary
+MACHO_HEADER = '\xcf\xfa\xed\xfe\x07\x00\x00\x01\x03\x00\x00\x00\x02\x00' \
+               '\x00\x00' + '\x00' * 16
+
+CODESIGN_STUB = '''#!/bin/sh
+echo codesign >> "$TCCPROFILE_BENCH_LOG"
+sleep {latency}
+for last; do :; done
+echo "Executable=$last" >&2
+echo "designated => identifier \\"$(basename "$last")\\" and anchor apple generic"
+'''
+
+SECURITY_STUB = '''#!/bin/sh
+echo security >> "$TCCPROFILE_BENCH_LOG"
+sleep {latency}
+if [ "$1" = cms ]; then
+    cat
+fi
+'''
+
+
+def make_corpus(root, size):
+    """Creates size apps under root and returns their paths. 70% are
+    bundles, 20% bare executables and 10% shell scripts.
+    """
+    paths = list()
+    for i in range(size):
+        name = 'App{:05d}'.format(i)
+        kind = i % 10
+        if kind < 7:
+            path = os.path.join(root, name + '.app')
+            os.makedirs(os.path.join(path, 'Contents/MacOS'))
+            with open(os.path.join(path, 'Contents/Info.plist'), 'w') as f:
+                f.write(INFO_PLIST.format(name=name))
+            with open(os.path.join(path, 'Contents/MacOS', name), 'wb') as f:
+                f.write(MACHO_HEADER)
+        elif kind < 9:
+            path = os.path.join(root, name)
+            with open(path, 'wb') as f:
+                f.write(MACHO_HEADER)
+        else:
+            path = os.path.join(root, name + '.sh')
+            with open(path, 'w') as f:
+                f.write('#!/bin/sh\necho {}\n'.format(name))
+        paths.append(path)
+
+    return paths
+
+
+def make_tools(tool_dir, latency):
+    for tool, stub in [('codesign', CODESIGN_STUB), ('security', SECURITY_STUB)]:
+        path = os.path.join(tool_dir, tool)
+        with open(path, 'w') as f:
+            f.write(stub.format(latency=latency))
+        os.chmod(path, 0o755)
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_one(size, jobs):
+    """Benchmarks one corpus size in this process and prints the result."""
+    tmpdir = tempfile.mkdtemp(prefix='tccprofile-bench-')
+    try:
+        paths = make_corpus(os.path.join(tmpdir, 'apps'), size) \
+            if size else list()
+        profile = tccprofile.PrivacyProfiles(
+            payload_description='Benchmark', payload_name='Benchmark',
+            payload_identifier='com.example.benchmark',
+            payload_organization='Example', payload_version=1,
+            sign_cert=['Benchmark'],
+            filename=os.path.join(tmpdir, 'benchmark.mobileconfig'))
+        profile.set_services_dict({'Accessibility': paths})
+
+        log = os.environ['TCCPROFILE_BENCH_LOG']
+        result = {'apps': size}
+
+        start = time.time()
+        profile.build_profile(allow=True, jobs=jobs)
+        result['build_s'] = time.time() - start
+
+        start = time.time()
+        data = profile.to_bytes()
+        with open(profile._filename, 'wb') as f:
+            f.write(data)
+        result['write_s'] = time.time() - start
+
+        start = time.time()
+        profile._sign_profile(data)
+        result['sign_s'] = time.time() - start
+
+        with open(log) as f:
+            result['subprocesses'] = len(f.readlines())
+        result['profile_bytes'] = len(data)
+        result['peak_rss_kb'] = peak_rss_kb()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,100,1000,10000')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Seconds each stub tool call takes.')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--run-one', type=int, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        run_one(args.run_one, args.jobs)
+        return
+
+    tool_dir = tempfile.mkdtemp(prefix='tccprofile-tools-')
+    try:
+        make_tools(tool_dir, args.latency)
+
+        results = list()
+        for size in [int(s) for s in args.sizes.split(',')]:
+            log = os.path.join(tool_dir, 'calls-{}.log'.format(size))
+            open(log, 'w').close()
+            env = dict(os.environ, TCCPROFILE_TOOL_DIR=tool_dir,
+                       TCCPROFILE_BENCH_LOG=log)
+
+            cmd = [sys.executable, os.path.abspath(__file__),
+                   '--run-one', str(size)]
+            if args.jobs:
+                cmd.extend(['--jobs', str(args.jobs)])
+            result = json.loads(subprocess.check_output(cmd, env=env))
+            results.append(result)
+
+            print('{apps:>6} apps: build {build_s:7.2f} s, write {write_s:6.3f} '
+                  's, sign {sign_s:6.3f} s, {subprocesses} subprocesses, peak '
+                  'RSS {peak_rss_kb} KB'.format(**result))
+    finally:
+        shutil.rmtree(tool_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'latency': args.latency,
+                'jobs': args.jobs or tccprofile.cpu_count(),
+                'results': results,
+            }, f, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
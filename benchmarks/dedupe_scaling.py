@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Shows how build_profile scales with the number of Services entries.
+
+Identities are seeded into the resolver, so this measures only assembling
+and de-duplicating entries (no codesign). Every app is listed twice to
+exercise the duplicate check. With indexed de-duplication the time per
+entry should stay flat as the profile grows.
+
+    ./benchmarks/dedupe_scaling.py [--sizes 1000,5000,10000,20000,50000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+
+
+def build(count):
+    profile = tccprofile.PrivacyProfiles(
+        payload_description='Benchmark', payload_name='Benchmark',
+        payload_identifier='com.example.benchmark',
+        payload_organization='Benchmark', payload_version=1,
+        sign_cert=None, filename=None)
+
+    apps = ['/Applications/App{:06d}.app'.format(i) for i in range(count)]
+    for app in apps:
+        profile.resolver.seed(tccprofile.AppIdentity(
+            path=app, mime_type='directory',
+            identifier='com.example.{}'.format(os.path.basename(app)),
+            identifier_type='bundleID',
+            code_requirement='identifier "com.example.{}" and anchor apple '
+                             'generic'.format(os.path.basename(app))))
+
+    profile.set_services_dict({'Accessibility': apps + apps})
+
+    start = time.time()
+    profile.build_profile(allow=True)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,5000,10000,20000,50000')
+    args = parser.parse_args()
+
+    print('{:>10} {:>12} {:>14}'.format('entries', 'build ms', 'us/entry'))
+    for size in [int(i) for i in args.sizes.split(',')]:
+        elapsed = build(size)
+        print('{:>10} {:>12.1f} {:>14.2f}'.format(
+            size, elapsed * 1000, elapsed * 1e6 / (size * 2)))
+
+
+if __name__ == '__main__':
+    main()
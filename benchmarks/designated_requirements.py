@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Checks tccprofile's in-process designated requirement reader against
+`codesign -d -r-`, and times both.
+
+By default the corpus is every app under /Applications,
+/System/Applications and /System/Library/CoreServices plus the binaries in
+/bin and /usr/bin. Pass paths to check others. Needs macOS (for codesign).
+
+    ./benchmarks/designated_requirements.py [paths...]
+
+Every app whose requirement differs is listed, and the script exits 1 if
+there are any.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+
+DEFAULT_PATHS = [
+    '/Applications/*.app',
+    '/Applications/*/*.app',
+    '/System/Applications/*.app',
+    '/System/Library/CoreServices/*.app',
+    '/bin/*',
+    '/usr/bin/*',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='*')
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(
+        path for pattern in DEFAULT_PATHS for path in glob.glob(pattern))
+    resolver = tccprofile.IdentityResolver(native=False)
+
+    native_s = codesign_s = 0.0
+    checked = implicit = 0
+    mismatches = list()
+    for path in paths:
+        start = time.time()
+        native = tccprofile.read_designated_requirement(path)
+        native_s += time.time() - start
+        if native is None:
+            # Unsigned, or no explicit requirement (codesign synthesises one)
+            implicit += 1
+            continue
+
+        start = time.time()
+        try:
+            expected = resolver._get_code_sign_requirements(path)
+        except (tccprofile.TCCProfileException, OSError, IndexError):
+            expected = None
+        codesign_s += time.time() - start
+
+        checked += 1
+        if native != expected:
+            mismatches.append((path, native, expected))
+
+    for path, native, expected in mismatches:
+        print('{}\n    native:   {}\n    codesign: {}'.format(
+            path, native, expected))
+
+    print('{} of {} paths have an explicit designated requirement, {} differ '
+          'from codesign ({} skipped)'.format(
+              checked, len(paths), len(mismatches), implicit))
+    print('native reader {:.3f} s, codesign {:.3f} s'.format(
+        native_s, codesign_s))
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Measures the cold start cost of importing tccprofile.
+
+Each case runs in a fresh interpreter, so the numbers include interpreter
+startup. Compare 'import tccprofile' against the bare interpreter, and
+against importing the GUI and PyObjC modules the CLI no longer loads.
+
+    ./benchmarks/import_time.py [--runs 20]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ('bare interpreter', 'pass'),
+    ('import tccprofile', 'import tccprofile'),
+    ('import tccprofile + GUI', 'import tccprofile; tccprofile.load_gui()'),
+    ('import Tkinter, AppKit, Foundation',
+     'import Tkinter, ttk, tkFileDialog, AppKit, Foundation'),
+]
+
+
+def time_statement(statement, runs):
+    """Returns the sorted wall times of running statement in a new
+    interpreter, or None if it fails (e.g. no PyObjC off macOS).
+    """
+    timings = list()
+    for _ in range(runs):
+        start = time.time()
+        returncode = subprocess.call(
+            [sys.executable, '-c', statement], cwd=REPO,
+            stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        if returncode != 0:
+            return None
+        timings.append(time.time() - start)
+
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    print('{:<40} {:>10} {:>10}'.format('case', 'median ms', 'min ms'))
+    for name, statement in CASES:
+        timings = time_statement(statement, args.runs)
+        if timings is None:
+            print('{:<40} {:>10}'.format(name, 'n/a'))
+            continue
+
+        print('{:<40} {:>10.1f} {:>10.1f}'.format(
+            name, timings[len(timings) // 2] * 1000, timings[0] * 1000))
+
+
+if __name__ == '__main__':
+    main()
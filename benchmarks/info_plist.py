@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Compares ways of reading CFBundleIdentifier from app Info.plists.
+
+By default the corpus is every Contents/Info.plist under /Applications,
+/System/Applications and /System/Library/CoreServices. Pass directories to
+scan others, or --synthetic N to generate XML plists (useful off macOS).
+
+    ./benchmarks/info_plist.py [--rounds 5] [--synthetic 500] [dirs...]
+"""
+
+import argparse
+import glob
+import os
+import plistlib
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+
+DEFAULT_DIRS = [
+    '/Applications',
+    '/System/Applications',
+    '/System/Library/CoreServices',
+]
+
+
+def find_corpus(dirs):
+    corpus = list()
+    for directory in dirs:
+        corpus.extend(glob.glob(os.path.join(directory, '*.app/Contents/Info.plist')))
+        corpus.extend(glob.glob(os.path.join(directory, '*/*.app/Contents/Info.plist')))
+
+    return sorted(corpus)
+
+
+def make_synthetic_corpus(count):
+    directory = tempfile.mkdtemp(prefix='tccprofile-plists-')
+    for i in range(count):
+        info = {
+            'CFBundleIdentifier': 'com.example.app{}'.format(i),
+            'CFBundleVersion': '1.0.{}'.format(i),
+            'CFBundleExecutable': 'App{}'.format(i),
+            'CFBundleDocumentTypes': [
+                {'CFBundleTypeName': 'Document {}'.format(n),
+                 'CFBundleTypeExtensions': ['ext{}'.format(n)]}
+                for n in range(50)
+            ],
+        }
+        plistlib.writePlist(info, os.path.join(directory, '{}.plist'.format(i)))
+
+    return directory, sorted(glob.glob(os.path.join(directory, '*.plist')))
+
+
+def foundation_reader(path):
+    from Foundation import NSDictionary
+    return NSDictionary.dictionaryWithContentsOfFile_(path)[
+        'CFBundleIdentifier']
+
+
+def cold_reader(path):
+    tccprofile._info_plist_cache.clear()
+    return tccprofile.read_info_plist(path)['CFBundleIdentifier']
+
+
+def warm_reader(path):
+    return tccprofile.read_info_plist(path)['CFBundleIdentifier']
+
+
+def plistlib_reader(path):
+    return plistlib.readPlist(path)['CFBundleIdentifier']
+
+
+def bench(reader, corpus, rounds):
+    """Returns the best time in seconds to read the whole corpus, or None if
+    the reader cannot handle it.
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.time()
+        try:
+            for path in corpus:
+                reader(path)
+        except Exception:
+            return None
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dirs', nargs='*')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--synthetic', type=int, default=0)
+    args = parser.parse_args()
+
+    tmpdir = None
+    if args.synthetic:
+        tmpdir, corpus = make_synthetic_corpus(args.synthetic)
+    else:
+        corpus = find_corpus(args.dirs or DEFAULT_DIRS)
+
+    if not corpus:
+        sys.exit('No Info.plists found, try --synthetic N')
+
+    try:
+        import Foundation  # NOQA
+        has_foundation = True
+    except ImportError:
+        has_foundation = False
+
+    readers = [
+        ('read_info_plist (cold)', cold_reader),
+        ('read_info_plist (cached)', warm_reader),
+        ('plistlib.readPlist (XML only)', plistlib_reader),
+    ]
+    if has_foundation:
+        readers.insert(0, ('NSPropertyListSerialization', foundation_reader))
+
+    print('{} Info.plists, best of {} rounds'.format(len(corpus), args.rounds))
+    print('{:<32} {:>10} {:>12}'.format('reader', 'total ms', 'us/plist'))
+    try:
+        for name, reader in readers:
+            elapsed = bench(reader, corpus, args.rounds)
+            if elapsed is None:
+                print('{:<32} {:>10}'.format(name, 'failed'))
+            else:
+                print('{:<32} {:>10.1f} {:>12.1f}'.format(
+                    name, elapsed * 1000, elapsed * 1e6 / len(corpus)))
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Measures the latency and throughput of `tccprofile.py serve`.
+
+Sends --requests profile requests from --concurrency client threads and
+reports requests per second and latency percentiles. Each request asks for
+a random --apps-per-profile sample of the corpus, so concurrent requests
+often share apps.
+
+Without --url or --socket a server is started against a synthetic corpus and
+stub tools (see build_profile.py), which runs on Linux:
+
+    ./benchmarks/load_test.py [--corpus 200] [--latency 0.005]
+        [--concurrency 8] [--requests 500]
+
+To load an already running server, pass its address and real app paths:
+
+    ./benchmarks/load_test.py --url http://127.0.0.1:8765 \
+        --apps /Applications/*.app
+"""
+
+import argparse
+import httplib
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+from build_profile import make_corpus, make_tools
+
+TCCPROFILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tccprofile.py')
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """HTTPConnection over a Unix socket."""
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+def connect(args):
+    if args.socket:
+        return UnixHTTPConnection(args.socket)
+
+    url = urlparse.urlparse(args.url)
+    return httplib.HTTPConnection(url.hostname, url.port)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_clients(args, apps):
+    latencies = list()
+    errors = list()
+    lock = threading.Lock()
+    remaining = [args.requests]
+
+    def client():
+        connection = connect(args)
+        while True:
+            with lock:
+                if not remaining[0]:
+                    break
+                remaining[0] -= 1
+
+            body = json.dumps({
+                'payload_description': 'Load test',
+                'payload_name': 'Load test',
+                'payload_identifier': 'com.example.loadtest',
+                'payload_organization': 'Example',
+                'payload_version': 1,
+                'services': {'Accessibility': random.sample(
+                    apps, min(args.apps_per_profile, len(apps)))},
+            })
+
+            start = time.time()
+            connection.request('POST', '/profile', body,
+                               {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            data = response.read()
+            elapsed = time.time() - start
+
+            with lock:
+                latencies.append(elapsed)
+                if response.status != 200:
+                    errors.append(data)
+
+    threads = [threading.Thread(target=client)
+               for _ in range(args.concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return time.time() - start, sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default=None,
+                        help='Address of a running server.')
+    parser.add_argument('--socket', default=None,
+                        help='Unix socket of a running server.')
+    parser.add_argument('--apps', nargs='*', default=None,
+                        help='App paths to request, for a running server.')
+    parser.add_argument('--corpus', type=int, default=200,
+                        help='Synthetic apps to create when starting a server.')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Seconds each stub tool call takes.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--apps-per-profile', type=int, default=10)
+    args = parser.parse_args()
+
+    tmpdir = None
+    server = None
+    try:
+        if args.url or args.socket:
+            apps = args.apps
+            if not apps:
+                parser.error('--apps is required with --url or --socket')
+        else:
+            tmpdir = tempfile.mkdtemp(prefix='tccprofile-load-')
+            tool_dir = os.path.join(tmpdir, 'tools')
+            os.mkdir(tool_dir)
+            make_tools(tool_dir, args.latency)
+            apps = make_corpus(os.path.join(tmpdir, 'apps'), args.corpus)
+
+            args.socket = os.path.join(tmpdir, 'serve.sock')
+            env = dict(os.environ, TCCPROFILE_TOOL_DIR=tool_dir,
+                       TCCPROFILE_BENCH_LOG=os.path.join(tmpdir, 'calls.log'))
+            server = subprocess.Popen(
+                [sys.executable, TCCPROFILE, 'serve', '--socket', args.socket,
+                 '--no-cache'], env=env, stderr=subprocess.PIPE)
+            # Wait for the "Serving on" line
+            server.stderr.readline()
+
+        wall, latencies, errors = run_clients(args, apps)
+
+        connection = connect(args)
+        connection.request('GET', '/stats')
+        stats = json.loads(connection.getresponse().read())
+
+        print('{} requests in {:.2f} s: {:.1f} requests/s, {} errors'.format(
+            len(latencies), wall, len(latencies) / wall, len(errors)))
+        print('latency p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, '
+              'max {:.1f} ms'.format(*[
+                  percentile(latencies, f) * 1000
+                  for f in [0.5, 0.95, 0.99, 1.0]]))
+        print('server inspected {inspections} apps, reused results {saved} '
+              'times'.format(**stats))
+        if errors:
+            print('first error: {}'.format(errors[0]))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Times RequirementsDatabase imports and lookups at a given size.
+
+Lookups are a random mix of app paths and bundle IDs and should stay well
+under a millisecond each, even with 100,000 records.
+
+    ./benchmarks/requirements_db.py [--records 100000] [--lookups 20000]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='tccprofile-db-')
+    try:
+        database = tccprofile.RequirementsDatabase(
+            os.path.join(tmpdir, 'requirements.sqlite'))
+
+        records = (json.dumps({
+            'path': '/Applications/App{:06d}.app'.format(i),
+            'identifier': 'com.example.app{}'.format(i),
+            'identifier_type': 'bundleID',
+            'code_requirement': 'identifier "com.example.app{}" and anchor '
+                                'apple generic'.format(i),
+        }) for i in range(args.records))
+
+        start = time.time()
+        database.import_scan(records)
+        print('import {} records: {:.2f} s'.format(
+            args.records, time.time() - start))
+
+        keys = list()
+        for _ in range(args.lookups // 2):
+            i = random.randrange(args.records)
+            keys.append('/Applications/App{:06d}.app'.format(i))
+            keys.append('com.example.app{}'.format(i))
+
+        start = time.time()
+        for key in keys:
+            database.lookup(key)
+        elapsed = time.time() - start
+        print('{} lookups: {:.1f} us/lookup'.format(
+            len(keys), elapsed * 1e6 / len(keys)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
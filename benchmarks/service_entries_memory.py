@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Measures the memory held by the Services entries of very large profiles.
+
+Builds a profile with --entries entries, one per app for each payload type
+other than AppleEvents, from synthetic app identities seeded into the
+resolver, so nothing is inspected and it runs anywhere. Every 10th app is a
+script whose requirement is that of /bin/bash, read separately for each
+script as it would be from codesign or the cache.
+
+Each representation runs in its own process and reports how much its peak
+RSS grew while building, and how long building and serialising took:
+
+    ./benchmarks/service_entries_memory.py [--entries 50000]
+        [--output results.json]
+
+`slots` is ServiceEntry with interned strings (what PrivacyProfiles builds).
+`dicts` is the previous representation: a dict per entry and no interning.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+
+BASH_REQUIREMENT = 'identifier "com.apple.bash" and anchor apple'
+
+MODES = ['slots', 'dicts']
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def make_identities(count):
+    """Returns count AppIdentity records. Requirement strings are built one
+    at a time, so equal requirements are separate objects until interned.
+    """
+    identities = list()
+    for i in range(count):
+        name = 'App{:05d}'.format(i)
+        if i % 10 == 9:
+            path = '/usr/local/bin/{}.sh'.format(name)
+            identities.append(tccprofile.AppIdentity(
+                path=path, mime_type='x-shellscript', identifier=path,
+                identifier_type='path',
+                code_requirement=''.join(list(BASH_REQUIREMENT))))
+        else:
+            identifier = 'com.example.{}'.format(name)
+            identities.append(tccprofile.AppIdentity(
+                path='/Applications/{}.app'.format(name),
+                mime_type='x-mach-binary', identifier=identifier,
+                identifier_type='bundleID',
+                code_requirement='identifier "{}" and anchor apple generic '
+                                 'and certificate leaf[subject.OU] = '
+                                 '"ABCDE12345"'.format(identifier)))
+
+    return identities
+
+
+def run_one(entries, mode):
+    """Benchmarks one representation in this process and prints the result."""
+    if mode == 'dicts':
+        tccprofile._intern = lambda value: value
+
+    payloads = [p for p in tccprofile.PrivacyProfiles.PAYLOADS
+                if p != 'AppleEvents']
+    identities = make_identities(max(1, entries // len(payloads)))
+
+    resolver = tccprofile.IdentityResolver()
+    for identity in identities:
+        resolver.seed(identity)
+
+    profile = tccprofile.PrivacyProfiles(
+        payload_description='Benchmark', payload_name='Benchmark',
+        payload_identifier='com.example.benchmark',
+        payload_organization='Example', payload_version=1, sign_cert=None,
+        filename=None, resolver=resolver)
+    profile.set_services_dict(
+        {payload: [identity.path for identity in identities]
+         for payload in payloads})
+
+    result = {'mode': mode}
+    baseline = peak_rss_kb()
+
+    start = time.time()
+    profile.build_profile(allow=True)
+    if mode == 'dicts':
+        services = profile.template['PayloadContent'][0]['Services']
+        for payload in services:
+            services[payload] = [entry.to_dict() for entry in services[payload]]
+    result['build_s'] = time.time() - start
+
+    result['entries'] = sum(
+        len(entries) for entries in
+        profile.template['PayloadContent'][0]['Services'].values())
+    result['build_rss_kb'] = peak_rss_kb() - baseline
+
+    start = time.time()
+    result['profile_bytes'] = len(profile.to_bytes())
+    result['serialize_s'] = time.time() - start
+
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--run-one', choices=MODES, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.entries, args.run_one)
+        return
+
+    results = list()
+    for mode in MODES:
+        result = json.loads(subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--run-one', mode,
+             '--entries', str(args.entries)]))
+        results.append(result)
+
+        print('{mode:>5}: {entries} entries, build {build_s:6.2f} s, '
+              'serialize {serialize_s:6.2f} s, RSS +{build_rss_kb} KB'.format(
+                  **result))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, f, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,27 +2,36 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import atexit
+import contextlib
+import cStringIO
+import csv
 import errno
+import functools
+import hashlib
+import json
+import mmap
 import os
+import platform
 import plistlib
 import uuid
+import xml.etree.cElementTree as ElementTree
+from collections import namedtuple
 import re
+import struct
+import sqlite3
+import stat
 import subprocess
 import sys
-import Tkinter as tk
-import ttk
-import tkFileDialog
-
-# Imports specifically for FoundationPlist
-# PyLint cannot properly find names inside Cocoa libraries, so issues bogus
-# No name 'Foo' in module 'Bar' warnings. Disable them.
-# pylint: disable=E0611
-import AppKit
-from Foundation import NSData  # NOQA
-from Foundation import NSPropertyListSerialization  # NOQA
-from Foundation import NSPropertyListMutableContainers  # NOQA
-from Foundation import NSPropertyListXMLFormat_v1_0  # NOQA
-# pylint: enable=E0611
+import tempfile
+import threading
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+# Tkinter and AppKit are imported where they are used (see load_gui), so the
+# CLI starts quickly and the script can be imported on hosts without a GUI or
+# PyObjC.
 
 # from pprint import pprint  # NOQA
 
@@ -44,900 +53,4720 @@ class TCCProfileException(Exception):
     pass
 
 
-class App(tk.Frame):
-    def __init__(self, master):
-        tk.Frame.__init__(self, master)
-        self.pack()
-        self.master.title("TCC Profile Generator")
-        self.master.resizable(False, False)
-        self.master.tk_setPalette(background='#ececec')
+class UnsignedCodeException(TCCProfileException):
+    """An app (or a script's interpreter) is not code signed"""
+    pass
 
-        self.master.protocol('WM_DELETE_WINDOW', self.click_quit)
-        self.master.bind('<Return>', self.click_save)
-        self.master.bind('<Escape>', self.click_quit)
 
-        x = (self.master.winfo_screenwidth() - self.master.winfo_reqwidth()) / 2
-        y = (self.master.winfo_screenheight() - self.master.winfo_reqheight()) / 4
-        self.master.geometry("+{}+{}".format(x, y))
+def load_gui():
+    """Imports Tkinter and returns the GUI's App class."""
+    import Queue
+    import Tkinter as tk
+    import ttk
+    import tkFileDialog
 
-        self.master.config(menu=tk.Menu(self.master))
+    class App(tk.Frame):
+        def __init__(self, master):
+            tk.Frame.__init__(self, master)
+            self.pack()
+            self.master.title("TCC Profile Generator")
+            self.master.resizable(False, False)
+            self.master.tk_setPalette(background='#ececec')
 
-        # Payload Details UI
+            self.master.protocol('WM_DELETE_WINDOW', self.click_quit)
+            self.master.bind('<Return>', self.click_save)
+            self.master.bind('<Escape>', self.click_quit)
 
-        payload_frame = tk.Frame(self)
-        payload_frame.pack(padx=15, pady=15, fill=tk.BOTH)
+            x = (self.master.winfo_screenwidth() - self.master.winfo_reqwidth()) / 2
+            y = (self.master.winfo_screenheight() - self.master.winfo_reqheight()) / 4
+            self.master.geometry("+{}+{}".format(x, y))
 
-        tk.Label(
-            payload_frame,
-            text='Payload Details',
-            font=('System', 18)
-        ).grid(row=0, column=0, columnspan=5, sticky='w')
+            self.master.config(menu=tk.Menu(self.master))
 
-        tk.Label(payload_frame, text="Name").grid(
-            row=1, column=0, sticky='w'
-        )
-        self._payload_name = tk.Entry(payload_frame, bg='white', width=30)
-        self._payload_name.insert(0, 'TCC Whitelist')
-        self._payload_name.grid(row=2, column=0, columnspan=2, sticky='we')
-
-        # This is an empty spacer for the grid layout of the frame
-        tk.Label(
-            payload_frame,
-            text='',
-            width=6
-        ).grid(row=1, column=2)
-
-        tk.Label(payload_frame, text="Organization").grid(
-            row=1, column=3, sticky='w'
-        )
-        self._payload_org = tk.Entry(payload_frame, bg='white', width=30)
-        self._payload_org.insert(0, 'My Org Name')
-        self._payload_org.grid(row=2, column=3, columnspan=2, sticky='we')
+            # Apps are inspected in the background as soon as they are added,
+            # so saving mostly reuses finished work and never blocks the UI
+            self._resolver = IdentityResolver(cache=RequirementsCache())
+            self._pool = ThreadPool(cpu_count())
+            self._progress_events = Queue.Queue()
+            self._build = None
 
-        tk.Label(payload_frame, text="Identifier").grid(
-            row=3, column=0, sticky='w'
-        )
-        self._payload_id = tk.Entry(payload_frame, bg='white')
-        self._payload_id.insert(0, 'com.my.tccprofile')
-        self._payload_id.grid(row=4, column=0, columnspan=2, sticky='we')
+            # Payload Details UI
 
-        tk.Label(payload_frame, text="Version").grid(
-            row=3, column=3, sticky='w'
-        )
-        self._payload_version = tk.Entry(payload_frame, bg='white')
-        self._payload_version.insert(0, '1')
-        self._payload_version.grid(row=4, column=3, columnspan=2, sticky='we')
+            payload_frame = tk.Frame(self)
+            payload_frame.pack(padx=15, pady=15, fill=tk.BOTH)
 
-        tk.Label(payload_frame, text="Description").grid(
-            row=5, column=0, sticky='w'
-        )
-        self._payload_desc = tk.Entry(payload_frame, bg='white')
-        self._payload_desc.insert(0, 'TCC Whitelist for various applications')
-        self._payload_desc.grid(row=6, column=0, columnspan=5, sticky='we')
+            tk.Label(
+                payload_frame,
+                text='Payload Details',
+                font=('System', 18)
+            ).grid(row=0, column=0, columnspan=5, sticky='w')
 
-        self._payload_sign = tk.StringVar()
-        self._payload_sign.set('No')
+            tk.Label(payload_frame, text="Name").grid(
+                row=1, column=0, sticky='w'
+            )
+            self._payload_name = tk.Entry(payload_frame, bg='white', width=30)
+            self._payload_name.insert(0, 'TCC Whitelist')
+            self._payload_name.grid(row=2, column=0, columnspan=2, sticky='we')
+
+            # This is an empty spacer for the grid layout of the frame
+            tk.Label(
+                payload_frame,
+                text='',
+                width=6
+            ).grid(row=1, column=2)
+
+            tk.Label(payload_frame, text="Organization").grid(
+                row=1, column=3, sticky='w'
+            )
+            self._payload_org = tk.Entry(payload_frame, bg='white', width=30)
+            self._payload_org.insert(0, 'My Org Name')
+            self._payload_org.grid(row=2, column=3, columnspan=2, sticky='we')
 
-        tk.Label(payload_frame, text="Sign Profile?").grid(
-            row=7, column=0, sticky='e'
-        )
-        tk.OptionMenu(
-            payload_frame,
-            self._payload_sign,
-            *self._list_signing_certs()
-        ).grid(row=7, column=1, columnspan=4, sticky='we')
+            tk.Label(payload_frame, text="Identifier").grid(
+                row=3, column=0, sticky='w'
+            )
+            self._payload_id = tk.Entry(payload_frame, bg='white')
+            self._payload_id.insert(0, 'com.my.tccprofile')
+            self._payload_id.grid(row=4, column=0, columnspan=2, sticky='we')
 
-        # UI Feedback Section
+            tk.Label(payload_frame, text="Version").grid(
+                row=3, column=3, sticky='w'
+            )
+            self._payload_version = tk.Entry(payload_frame, bg='white')
+            self._payload_version.insert(0, '1')
+            self._payload_version.grid(row=4, column=3, columnspan=2, sticky='we')
 
-        feedback_frame = tk.Frame(self)
-        feedback_frame.pack(padx=15, fill=tk.BOTH)
+            tk.Label(payload_frame, text="Description").grid(
+                row=5, column=0, sticky='w'
+            )
+            self._payload_desc = tk.Entry(payload_frame, bg='white')
+            self._payload_desc.insert(0, 'TCC Whitelist for various applications')
+            self._payload_desc.grid(row=6, column=0, columnspan=5, sticky='we')
 
-        self._feedback_label = tk.Label(
-            feedback_frame,
-            font=("System", 12, "italic"),
-            fg='red'
-        )
-        self._feedback_label.grid(row=0, column=0, sticky='we')
+            self._payload_sign = tk.StringVar()
+            self._payload_sign.set('No')
 
-        # Services UI
+            tk.Label(payload_frame, text="Sign Profile?").grid(
+                row=7, column=0, sticky='e'
+            )
+            # Certificates are filled in once the window is up, see
+            # _load_signing_certs
+            self._sign_menu = tk.OptionMenu(
+                payload_frame,
+                self._payload_sign,
+                'No'
+            )
+            self._sign_menu.grid(row=7, column=1, columnspan=3, sticky='we')
+            tk.Button(
+                payload_frame,
+                text='Refresh',
+                command=lambda: self._load_signing_certs(refresh=True)
+            ).grid(row=7, column=4, sticky='e')
+            self._certs_lookup = None
+
+            # UI Feedback Section
+
+            feedback_frame = tk.Frame(self)
+            feedback_frame.pack(padx=15, fill=tk.BOTH)
+
+            self._feedback_label = tk.Label(
+                feedback_frame,
+                font=("System", 12, "italic"),
+                fg='red'
+            )
+            self._feedback_label.grid(row=0, column=0, sticky='we')
 
-        services_frame = tk.Frame(self)
-        services_frame.pack(padx=15, pady=15, fill=tk.BOTH)
+            # Only shown while a profile is being saved
+            self._progress = ttk.Progressbar(
+                feedback_frame,
+                mode='determinate',
+                length=300
+            )
 
-        self._services_target_var = tk.StringVar()
-        self._services_target_var_display = tk.StringVar()
+            # Services UI
 
-        tk.Label(
-            services_frame,
-            text='Setup Service Permissions',
-            font=('System', 18)
-        ).grid(row=0, column=0, columnspan=5, sticky='w')
+            services_frame = tk.Frame(self)
+            services_frame.pack(padx=15, pady=15, fill=tk.BOTH)
 
-        tk.Label(services_frame, text="Target App...").grid(
-            row=1, column=0, sticky='w'
-        )
-        self.app_env_source_btn = tk.Button(
-            services_frame,
-            text='Choose...',
-            command=lambda: self._app_picker('_services_target_var')
-        )
-        self.app_env_source_btn.grid(row=2, column=0, sticky='w')
-
-        tk.Label(
-            services_frame,
-            textvariable=self._services_target_var_display,
-            width=16
-        ).grid(row=2, column=1, sticky='w')
-
-        self._available_services = {
-            'AddressBook': True,
-            'Calendar': True,
-            'Reminders': True,
-            'Photos': True,
-            'Camera': False,
-            'Microphone': False,
-            'Accessibility': True,
-            'PostEvent': True,
-            'SystemPolicyAllFiles': True,
-            'SystemPolicySysAdminFiles': True
-        }
+            self._services_target_var = tk.StringVar()
+            self._services_target_var_display = tk.StringVar()
 
-        self._selected_service = tk.StringVar()
-        self._selected_service.set('AddressBook')
+            tk.Label(
+                services_frame,
+                text='Setup Service Permissions',
+                font=('System', 18)
+            ).grid(row=0, column=0, columnspan=5, sticky='w')
 
-        tk.Label(services_frame, text="Service...").grid(
-            row=1, column=2, sticky='w'
-        )
-        tk.OptionMenu(
-            services_frame,
-            self._selected_service,
-            *sorted([i for i in self._available_services.keys()])
-        ).grid(row=2, column=2, sticky='w')
-
-        # This is an empty spacer for the grid layout of the frame
-        tk.Label(
-            services_frame,
-            text='',
-            width=6
-        ).grid(row=2, column=3)
-
-        tk.Button(
-            services_frame,
-            text='Add +',
-            command=self._add_service
-        ).grid(row=2, column=4, sticky='e')
-
-        self.services_table = ttk.Treeview(
-            services_frame,
-            columns=('target', 'service', 'allow_deny'),
-            height=5
-        )
-        self.services_table['show'] = 'headings'
-        self.services_table.heading('target', text='Target')
-        self.services_table.heading('service', text='Service')
-        self.services_table.heading('allow_deny', text='Allow/Deny')
-        self.services_table.grid(row=3, column=0, columnspan=5, sticky='we')
-
-        # Apple Events UI
-
-        apple_events_frame = tk.Frame(self)
-        apple_events_frame.pack(padx=15, pady=15, fill=tk.BOTH)
-
-        self._app_env_source_var = tk.StringVar()
-        self._app_env_target_var = tk.StringVar()
-        self._app_env_source_var_display = tk.StringVar()
-        self._app_env_target_var_display = tk.StringVar()
-
-        tk.Label(
-            apple_events_frame,
-            text='Setup Apple Events',
-            font=('System', 18)
-        ).grid(row=0, column=0, columnspan=5, sticky='w')
-
-        tk.Label(apple_events_frame, text="Source App...").grid(
-            row=1, column=0, sticky='w'
-        )
+            tk.Label(services_frame, text="Target App...").grid(
+                row=1, column=0, sticky='w'
+            )
+            self.app_env_source_btn = tk.Button(
+                services_frame,
+                text='Choose...',
+                command=lambda: self._app_picker('_services_target_var')
+            )
+            self.app_env_source_btn.grid(row=2, column=0, sticky='w')
+
+            tk.Label(
+                services_frame,
+                textvariable=self._services_target_var_display,
+                width=16
+            ).grid(row=2, column=1, sticky='w')
+
+            self._available_services = {
+                'AddressBook': True,
+                'Calendar': True,
+                'Reminders': True,
+                'Photos': True,
+                'Camera': False,
+                'Microphone': False,
+                'Accessibility': True,
+                'PostEvent': True,
+                'SystemPolicyAllFiles': True,
+                'SystemPolicySysAdminFiles': True
+            }
 
-        self.app_env_source_btn = tk.Button(
-            apple_events_frame,
-            text='Choose...',
-            command=lambda: self._app_picker('_app_env_source_var')
-        )
-        self.app_env_source_btn.grid(row=2, column=0, sticky='w')
+            self._selected_service = tk.StringVar()
+            self._selected_service.set('AddressBook')
 
-        tk.Label(
-            apple_events_frame,
-            textvariable=self._app_env_source_var_display,
-            width=20
-        ).grid(row=2, column=1, sticky='w')
+            tk.Label(services_frame, text="Service...").grid(
+                row=1, column=2, sticky='w'
+            )
+            tk.OptionMenu(
+                services_frame,
+                self._selected_service,
+                *sorted([i for i in self._available_services.keys()])
+            ).grid(row=2, column=2, sticky='w')
+
+            # This is an empty spacer for the grid layout of the frame
+            tk.Label(
+                services_frame,
+                text='',
+                width=6
+            ).grid(row=2, column=3)
+
+            tk.Button(
+                services_frame,
+                text='Add +',
+                command=self._add_service
+            ).grid(row=2, column=4, sticky='e')
+
+            self.services_table = ttk.Treeview(
+                services_frame,
+                columns=('target', 'service', 'allow_deny'),
+                height=5
+            )
+            self.services_table['show'] = 'headings'
+            self.services_table.heading('target', text='Target')
+            self.services_table.heading('service', text='Service')
+            self.services_table.heading('allow_deny', text='Allow/Deny')
+            self.services_table.grid(row=3, column=0, columnspan=5, sticky='we')
+
+            # Apple Events UI
+
+            apple_events_frame = tk.Frame(self)
+            apple_events_frame.pack(padx=15, pady=15, fill=tk.BOTH)
+
+            self._app_env_source_var = tk.StringVar()
+            self._app_env_target_var = tk.StringVar()
+            self._app_env_source_var_display = tk.StringVar()
+            self._app_env_target_var_display = tk.StringVar()
+
+            tk.Label(
+                apple_events_frame,
+                text='Setup Apple Events',
+                font=('System', 18)
+            ).grid(row=0, column=0, columnspan=5, sticky='w')
+
+            tk.Label(apple_events_frame, text="Source App...").grid(
+                row=1, column=0, sticky='w'
+            )
 
-        tk.Label(apple_events_frame, text="Target App...").grid(
-            row=1, column=2, sticky='w'
-        )
+            self.app_env_source_btn = tk.Button(
+                apple_events_frame,
+                text='Choose...',
+                command=lambda: self._app_picker('_app_env_source_var')
+            )
+            self.app_env_source_btn.grid(row=2, column=0, sticky='w')
 
-        self.app_env_target_btn = tk.Button(
-            apple_events_frame,
-            text='Choose...',
-            command=lambda: self._app_picker('_app_env_target_var')
-        )
-        self.app_env_target_btn.grid(row=2, column=2, sticky='w')
-
-        tk.Label(
-            apple_events_frame,
-            textvariable=self._app_env_target_var_display,
-            width=20
-        ).grid(row=2, column=3, sticky='w')
-
-        tk.Button(
-            apple_events_frame,
-            text='Add +',
-            command=self._add_apple_event
-        ).grid(row=2, column=4, sticky='e')
-
-        self.app_env_table = ttk.Treeview(
-            apple_events_frame, columns=('source', 'target'), height=5
-        )
-        self.app_env_table['show'] = 'headings'
-        self.app_env_table.heading('source', text='Source')
-        self.app_env_table.heading('target', text='Target')
-        self.app_env_table.grid(row=3, column=0, columnspan=5, sticky='we')
+            tk.Label(
+                apple_events_frame,
+                textvariable=self._app_env_source_var_display,
+                width=20
+            ).grid(row=2, column=1, sticky='w')
 
-        # Bottom frame for "Save' and 'Quit' buttons
-        button_frame = tk.Frame(self)
-        button_frame.pack(padx=15, pady=(0, 15), anchor='e')
+            tk.Label(apple_events_frame, text="Target App...").grid(
+                row=1, column=2, sticky='w'
+            )
 
-        tk.Button(button_frame, text='Save', command=self.click_save).pack(
-            side='right'
-        )
-        tk.Button(button_frame, text='Quit', command=self.click_quit).pack(
-            side='right'
-        )
+            self.app_env_target_btn = tk.Button(
+                apple_events_frame,
+                text='Choose...',
+                command=lambda: self._app_picker('_app_env_target_var')
+            )
+            self.app_env_target_btn.grid(row=2, column=2, sticky='w')
+
+            tk.Label(
+                apple_events_frame,
+                textvariable=self._app_env_target_var_display,
+                width=20
+            ).grid(row=2, column=3, sticky='w')
+
+            tk.Button(
+                apple_events_frame,
+                text='Add +',
+                command=self._add_apple_event
+            ).grid(row=2, column=4, sticky='e')
+
+            self.app_env_table = ttk.Treeview(
+                apple_events_frame, columns=('source', 'target'), height=5
+            )
+            self.app_env_table['show'] = 'headings'
+            self.app_env_table.heading('source', text='Source')
+            self.app_env_table.heading('target', text='Target')
+            self.app_env_table.grid(row=3, column=0, columnspan=5, sticky='we')
 
-    def click_save(self, event=None):
-        print("The user clicked 'Save'")
+            # Bottom frame for "Save' and 'Quit' buttons
+            button_frame = tk.Frame(self)
+            button_frame.pack(padx=15, pady=(0, 15), anchor='e')
 
-        payload = dict()
-        payload['Description'] = self._payload_desc.get()
-        payload['Name'] = self._payload_name.get()
-        payload['Identifier'] = self._payload_id.get()
-        payload['Organization'] = self._payload_org.get()
+            self._save_button = tk.Button(
+                button_frame, text='Save', command=self.click_save
+            )
+            self._save_button.pack(side='right')
 
-        for k, v in payload.items():
-            if not v:
-                self._feedback_label['text'] = \
-                    "Missing input for '{}'".format(k)
+            self.after_idle(self._load_signing_certs)
+            tk.Button(button_frame, text='Quit', command=self.click_quit).pack(
+                side='right'
+            )
+
+        def click_save(self, event=None):
+            print("The user clicked 'Save'")
+
+            if self._build and not self._build.done():
                 return
 
-        # The 'PayloadVersion' key MUST be an Integer value
-        _version = self._payload_version.get()
-        try:
-            if float(_version).is_integer():
-                version = int(_version)
-            else:
-                raise ValueError
-        except ValueError:
-            print('Invalid payload version')
-            self._feedback_label['text'] = "The 'Version' must be an integer!"
-            return
+            payload = dict()
+            payload['Description'] = self._payload_desc.get()
+            payload['Name'] = self._payload_name.get()
+            payload['Identifier'] = self._payload_id.get()
+            payload['Organization'] = self._payload_org.get()
 
-        app_lists = dict()
+            for k, v in payload.items():
+                if not v:
+                    self._feedback_label['text'] = \
+                        "Missing input for '{}'".format(k)
+                    return
 
-        for child in self.services_table.get_children():
-            values = self.services_table.item(child)["values"]
-            if not app_lists.get(values[1]):
-                app_lists[values[1]] = list()
+            # The 'PayloadVersion' key MUST be an Integer value
+            _version = self._payload_version.get()
+            try:
+                if float(_version).is_integer():
+                    version = int(_version)
+                else:
+                    raise ValueError
+            except ValueError:
+                print('Invalid payload version')
+                self._feedback_label['text'] = "The 'Version' must be an integer!"
+                return
+
+            app_lists = dict()
+
+            for child in self.services_table.get_children():
+                values = self.services_table.item(child)["values"]
+                if not app_lists.get(values[1]):
+                    app_lists[values[1]] = list()
+
+                app_lists[values[1]].append(values[0])
+
+            for child in self.app_env_table.get_children():
+                if not app_lists.get('AppleEvents'):
+                    app_lists['AppleEvents'] = list()
+
+                app_lists['AppleEvents'].append(
+                    ','.join(self.app_env_table.item(child)["values"])
+                )
 
-            app_lists[values[1]].append(values[0])
+            if not any(app_lists.keys()):
+                self._feedback_label['text'] = 'You must provide at least one ' \
+                                               'payload type to create a profile!'
+                return
 
-        for child in self.app_env_table.get_children():
-            if not app_lists.get('AppleEvents'):
-                app_lists['AppleEvents'] = list()
+            sign = self._payload_sign.get()
 
-            app_lists['AppleEvents'].append(
-                ','.join(self.app_env_table.item(child)["values"])
+            desktop_path = os.path.expanduser('~/Desktop')
+            filename = tkFileDialog.asksaveasfilename(
+                parent=self,
+                defaultextension='.mobileconfig',
+                initialdir=desktop_path,
+                initialfile='tccprofile.mobileconfig',
+                title='Save TCC Profile...'
             )
 
-        if not any(app_lists.keys()):
-            self._feedback_label['text'] = 'You must provide at least one ' \
-                                           'payload type to create a profile!'
-            return
+            tcc_profile = PrivacyProfiles(
+                payload_description=payload['Description'],
+                payload_name=payload['Name'],
+                payload_identifier=payload['Identifier'],
+                payload_organization=payload['Organization'],
+                payload_version=version,
+                sign_cert=None if sign == 'No' else [sign],
+                filename=filename,
+                resolver=self._resolver
+            )
 
-        sign = self._payload_sign.get()
+            tcc_profile.set_services_dict(app_lists)
+            self._start_build(tcc_profile)
+
+        def _start_build(self, tcc_profile):
+            """Inspects the apps, then builds and writes the profile on a
+            background thread, showing progress until it is done.
+            """
+            paths = tcc_profile._plan_inspections()
+
+            self._feedback_label['text'] = ''
+            self._save_button['state'] = tk.DISABLED
+            self._progress['maximum'] = max(len(paths), 1)
+            self._progress['value'] = 0
+            self._progress.grid(row=1, column=0, sticky='we')
+
+            def build():
+                # Apps added earlier are already resolved and return at once
+                for _ in self._pool.imap_unordered(self._resolver.resolve, paths):
+                    self._progress_events.put(1)
+                tcc_profile.build_profile(allow=True)
+                tcc_profile.write()
+
+            self._build = ProfileBuild(build)
+            self.after(100, self._poll_build)
+
+        def _poll_build(self):
+            """Applies progress from the build thread, on the Tk thread."""
+            try:
+                while True:
+                    self._progress.step(self._progress_events.get_nowait())
+            except Queue.Empty:
+                pass
 
-        desktop_path = os.path.expanduser('~/Desktop')
-        filename = tkFileDialog.asksaveasfilename(
-            parent=self,
-            defaultextension='.mobileconfig',
-            initialdir=desktop_path,
-            initialfile='tccprofile.mobileconfig',
-            title='Save TCC Profile...'
-        )
+            if not self._build.done():
+                self.after(100, self._poll_build)
+                return
 
-        tcc_profile = PrivacyProfiles(
-            payload_description=payload['Description'],
-            payload_name=payload['Name'],
-            payload_identifier=payload['Identifier'],
-            payload_organization=payload['Organization'],
-            payload_version=version,
-            sign_cert=None if sign == 'No' else sign,
-            filename=filename
-        )
+            self._progress.grid_remove()
+            self._save_button['state'] = tk.NORMAL
+            try:
+                self._build.result()
+            except (TCCProfileException, EnvironmentError) as err:
+                self._feedback_label['text'] = str(err)
+                return
 
-        tcc_profile.set_services_dict(app_lists)
-        tcc_profile.build_profile(allow=True)
-        tcc_profile.write()
+            self._feedback_label['text'] = ''
+
+        def _warm_up(self, *paths):
+            """Starts inspecting newly added apps in the background. Errors
+            are ignored here; failed apps are not remembered, so they are
+            inspected again (and reported) when the profile is saved.
+            """
+            for path in paths:
+                self._pool.apply_async(self._resolver.resolve, (path,))
+
+        def click_quit(self, event=None):
+            print("The user clicked 'Quit'")
+            self.master.destroy()
+
+        def _load_signing_certs(self, refresh=False):
+            """Looks up the signing certificates on a background thread and
+            fills the "Sign Profile?" menu when they arrive.
+            """
+            if self._certs_lookup and not self._certs_lookup.done():
+                return
 
-        self._feedback_label['text'] = ''
+            self._certs_lookup = ProfileBuild(
+                list_signing_certs, refresh=refresh)
+            self.after(100, self._poll_signing_certs)
 
-    def click_quit(self, event=None):
-        print("The user clicked 'Quit'")
-        self.master.destroy()
+        def _poll_signing_certs(self):
+            if not self._certs_lookup.done():
+                self.after(100, self._poll_signing_certs)
+                return
 
-    @staticmethod
-    def _list_signing_certs():
-        output = subprocess.check_output(
-            ['/usr/bin/security', 'find-identity', '-p', 'codesigning', '-v']
-        ).split('\n')
-
-        cert_list = ['No']
-        for i in output:
-            r = re.findall(r'"(.*?)"', i)
-            if r:
-                cert_list.extend(r)
-
-        return cert_list
-
-    def _app_picker(self, var_name):
-        app_name = tkFileDialog.askopenfilename(
-            parent=self,
-            # filetypes=[('App', '.app')],
-            initialdir='/Applications',
-            title='Select App'
-        )
-        getattr(self, var_name).set(app_name)
-        getattr(self, var_name + '_display').set(os.path.basename(app_name))
+            try:
+                certs = self._certs_lookup.result()
+            except (EnvironmentError, subprocess.CalledProcessError):
+                self._feedback_label['text'] = \
+                    'Could not list the signing certificates.'
+                return
 
-    def _add_apple_event(self):
-        source_app = self._app_env_source_var.get()
-        target_app = self._app_env_target_var.get()
+            menu = self._sign_menu['menu']
+            menu.delete(0, 'end')
+            for name in ['No'] + certs:
+                menu.add_command(
+                    label=name, command=tk._setit(self._payload_sign, name))
+
+            if self._payload_sign.get() not in certs:
+                self._payload_sign.set('No')
+
+        def _app_picker(self, var_name):
+            app_name = tkFileDialog.askopenfilename(
+                parent=self,
+                # filetypes=[('App', '.app')],
+                initialdir='/Applications',
+                title='Select App'
+            )
+            getattr(self, var_name).set(app_name)
+            getattr(self, var_name + '_display').set(os.path.basename(app_name))
 
-        if not all([source_app, target_app]):
-            print('Source and Target not both provided')
-            return
+        def _add_apple_event(self):
+            source_app = self._app_env_source_var.get()
+            target_app = self._app_env_target_var.get()
 
-        self.app_env_table.insert('', 'end', values=(source_app, target_app))
-        self._app_env_target_var.set('')
-        self._app_env_source_var.set('')
-        self._app_env_source_var_display.set('')
-        self._app_env_target_var_display.set('')
+            if not all([source_app, target_app]):
+                print('Source and Target not both provided')
+                return
 
-    def _add_service(self):
-        target_app = self._services_target_var.get()
-        selected_service = self._selected_service.get()
-        allow_deny = 'Allow' if \
-            self._available_services.get(selected_service) else 'Deny'
+            self.app_env_table.insert('', 'end', values=(source_app, target_app))
+            self._warm_up(source_app, target_app)
+            self._app_env_target_var.set('')
+            self._app_env_source_var.set('')
+            self._app_env_source_var_display.set('')
+            self._app_env_target_var_display.set('')
+
+        def _add_service(self):
+            target_app = self._services_target_var.get()
+            selected_service = self._selected_service.get()
+            allow_deny = 'Allow' if \
+                self._available_services.get(selected_service) else 'Deny'
+
+            if not target_app:
+                print('Target app not provided')
+                return
 
-        if not target_app:
-            print('Target app not provided')
-            return
+            self.services_table.insert(
+                '', 'end',
+                values=(target_app, selected_service, allow_deny)
+            )
+            self._warm_up(target_app)
+            self._services_target_var.set('')
+            self._services_target_var_display.set('')
 
-        self.services_table.insert(
-            '', 'end',
-            values=(target_app, selected_service, allow_deny)
-        )
-        self._services_target_var.set('')
-        self._services_target_var_display.set('')
+    return App
 
 
-def read_plist(filepath):
+class Tracer(object):
+    """Records timings as Chrome trace events, which chrome://tracing,
+    Perfetto and speedscope can open. Install one with install_tracer.
     """
-    Read a .plist file from filepath.  Return the unpacked root object
-    (which is usually a dictionary).
+
+    def __init__(self):
+        self.events = list()
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._pid = os.getpid()
+
+    def add(self, name, category, start, duration, args=None):
+        """Records a complete event; start and duration are in seconds."""
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((start - self._start) * 1e6),
+            'dur': int(duration * 1e6),
+            'pid': self._pid,
+            'tid': threading.current_thread().ident,
+            'args': args or {},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path):
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class _Span(object):
+    """Context manager timing one traced event. Extra details can be added
+    to args before it exits.
     """
-    plistData = NSData.dataWithContentsOfFile_(filepath)
-    dataObject, dummy_plistFormat, error = (
-        NSPropertyListSerialization.
-        propertyListFromData_mutabilityOption_format_errorDescription_(
-            plistData, NSPropertyListMutableContainers, None, None))
-    if dataObject is None:
-        if error:
-            error = error.encode('ascii', 'ignore')
-        else:
-            error = "Unknown error"
-        errmsg = "%s in file %s" % (error, filepath)
-        raise NSPropertyListSerializationException(errmsg)
-    else:
-        return dataObject
 
+    def __init__(self, tracer, name, category, args):
+        self._tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
 
-def read_plist_from_string(data):
-    """Read a plist data from a string. Return the root object."""
-    try:
-        plistData = buffer(data)
-    except TypeError, err:
-        raise NSPropertyListSerializationException(err)
-    dataObject, dummy_plistFormat, error = (
-        NSPropertyListSerialization.
-        propertyListFromData_mutabilityOption_format_errorDescription_(
-            plistData, NSPropertyListMutableContainers, None, None))
-    if dataObject is None:
-        if error:
-            error = error.encode('ascii', 'ignore')
-        else:
-            error = "Unknown error"
-        raise NSPropertyListSerializationException(error)
-    else:
-        return dataObject
+    def __enter__(self):
+        self._started = time.time()
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.args['error'] = str(exc_value)
+        self._tracer.add(self.name, self.category, self._started,
+                         time.time() - self._started, self.args)
 
-class PrivacyProfiles(object):
-    # List of Payload types to iterate on because lazy code is good code
-    PAYLOADS = [
-        'AddressBook',
-        'Calendar',
-        'Reminders',
-        'Photos',
-        'Camera',
-        'Microphone',
-        'Accessibility',
-        'PostEvent',
-        'SystemPolicyAllFiles',
-        'SystemPolicySysAdminFiles',
-        'AppleEvents'
-    ]
 
-    def __init__(self, payload_description, payload_name, payload_identifier,
-                 payload_organization, payload_version, sign_cert, filename):
-        """Creates a Privacy Preferences Policy Control Profile for macOS
-        Mojave.
-        """
-        # Init the things to put in the template, and elsewhere
-        self.payload_description = payload_description
-        self.payload_name = payload_name
-        self.payload_identifier = payload_identifier
-        self.payload_organization = payload_organization
-        self.payload_type = 'com.apple.TCC.configuration-profile-policy'
-        self.payload_uuid = str(uuid.uuid1()).upper()  # This is used in the 'PayloadContent' part of the profile
-        self.profile_uuid = str(uuid.uuid1()).upper()  # This is used in the root of the profile
-        self.payload_version = payload_version
+class _NullSpan(object):
+    """Stands in for _Span when tracing is off."""
 
-        # Basic requirements for this profile to work
-        self.template = {
-            'PayloadContent': [
-                {
-                    'PayloadDescription': self.payload_description,
-                    'PayloadDisplayName': self.payload_name,
-                    'PayloadIdentifier': '{}.{}'.format(self.payload_identifier, self.payload_uuid),  # This needs to be different to the root 'PayloadIdentifier'
-                    'PayloadOrganization': self.payload_organization,
-                    'PayloadType': self.payload_type,
-                    'PayloadUUID': self.payload_uuid,
-                    'PayloadVersion': self.payload_version,
-                    'Services': dict()  # This will be an empty list to house the dicts.
-                }
-            ],
-            'PayloadDescription': self.payload_description,
-            'PayloadDisplayName': self.payload_name,
-            'PayloadIdentifier': self.payload_identifier,
-            'PayloadOrganization': self.payload_organization,
-            'PayloadScope': 'system',  # What's the point in making this a user profile?
-            'PayloadType': 'Configuration',
-            'PayloadUUID': self.profile_uuid,
-            'PayloadVersion': self.payload_version,
-        }
+    @property
+    def args(self):
+        return dict()
 
-        self._app_lists = dict()
-        self._sign_cert = self._set_sign_profile(sign_cert)
-        self._filename = self._set_filename(filename)
+    def __enter__(self):
+        return self
 
-        # Note, there's different values for the python codesigns depending on which python is called.
-        # /usr/bin/python is com.apple.python
-        # /System/Library/Frameworks/Python.framework/Resources/Python.app is org.python.python
-        # These different codesign values cause issues with LaunchAgents/LaunchDaemons that don't explicitly call
-        # the interpreter in the ProgramArguments array.
-        # For the time being, strongly recommend any LaunchDaemons/LaunchAgents that launch python scripts to
-        # add in <string>/usr/bin/python</string> to the ProgramArguments array _before_ the <string>/path/to/pythonscript.py</string> line.
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
 
-    def set_services_dict(self, args):
-        if not isinstance(args, dict):
-            arguments = vars(args)
-            app_lists = dict()
 
-            # Build up args to pass to the class init
-            app_lists['AddressBook'] = arguments.get(
-                'address_book_apps_list', False)
-            app_lists['Calendar'] = arguments.get('calendar_apps_list', False)
-            app_lists['Reminders'] = arguments.get('reminders_apps_list', False)
-            app_lists['Photos'] = arguments.get('photos_apps_list', False)
-            app_lists['Camera'] = arguments.get('camera_apps_list', False)
-            app_lists['Microphone'] = arguments.get(
-                'microphone_apps_list', False)
-            app_lists['Accessibility'] = arguments.get(
-                'accessibility_apps_list', False)
-            app_lists['PostEvent'] = arguments.get(
-                'post_event_apps_list', False)
-            app_lists['SystemPolicyAllFiles'] = arguments.get(
-                'allfiles_apps_list', False)
-            app_lists['SystemPolicySysAdminFiles'] = arguments.get(
-                'sysadmin_apps_list', False)
-            app_lists['AppleEvents'] = arguments.get('events_apps_list', False)
-        else:
-            app_lists = args
+_NULL_SPAN = _NullSpan()
+_tracer = None
 
-        # Handle if no payload arguments are supplied,
-        # Can't create an empty profile.
-        if not any(app_lists.keys()):
-            print 'You must provide at least one payload type to create a profile.'
-            raise TCCProfileException
 
-        self._app_lists = app_lists
+def install_tracer(tracer):
+    """Makes tracer record every traced phase and tool call from now on.
+    Pass None to stop tracing.
+    """
+    global _tracer
+    _tracer = tracer
 
-        # Create payload lists in the services_dict
-        for payload in self.PAYLOADS:
-            if app_lists.get(payload):
-                self.template['PayloadContent'][0]['Services'][payload] = []
 
-    def build_profile(self, allow):
-        for payload in self.PAYLOADS:
-            if self._app_lists.get(payload):
-                for app in self._app_lists[payload]:
-                    if payload in ['Camera', 'Microphone']:  # Camera and Microphone payloads can only DENY an app access to that hardware.
-                        _allow = False
-                        allow_statement = 'Deny'
-                    else:
-                        _allow = allow
-                        allow_statement = 'Allow'
-
-                    if payload == 'AppleEvents':  # AppleEvent payload has additional requirements
-                        if not len(app.split(',')) == 2:
-                            print 'AppleEvents applications must be in the format of /Application/Path/EventSending.app,/Application/Path/EventReceiving.app'
-                            sys.exit(1)
-                        else:
-                            sending_app = app.split(',')[0]
-                            receiving_app = app.split(',')[1]
-                            sending_app_name = os.path.basename(
-                                os.path.splitext(sending_app)[0])
-                            receiving_app_name = os.path.basename(
-                                os.path.splitext(receiving_app)[0])
-                            codesign_result = self._get_code_sign_requirements(
-                                path=app.split(',')[0])
-                            payload_dict = self._build_payload(
-                                app_path=app, allowed=allow, apple_event=True,
-                                code_requirement=codesign_result,
-                                comment='{} {} to send {} control to {}'.format(
-                                    allow_statement, sending_app_name, payload,
-                                    receiving_app_name))
+def trace_span(name, category='phase', **args):
+    """Returns a context manager that records its block as a trace event,
+    or does nothing when no tracer is installed.
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name, category, args)
+
+
+def traced(name, category='phase'):
+    """Decorator recording each call of a function as a trace event."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Keys read from an app's Info.plist by default
+INFO_PLIST_KEYS = ('CFBundleIdentifier', 'CFBundleVersion', 'CFBundleExecutable')
+
+_info_plist_cache = dict()
+_info_plist_cache_lock = threading.Lock()
+_INFO_PLIST_CACHE_SIZE = 4096
+
+
+def _xml_plist_value(element):
+    """Converts an XML plist value element to a Python object."""
+    tag = element.tag
+    if tag == 'string':
+        return element.text or ''
+    elif tag == 'integer':
+        return int(element.text)
+    elif tag == 'real':
+        return float(element.text)
+    elif tag == 'true':
+        return True
+    elif tag == 'false':
+        return False
+    elif tag == 'array':
+        return [_xml_plist_value(child) for child in element]
+    elif tag == 'dict':
+        children = list(element)
+        return {
+            children[i].text or '': _xml_plist_value(children[i + 1])
+            for i in range(0, len(children) - 1, 2)
+        }
+    elif tag == 'data':
+        return (element.text or '').decode('base64')
+    else:
+        return element.text
 
-                    else:
-                        app_name = os.path.basename(os.path.splitext(app)[0])
-                        codesign_result = self._get_code_sign_requirements(
-                            path=app)
-                        payload_dict = self._build_payload(
-                            app_path=app,
-                            allowed=_allow,
-                            apple_event=False,
-                            code_requirement=codesign_result,
-                            comment='{} {} control for {}'.format(
-                                allow_statement,
-                                payload,
-                                app_name
-                            )
-                        )
-
-                    if payload_dict not in self.template['PayloadContent'][0]['Services'][payload]:
-                        self.template['PayloadContent'][0]['Services'][payload].append(payload_dict)
 
-    def write(self):
-        if self._filename:
-            # Write the plist out to file
-            plistlib.writePlist(self.template, self._filename)
-
-            # Sign it if required
-            if self._sign_cert:
-                self._sign_profile(
-                    certificate_name=self._sign_cert,
-                    input_file=self._filename
-                )
-        else:
-            # Print as formatted plist out to stdout
-            print plistlib.writePlistToString(self.template).rstrip('\n')
+def _read_xml_plist_keys(f, keys):
+    """Reads keys from the root dict of an XML plist, stopping as soon as all
+    of them have been seen.
+    """
+    result = dict()
+    depth = 0
+    wanted_key = None
+    for event, element in ElementTree.iterparse(f, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+
+        depth -= 1
+        # Direct children of the root <dict> are at depth 2 (plist > dict)
+        if depth == 2:
+            if element.tag == 'key':
+                wanted_key = element.text if element.text in keys else None
+            else:
+                if wanted_key:
+                    result[wanted_key] = _xml_plist_value(element)
+                    if len(result) == len(keys):
+                        break
+                wanted_key = None
+                element.clear()
 
-    @staticmethod
-    def _set_sign_profile(sign_cert):
-        if sign_cert and len(sign_cert):
-            return sign_cert[0]
-        else:
-            return False
+    return result
 
-    @staticmethod
-    def _set_filename(filename):
-        if filename:
-            _filename = os.path.expandvars(os.path.expanduser(filename))
-            if not os.path.splitext(filename)[1] == '.mobileconfig':
-                _filename = filename.replace(os.path.splitext(filename)[1], '.mobileconfig')
 
-            return _filename
+def _read_binary_plist_keys(data, keys):
+    """Reads keys from the root dict of a binary (bplist00) plist, decoding
+    only the objects needed.
+    """
+    offset_size, ref_size, num_objects, top_object, table_offset = \
+        struct.unpack('>6xBBQQQ', data[-32:])
+
+    def read_int(offset, size):
+        return int(data[offset:offset + size].encode('hex') or '0', 16)
+
+    def object_offset(ref):
+        return read_int(table_offset + ref * offset_size, offset_size)
+
+    def read_length(offset, info):
+        """Returns (length, offset of the payload)."""
+        if info != 0xF:
+            return info, offset + 1
+        int_size = 1 << (ord(data[offset + 1]) & 0xF)
+        return read_int(offset + 2, int_size), offset + 2 + int_size
+
+    def read_object(ref):
+        offset = object_offset(ref)
+        marker = ord(data[offset])
+        kind, info = marker >> 4, marker & 0xF
+
+        if kind == 0x0:
+            return {0x8: False, 0x9: True}.get(info)
+        elif kind == 0x1:
+            size = 1 << info
+            value = read_int(offset + 1, size)
+            if size == 8 and value >= 1 << 63:
+                value -= 1 << 64
+            return int(value)
+        elif kind == 0x2:
+            fmt = '>f' if info == 2 else '>d'
+            return struct.unpack(fmt, data[offset + 1:offset + 1 + (1 << info)])[0]
+        elif kind == 0x3:
+            # Seconds since 2001-01-01
+            return struct.unpack('>d', data[offset + 1:offset + 9])[0]
+        elif kind == 0x4:
+            length, start = read_length(offset, info)
+            return data[start:start + length]
+        elif kind == 0x5:
+            length, start = read_length(offset, info)
+            return data[start:start + length]
+        elif kind == 0x6:
+            length, start = read_length(offset, info)
+            return data[start:start + length * 2].decode('utf-16be')
+        elif kind in [0xA, 0xC]:
+            length, start = read_length(offset, info)
+            return [read_object(read_int(start + i * ref_size, ref_size))
+                    for i in range(length)]
+        elif kind == 0xD:
+            length, start = read_length(offset, info)
+            values = start + length * ref_size
+            return {
+                read_object(read_int(start + i * ref_size, ref_size)):
+                    read_object(read_int(values + i * ref_size, ref_size))
+                for i in range(length)
+            }
         else:
-            return None
+            raise NSPropertyListSerializationException(
+                'Unsupported binary plist object type {:#x}'.format(kind))
+
+    offset = object_offset(top_object)
+    marker = ord(data[offset])
+    if marker >> 4 != 0xD:
+        raise NSPropertyListSerializationException(
+            'Root of the binary plist is not a dict')
+
+    # Only decode the keys, then the values of the keys that are wanted.
+    length, start = read_length(offset, marker & 0xF)
+    values = start + length * ref_size
+    result = dict()
+    for i in range(length):
+        key = read_object(read_int(start + i * ref_size, ref_size))
+        if key in keys:
+            result[key] = read_object(read_int(values + i * ref_size, ref_size))
+            if len(result) == len(keys):
+                break
+
+    return result
+
+
+def read_info_plist(filepath, keys=INFO_PLIST_KEYS):
+    """Returns a dict of the requested top-level keys found in the XML or
+    binary plist at filepath, without PyObjC.
+
+    Parsing stops once every key has been found, and results are cached by
+    path and mtime.
+    """
+    keys = tuple(keys)
+    mtime = os.stat(filepath).st_mtime
+    cache_key = (filepath, mtime, keys)
 
-    @staticmethod
-    def _get_file_mime_type(path):
-        """Returns the mimetype of a given file."""
-        if os.path.exists(path.rstrip('/')):
-            cmd = ['/usr/bin/file', '--mime-type', path]
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            result, error = process.communicate()
+    with _info_plist_cache_lock:
+        if cache_key in _info_plist_cache:
+            return _info_plist_cache[cache_key]
 
-            if process.returncode is 0:
-                # Only need the mime type, so return the last bit
-                result = result.replace(' ', '').replace('\n', '').split(':')[1].split('/')[1]
-                return result
+    try:
+        with trace_span('read_info_plist', 'inspect', path=filepath), \
+                open(filepath, 'rb') as f:
+            if f.read(8) == 'bplist00':
+                f.seek(0)
+                result = _read_binary_plist_keys(f.read(), keys)
+            else:
+                f.seek(0)
+                result = _read_xml_plist_keys(f, keys)
+    except (ElementTree.ParseError, struct.error, IndexError, ValueError) as err:
+        raise NSPropertyListSerializationException(
+            "%s in file %s" % (err, filepath))
+
+    # Keep plain str values like the rest of the profile
+    for key, value in result.items():
+        if isinstance(value, unicode):
+            try:
+                result[key] = str(value)
+            except UnicodeEncodeError:
+                pass
 
-    @staticmethod
-    def _read_shebang(app_path):
-        """Returns the contents of the shebang in a script file, as long as env
-        is not in the shebang
-        """
-        with open(app_path, 'r') as textfile:
-            line = textfile.readline().rstrip('\n')
-            if line.startswith('#!') and 'env ' not in line:
-                return line.replace('#!', '')
-            elif line.startswith('#!') and 'env ' in line:
-                raise Exception('Cannot check codesign for shebangs that refer to \'env\'.')
+    with _info_plist_cache_lock:
+        if len(_info_plist_cache) >= _INFO_PLIST_CACHE_SIZE:
+            _info_plist_cache.clear()
+        _info_plist_cache[cache_key] = result
 
-    def _get_code_sign_requirements(self, path):
-        """Returns the values for the CodeRequirement key."""
-        if os.path.exists(path.rstrip('/')):
-            # Handle situations where path is a script, and shebang is
-            # ['/bin/sh', '/bin/bash', '/usr/bin/python']
-            mimetype = self._get_file_mime_type(path=path)
-            if mimetype in ['x-python', 'x-shellscript']:
-                path = self._read_shebang(app_path=path)
+    return result
 
-            cmd = ['/usr/bin/codesign', '-dr', '-', path]
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            result, error = process.communicate()
 
-            if process.returncode is 0:
-                # For some reason, part of the output gets dumped to stderr, but the bit we need goes to stdout
-                # Also, there can be multiple lines in the result, so handle this properly
-                # There are circumstances where the codesign 'designated => ' is not the start of the line, so handle these.
-                result = result.rstrip('\n').splitlines()
-                result = [line for line in result if 'designated => ' in line][0]
-                result = result.partition('designated => ')
-                result = result[result.index('designated => ') + 1:][0]
-                # result = [x.rstrip('\n') for x in result.splitlines() if x.startswith('designated => ')][0]
-                return result
+# Magic numbers of thin (32/64-bit, either byte order) and fat Mach-O files
+MACHO_MAGICS = frozenset([0xfeedface, 0xcefaedfe, 0xfeedfacf, 0xcffaedfe])
+FAT_MAGICS = frozenset([0xcafebabe, 0xcafebabf])
 
-            elif process.returncode is 1 and 'not signed' in error:
-                print 'App at {} is not signed. Exiting.'.format(path)
-                sys.exit(1)
-        else:
-            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+# Interpreters that `file` reports as text/x-shellscript
+SHELL_INTERPRETERS = frozenset(['sh', 'bash', 'zsh', 'ksh', 'dash', 'csh',
+                                'tcsh'])
 
-    def _get_identifier_and_type(self, app_path):
+
+def sniff_mime_type(path):
+    """Returns the subtype of the mime type `file --mime-type` reports for
+    path (e.g. 'x-python', 'x-shellscript', 'x-mach-binary', 'directory'),
+    worked out in-process from the first bytes of the file. Returns None if
+    path does not exist.
+    """
+    path = path.rstrip('/') or '/'
+    if os.path.isdir(path):
+        return 'directory'
+
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(512)
+    except IOError:
+        return None
+
+    if not head:
+        return 'x-empty'
+
+    if len(head) >= 8:
+        magic = struct.unpack('>I', head[:4])[0]
+        if magic in MACHO_MAGICS:
+            return 'x-mach-binary'
+        # Java class files share 0xcafebabe, but their second word is a
+        # version number well above any plausible count of architectures.
+        if magic in FAT_MAGICS and struct.unpack('>I', head[4:8])[0] < 32:
+            return 'x-mach-binary'
+
+    if head.startswith('#!'):
+        interpreter = head[2:].split('\n', 1)[0].split()
+        if interpreter:
+            name = os.path.basename(interpreter[0])
+            if name == 'env':
+                # Skip env's options and variable assignments (-S, -i,
+                # PATH=...) to reach the command it runs
+                commands = [word for word in interpreter[1:]
+                            if not word.startswith('-') and '=' not in word]
+                name = os.path.basename(commands[0]) if commands else name
+
+            if name.startswith('python'):
+                return 'x-python'
+            elif name in SHELL_INTERPRETERS:
+                return 'x-shellscript'
+            elif name.startswith('perl'):
+                return 'x-perl'
+            elif name.startswith('ruby'):
+                return 'x-ruby'
+
+    if '\0' in head:
+        return 'octet-stream'
+
+    return 'plain'
+
+
+# Mach-O load command and code signing blob constants, from <mach-o/loader.h>
+# and Security.framework's cs_blobs.h / requirement.h
+LC_CODE_SIGNATURE = 0x1d
+CPU_TYPES = {'x86_64': 0x01000007, 'i386': 7, 'arm64': 0x0100000c}
+
+CSMAGIC_REQUIREMENT = 0xfade0c00
+CSMAGIC_REQUIREMENTS = 0xfade0c01
+CSMAGIC_CODEDIRECTORY = 0xfade0c02
+CSMAGIC_EMBEDDED_SIGNATURE = 0xfade0cc0
+CSSLOT_REQUIREMENTS = 2
+# The primary CodeDirectory and its alternates (one per extra hash type)
+CSSLOT_CODEDIRECTORIES = [0] + range(0x1000, 0x1005)
+DESIGNATED_REQUIREMENT_TYPE = 3
+
+# CodeDirectory hash types: (strength rank, hashlib name). The strongest
+# CodeDirectory present is the one whose hash identifies the code.
+CS_HASH_TYPES = {
+    1: (0, 'sha1'),
+    2: (2, 'sha256'),
+    3: (1, 'sha256'),  # SHA-256 truncated to 20 bytes
+    4: (3, 'sha384'),
+}
+
+_cdhash_cache = dict()
+_cdhash_cache_lock = threading.Lock()
+_CDHASH_CACHE_SIZE = 4096
+
+# Words the requirement language reserves, which codesign always quotes
+REQUIREMENT_KEYWORDS = frozenset([
+    'always', 'and', 'anchor', 'apple', 'cdhash', 'certificate', 'cert',
+    'designated', 'entitlement', 'exists', 'false', 'generic', 'guest', 'host',
+    'identifier', 'info', 'leaf', 'legacy', 'library', 'never', 'notarized',
+    'or', 'platform', 'root', 'timestamp', 'trusted', 'true',
+])
+
+
+def main_executable(path):
+    """Returns the main executable of an app bundle (from its
+    CFBundleExecutable), or path itself if it is not a bundle.
+    """
+    path = path.rstrip('/')
+    info_plist = os.path.join(path, 'Contents/Info.plist')
+    if os.path.isdir(path) and os.path.isfile(info_plist):
+        executable = read_info_plist(info_plist).get('CFBundleExecutable')
+        if executable:
+            return os.path.join(path, 'Contents/MacOS', executable)
+
+    return path
+
+
+def _macho_slices(data):
+    """Returns [(cputype, offset)] of the thin Mach-O images in data, which
+    is either a thin or a fat (universal) binary.
+    """
+    magic = struct.unpack('>I', data[:4])[0]
+    if magic in FAT_MAGICS:
+        count = struct.unpack('>I', data[4:8])[0]
+        arch_size = 20 if magic == 0xcafebabe else 32
+        slices = list()
+        for i in xrange(count):
+            start = 8 + i * arch_size
+            cputype = struct.unpack('>i', data[start:start + 4])[0]
+            if magic == 0xcafebabe:
+                offset = struct.unpack('>I', data[start + 8:start + 12])[0]
+            else:
+                offset = struct.unpack('>Q', data[start + 8:start + 16])[0]
+            slices.append((cputype, offset))
+        return slices
+
+    if magic in MACHO_MAGICS:
+        return [(None, 0)]
+
+    return list()
+
+
+def _code_signature_range(data, offset):
+    """Returns (start, size) of the embedded code signature of the thin
+    Mach-O image at offset, or None if it has no LC_CODE_SIGNATURE.
+    """
+    magic = struct.unpack('>I', data[offset:offset + 4])[0]
+    # Big endian magics are read as-is; anything else is a little endian image
+    endian = '>' if magic in [0xfeedface, 0xfeedfacf] else '<'
+    is_64 = magic in [0xfeedfacf, 0xcffaedfe]
+
+    ncmds, sizeofcmds = struct.unpack(
+        endian + 'II', data[offset + 16:offset + 24])
+    command = offset + (32 if is_64 else 28)
+    # Counts come from the file, so a malformed one must not build a list
+    # (struct.error ends the loop once it runs past the data)
+    for _ in xrange(ncmds):
+        cmd, cmdsize = struct.unpack(endian + 'II', data[command:command + 8])
+        if cmd == LC_CODE_SIGNATURE:
+            dataoff, datasize = struct.unpack(
+                endian + 'II', data[command + 8:command + 16])
+            return offset + dataoff, datasize
+        if cmdsize < 8:
+            break
+        command += cmdsize
+
+    return None
+
+
+def _superblob_slots(data, start):
+    """Returns {slot type: offset} for the SuperBlob at start."""
+    count = struct.unpack('>I', data[start + 8:start + 12])[0]
+    slots = dict()
+    for i in xrange(count):
+        index = start + 12 + i * 8
+        slot_type, slot_offset = struct.unpack('>II', data[index:index + 8])
+        slots[slot_type] = start + slot_offset
+
+    return slots
+
+
+class RequirementDecompiler(object):
+    """Turns a compiled requirement expression back into the text codesign
+    prints, following Security.framework's reqdumper.cpp.
+    """
+    # Syntax levels, used to decide when and/or need parentheses
+    PRIMARY, AND, OR, TOP = range(4)
+
+    MATCH_OPERATORS = {
+        1: ' = ', 2: ' ~ ', 5: ' < ', 6: ' > ', 7: ' <= ', 8: ' >= ',
+        9: ' = ', 10: ' < ', 11: ' > ', 12: ' <= ', 13: ' >= ',
+    }
+
+    def __init__(self, data, offset):
+        self._data = data
+        self._offset = offset
+        self._out = list()
+
+    def decompile(self):
+        self._expr(self.TOP)
+        return ''.join(self._out)
+
+    def _get(self, fmt='>I'):
+        value = struct.unpack_from(fmt, self._data, self._offset)[0]
+        self._offset += struct.calcsize(fmt)
+        return value
+
+    def _get_data(self):
+        length = self._get()
+        value = self._data[self._offset:self._offset + length]
+        # Data is padded to a multiple of 4 bytes
+        self._offset += (length + 3) & ~3
+        return value
+
+    def _print(self, text):
+        self._out.append(text)
+
+    def _data_value(self, dot_okay=False):
+        value = self._get_data()
+        mode = 'simple'
+        for index, char in enumerate(value):
+            if char.isalnum() or (char == '.' and dot_okay):
+                if index == 0 and char.isdigit():
+                    mode = 'printable'
+            elif 32 < ord(char) < 127 or char in ' \t\n\r\f\v':
+                if mode == 'simple':
+                    mode = 'printable'
+            else:
+                mode = 'binary'
+                break
+
+        if mode == 'simple' and value in REQUIREMENT_KEYWORDS:
+            mode = 'printable'
+
+        if mode == 'simple':
+            self._print(value)
+        elif mode == 'printable':
+            self._print('"{}"'.format(
+                value.replace('\\', '\\\\').replace('"', '\\"')))
+        else:
+            self._print('H"{}"'.format(value.encode('hex')))
+
+    def _hash_data(self):
+        self._print('H"{}"'.format(self._get_data().encode('hex')))
+
+    def _oid(self):
+        value = bytearray(self._get_data())
+        arcs = list()
+        current = 0
+        for index, byte in enumerate(value):
+            current = (current << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                if not arcs:
+                    first = min(current // 40, 2)
+                    arcs.extend([first, current - first * 40])
+                else:
+                    arcs.append(current)
+                current = 0
+
+        return '.'.join(str(arc) for arc in arcs)
+
+    def _cert_slot(self):
+        slot = self._get('>i')
+        self._print({-1: ' root', 0: ' leaf'}.get(slot, ' {}'.format(slot)))
+
+    def _match(self):
+        op = self._get()
+        if op == 0:
+            self._print(' /* exists */')
+        elif op == 14:
+            self._print(' absent ')
+        elif op == 3:
+            self._print(' = ')
+            self._data_value()
+            self._print('*')
+        elif op == 4:
+            self._print(' = *')
+            self._data_value()
+        elif op in self.MATCH_OPERATORS:
+            self._print(self.MATCH_OPERATORS[op])
+            if op >= 9:
+                self._print('<{}>'.format(self._get('>q')))
+            else:
+                self._data_value()
+        else:
+            raise ValueError('Unknown match operation {}'.format(op))
+
+    def _expr(self, level):
+        op = self._get()
+        code = op & 0x00ffffff
+
+        if code == 0:
+            self._print('never')
+        elif code == 1:
+            self._print('always')
+        elif code == 2:
+            self._print('identifier ')
+            self._data_value()
+        elif code == 3:
+            self._print('anchor apple')
+        elif code == 4:
+            self._print('certificate')
+            self._cert_slot()
+            self._print(' = ')
+            self._hash_data()
+        elif code == 5:
+            self._print('info[')
+            self._data_value(dot_okay=True)
+            self._print('] = ')
+            self._data_value()
+        elif code in [6, 7]:
+            inner, word = (self.AND, ' and ') if code == 6 else (self.OR, ' or ')
+            if level < inner:
+                self._print('(')
+            self._expr(inner)
+            self._print(word)
+            self._expr(inner)
+            if level < inner:
+                self._print(')')
+        elif code == 8:
+            self._print('cdhash ')
+            self._hash_data()
+        elif code == 9:
+            self._print('! ')
+            self._expr(self.PRIMARY)
+        elif code in [10, 16]:
+            self._print('info[' if code == 10 else 'entitlement[')
+            self._data_value(dot_okay=True)
+            self._print(']')
+            self._match()
+        elif code == 11:
+            self._print('certificate')
+            self._cert_slot()
+            self._print('[')
+            self._data_value(dot_okay=True)
+            self._print(']')
+            self._match()
+        elif code == 12:
+            self._print('certificate')
+            self._cert_slot()
+            self._print(' trusted')
+        elif code == 13:
+            self._print('anchor trusted')
+        elif code in [14, 17, 22]:
+            prefix = {14: 'field.', 17: 'policy.', 22: 'timestamp.'}[code]
+            self._print('certificate')
+            self._cert_slot()
+            self._print('[{}{}]'.format(prefix, self._oid()))
+            self._match()
+        elif code == 15:
+            self._print('anchor apple generic')
+        elif code == 18:
+            self._print('anchor apple ')
+            self._data_value()
+        elif code == 19:
+            self._print('(')
+            self._data_value()
+            self._print(')')
+        elif code == 20:
+            self._print('platform = {}'.format(self._get('>i')))
+        elif code == 21:
+            self._print('notarized')
+        elif code == 23:
+            self._print('legacy')
+        elif op & 0x80000000:
+            self._print(' false /* opcode {} */'.format(code))
+        elif op & 0x40000000:
+            self._print(' /* opcode {} */'.format(code))
+        else:
+            raise ValueError('Unknown requirement opcode {}'.format(op))
+
+
+def _preferred_slice(slices):
+    """Picks the slice matching this machine's architecture, else the
+    first one, as codesign does for universal binaries.
+    """
+    host = CPU_TYPES.get(platform.machine())
+    for cputype, offset in slices:
+        if cputype == host:
+            return offset
+
+    return slices[0][1]
+
+
+def _blob_magic(data, offset):
+    return struct.unpack('>I', data[offset:offset + 4])[0]
+
+
+def _slice_signature(data, offset):
+    """Returns the offset of the embedded signature SuperBlob of the Mach-O
+    image at offset, or None if it is not signed.
+    """
+    signature = _code_signature_range(data, offset)
+    if not signature or _blob_magic(data, signature[0]) != \
+            CSMAGIC_EMBEDDED_SIGNATURE:
+        return None
+
+    return signature[0]
+
+
+def _embedded_signature(data):
+    """Returns the offset of the embedded signature SuperBlob in the mapped
+    Mach-O file, or None if it is not a signed Mach-O file.
+    """
+    slices = _macho_slices(data)
+    if not slices:
+        return None
+
+    return _slice_signature(data, _preferred_slice(slices))
+
+
+def _embedded_signatures(data):
+    """Returns the offsets of the embedded signature SuperBlobs of every
+    signed slice of the mapped Mach-O file.
+    """
+    return [start for start in (_slice_signature(data, offset)
+                                for cputype, offset in _macho_slices(data))
+            if start is not None]
+
+
+def _read_signature(path, reader, all_slices=False):
+    """Memory maps the main executable of path and returns
+    reader(data, superblob offset), or None if it is not signed or cannot
+    be parsed. Mapping means large universal binaries are not read in.
+
+    With all_slices, returns the list of reader's results for every signed
+    slice of a universal binary instead (empty if none are signed).
+    """
+    try:
+        with open(main_executable(path), 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+
+    try:
+        if all_slices:
+            return [reader(data, start)
+                    for start in _embedded_signatures(data)]
+
+        start = _embedded_signature(data)
+        if start is None:
+            return None
+        return reader(data, start)
+    except (struct.error, ValueError, IndexError):
+        return [] if all_slices else None
+    finally:
+        data.close()
+
+
+def _designated_requirement(data, start):
+    requirements = _superblob_slots(data, start).get(CSSLOT_REQUIREMENTS)
+    if requirements is None or _blob_magic(data, requirements) != \
+            CSMAGIC_REQUIREMENTS:
+        return None
+
+    designated = _superblob_slots(data, requirements).get(
+        DESIGNATED_REQUIREMENT_TYPE)
+    if designated is None or _blob_magic(data, designated) != \
+            CSMAGIC_REQUIREMENT:
+        return None
+
+    # Skip the blob's magic, length and kind to reach the expression
+    return RequirementDecompiler(data, designated + 12).decompile()
+
+
+def read_designated_requirement(path):
+    """Returns the designated requirement embedded in the code signature of
+    the binary at path (or of a bundle's main executable), in the same form
+    `codesign -dr -` prints it.
+
+    Returns None if the binary is not a signed Mach-O file or has no
+    explicit designated requirement (codesign synthesises one in that case).
+    """
+    return _read_signature(path, _designated_requirement)
+
+
+def _cdhash(data, start):
+    """Returns the CDHash of the strongest CodeDirectory in the SuperBlob."""
+    slots = _superblob_slots(data, start)
+    best = None
+    for slot in CSSLOT_CODEDIRECTORIES:
+        directory = slots.get(slot)
+        if directory is None or _blob_magic(data, directory) != \
+                CSMAGIC_CODEDIRECTORY:
+            continue
+
+        length = struct.unpack('>I', data[directory + 4:directory + 8])[0]
+        hash_type = ord(data[directory + 37])
+        if hash_type not in CS_HASH_TYPES:
+            continue
+        rank = CS_HASH_TYPES[hash_type][0]
+        if best is None or rank > best[0]:
+            best = (rank, hash_type, directory, length)
+
+    if best is None:
+        return None
+
+    rank, hash_type, directory, length = best
+    digest = hashlib.new(CS_HASH_TYPES[hash_type][1])
+    # The CodeDirectory holds the hash of every page, so hashing it covers
+    # the whole binary; hash it in chunks straight from the mapping
+    for offset in range(directory, directory + length, 65536):
+        digest.update(data[offset:min(offset + 65536, directory + length)])
+
+    # CDHashes are always truncated to 20 bytes
+    return digest.hexdigest()[:40]
+
+
+def read_cdhash(path, all_slices=False):
+    """Returns the CDHash (as hex) of the binary at path, or of a bundle's
+    main executable, or None if it is not a signed Mach-O file. For a
+    universal binary this is the CDHash of the slice codesign would pick.
+
+    With all_slices, returns the distinct CDHashes of every slice instead,
+    in the order the slices appear (empty if it is not signed).
+
+    Results are cached per executable and modification time.
+    """
+    executable = main_executable(path)
+    try:
+        mtime = os.stat(executable).st_mtime
+    except OSError:
+        return [] if all_slices else None
+
+    cache_key = (executable, mtime, all_slices)
+    with _cdhash_cache_lock:
+        if cache_key in _cdhash_cache:
+            return _cdhash_cache[cache_key]
+
+    result = _read_signature(executable, _cdhash, all_slices=all_slices)
+    if all_slices:
+        result = [cdhash for i, cdhash in enumerate(result)
+                  if cdhash and cdhash not in result[:i]]
+
+    with _cdhash_cache_lock:
+        if len(_cdhash_cache) >= _CDHASH_CACHE_SIZE:
+            _cdhash_cache.clear()
+        _cdhash_cache[cache_key] = result
+
+    return result
+
+
+_PIN_RE = re.compile(
+    r'^(.*) and (?:cdhash H"[0-9a-fA-F]+"|'
+    r'\(cdhash H"[0-9a-fA-F]+"(?: or cdhash H"[0-9a-fA-F]+")+\))$',
+    re.DOTALL)
+
+
+def unpin_requirement(requirement):
+    """Returns requirement without the CDHash pin --pin-cdhash appended to
+    it, undoing the parentheses it added around requirements with an `or`.
+    Requirements that are not pinned are returned unchanged.
+    """
+    match = _PIN_RE.match(requirement)
+    if not match:
+        return requirement
+
+    requirement = match.group(1)
+    if ' or ' in requirement and requirement.startswith('(') and \
+            requirement.endswith(')'):
+        # Only strip the parentheses if they enclose the whole requirement
+        depth, quoted = 0, False
+        for i, char in enumerate(requirement[:-1]):
+            if char == '"' and requirement[i - 1:i] != '\\':
+                quoted = not quoted
+            elif not quoted and char in '()':
+                depth += 1 if char == '(' else -1
+                if depth == 0:
+                    break
+        else:
+            requirement = requirement[1:-1]
+
+    return requirement
+
+
+class _NoLimit(object):
+    """Stands in for a semaphore when a ToolRunner is unbounded."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class ToolRunner(object):
+    """Runs the external macOS tools tccprofile relies on.
+
+    Every call to codesign and security goes through a runner, which can
+    bound how many of them run at once (max_concurrent; unbounded by default,
+    as the tools mostly wait on I/O and callers already size their thread
+    pools with --jobs). Tool binaries are looked up in
+    tool_dir (or the TCCPROFILE_TOOL_DIR environment variable) when given, so
+    stub scripts can stand in for them off macOS.
+    """
+    TOOLS = {
+        'codesign': '/usr/bin/codesign',
+        'security': '/usr/bin/security',
+    }
+
+    def __init__(self, tool_dir=None, max_concurrent=None):
+        tool_dir = tool_dir or os.environ.get('TCCPROFILE_TOOL_DIR')
+        if tool_dir:
+            self.tools = {
+                name: os.path.join(tool_dir, name) for name in self.TOOLS
+            }
+        else:
+            self.tools = dict(self.TOOLS)
+
+        self.max_concurrent = max_concurrent
+        self._semaphore = threading.BoundedSemaphore(max_concurrent) \
+            if max_concurrent else _NoLimit()
+
+    def run(self, tool, args, input_data=None):
+        """Runs tool with args and returns (returncode, stdout, stderr)."""
+        cmd = [self.tools[tool]] + list(args)
+
+        with self._semaphore, trace_span(tool, 'subprocess', argv=cmd) as span:
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if input_data is not None else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            result, error = process.communicate(input_data)
+            span.args['returncode'] = process.returncode
+
+        return process.returncode, result, error
+
+    def check_output(self, tool, args):
+        """Runs tool with args and returns stdout, raising
+        subprocess.CalledProcessError if it exits non-zero.
+        """
+        returncode, result, error = self.run(tool, args)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(
+                returncode, [self.tools[tool]] + list(args), result)
+
+        return result
+
+
+class ProfileBuild(object):
+    """Handle for a build_profile call running on a background thread."""
+
+    def __init__(self, target, *args, **kwargs):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = list()
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(
+            target=self._run, args=(target, args, kwargs))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, target, args, kwargs):
+        try:
+            self._result = target(*args, **kwargs)
+        except BaseException:
+            self._exc_info = sys.exc_info()
+
+        with self._lock:
+            self._done.set()
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the build to finish and returns its result, re-raising
+        any exception it raised.
+        """
+        if not self._done.wait(timeout):
+            raise TCCProfileException('Profile build did not finish in time')
+
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+        return self._result
+
+    def add_done_callback(self, callback):
+        """Calls callback(build) once the build finishes, on the worker thread
+        (or immediately if it already has).
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback(self)
+
+
+def default_cache_dir():
+    """Returns the per-user directory used for tccprofile's on-disk caches."""
+    if sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+
+    return os.path.join(base, 'tccprofile')
+
+
+# How long the list of signing certificates is reused, in seconds
+SIGNING_CERTS_TTL = 3600
+
+
+def list_signing_certs(runner=None, cache_dir=None, refresh=False,
+                       ttl=SIGNING_CERTS_TTL):
+    """Returns the names of the code signing certificates in the keychain.
+
+    `security find-identity` can take seconds with large keychains, so the
+    list is kept in signing_certs.json in the cache directory and reused for
+    ttl seconds unless refresh is set.
+    """
+    cache_file = os.path.join(cache_dir or default_cache_dir(),
+                              'signing_certs.json')
+
+    if not refresh:
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+            if 0 <= time.time() - cached['fetched'] < ttl:
+                return [str(name) for name in cached['certs']]
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+    runner = runner or ToolRunner()
+    output = runner.check_output(
+        'security', ['find-identity', '-p', 'codesigning', '-v'])
+
+    certs = list()
+    for line in output.split('\n'):
+        certs.extend(re.findall(r'"(.*?)"', line))
+
+    try:
+        try:
+            os.makedirs(os.path.dirname(cache_file))
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        with open(cache_file, 'w') as f:
+            json.dump({'fetched': time.time(), 'certs': certs}, f)
+    except (IOError, OSError):
+        # Not being able to cache the list is no reason to fail
+        pass
+
+    return certs
+
+
+def bundle_fingerprint(path):
+    """Returns a cheap fingerprint for an app bundle or binary at path.
+
+    Built from the inode of the path itself, the inode, size and mtime of the
+    bundle's Info.plist, main executable and _CodeSignature/CodeResources (or
+    of the file itself when it is not a bundle) and the CFBundleVersion, so
+    replacing, updating or re-signing an app changes it.
+    """
+    path = path.rstrip('/')
+    path_stat = os.stat(path)
+    info_plist = os.path.join(path, 'Contents/Info.plist')
+    version = ''
+    parts = [path_stat.st_ino]
+
+    if os.path.isfile(info_plist):
+        targets = [info_plist, os.path.join(
+            path, 'Contents/_CodeSignature/CodeResources')]
+        try:
+            info = read_info_plist(info_plist)
+            version = info.get('CFBundleVersion', '')
+            if info.get('CFBundleExecutable'):
+                targets.append(os.path.join(
+                    path, 'Contents/MacOS', info['CFBundleExecutable']))
+        except Exception:
+            pass
+
+        for target in targets:
+            try:
+                target_stat = os.stat(target)
+            except OSError:
+                parts.extend(['-', '-', '-'])
+                continue
+            parts.extend([target_stat.st_ino, target_stat.st_size,
+                          repr(target_stat.st_mtime)])
+    else:
+        parts.extend([path_stat.st_ino, path_stat.st_size,
+                      repr(path_stat.st_mtime)])
+
+    parts.append(version)
+    return ':'.join(str(part) for part in parts)
+
+
+def app_fingerprints(paths):
+    """Returns {path: bundle_fingerprint(path)} for the paths that exist."""
+    fingerprints = dict()
+    for path in paths:
+        try:
+            fingerprints[path] = bundle_fingerprint(path)
+        except OSError:
+            pass
+
+    return fingerprints
+
+
+def fingerprints_path(profile_path):
+    """Returns where the app fingerprints of the profile at profile_path are
+    recorded, next to it (Foo.mobileconfig -> Foo.fingerprints.json).
+    """
+    return os.path.splitext(profile_path)[0] + '.fingerprints.json'
+
+
+def _fingerprint_or_none(path):
+    """Returns bundle_fingerprint(path), or None if there is nothing at path
+    (which may also be a bundle ID, for DatabaseResolver).
+    """
+    try:
+        return bundle_fingerprint(path)
+    except OSError:
+        return None
+
+
+class RequirementsCache(object):
+    """Persistent store of code requirements keyed by path and fingerprint.
+
+    Entries live in a SQLite database under cache_dir. Lookups for a path whose
+    fingerprint no longer matches are treated as misses, and the least
+    recently used entries are evicted once max_entries is exceeded. When
+    entries were last used is kept in memory and only written out, in one
+    transaction, before evicting and on close (at exit at the latest), so
+    hits never wait on the disk.
+    """
+    DEFAULT_MAX_ENTRIES = 5000
+    FILENAME = 'requirements.sqlite'
+
+    def __init__(self, cache_dir=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_dir = os.path.expanduser(cache_dir or default_cache_dir())
+        self.max_entries = max_entries
+
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+        self._lock = threading.Lock()
+        # {path: last used} for hits not yet written to the database
+        self._last_used = dict()
+        self._db = sqlite3.connect(
+            os.path.join(self.cache_dir, self.FILENAME),
+            check_same_thread=False
+        )
+        # Paths and requirements are UTF-8 byte strings
+        self._db.text_factory = str
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS requirements ('
+            'path TEXT PRIMARY KEY, '
+            'fingerprint TEXT NOT NULL, '
+            'requirement TEXT NOT NULL, '
+            'last_used REAL NOT NULL)'
+        )
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS requirements_last_used '
+            'ON requirements (last_used)'
+        )
+        self._db.commit()
+        atexit.register(self.close)
+
+    def get(self, path):
+        """Returns the cached requirement for path, or None if the path is
+        unknown or has changed since it was cached.
+        """
+        try:
+            fingerprint = bundle_fingerprint(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fingerprint, requirement FROM requirements '
+                'WHERE path = ?', (path,)
+            ).fetchone()
+
+            if not row or row[0] != fingerprint:
+                return None
+
+            self._last_used[path] = time.time()
+
+        return row[1]
+
+    def set(self, path, requirement):
+        """Stores the requirement for path and evicts old entries."""
+        try:
+            fingerprint = bundle_fingerprint(path)
+        except OSError:
+            return
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO requirements '
+                '(path, fingerprint, requirement, last_used) '
+                'VALUES (?, ?, ?, ?)',
+                (path, fingerprint, requirement, time.time())
+            )
+            self._last_used.pop(path, None)
+            self._evict()
+            self._db.commit()
+
+    def _flush_last_used(self):
+        """Writes the last used times recorded by get() to the database."""
+        if self._last_used:
+            self._db.executemany(
+                'UPDATE requirements SET last_used = ? WHERE path = ?',
+                [(when, path) for path, when in self._last_used.items()]
+            )
+            self._last_used.clear()
+
+    def _evict(self):
+        """Drops the least recently used entries above max_entries."""
+        self._flush_last_used()
+        count = self._db.execute(
+            'SELECT COUNT(*) FROM requirements').fetchone()[0]
+
+        if count > self.max_entries:
+            self._db.execute(
+                'DELETE FROM requirements WHERE path IN ('
+                'SELECT path FROM requirements ORDER BY last_used ASC '
+                'LIMIT ?)', (count - self.max_entries,)
+            )
+
+    def close(self):
+        with self._lock:
+            if self._db is None:
+                return
+            self._flush_last_used()
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+
+AppIdentity = namedtuple('AppIdentity', [
+    'path', 'mime_type', 'identifier', 'identifier_type', 'code_requirement'
+])
+
+
+class _PendingInspection(object):
+    """An inspection in progress, which other threads asking for the same
+    path wait on instead of inspecting it again.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._identity = None
+        self._exc_info = None
+
+    def finish(self, identity=None, exc_info=None):
+        self._identity = identity
+        self._exc_info = exc_info
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+        return self._identity
+
+
+class IdentityResolver(object):
+    """Works out the AppIdentity of each app path once per run.
+
+    Every service and AppleEvents pair that references a path shares the same
+    record, so an app is only classified, read and run through codesign once
+    no matter how often it appears. A resolver can be shared by several
+    PrivacyProfiles instances, and threads resolving the same path at the
+    same time share one inspection.
+    """
+
+    def __init__(self, cache=None, runner=None, native=True):
+        self._cache = cache
+        self._runner = runner or ToolRunner()
+        # Read designated requirements in-process where possible
+        self._native = native
+        self._identities = dict()
+        self._lock = threading.Lock()
+        # Inspections in progress, and the fingerprint of each path when it
+        # was inspected
+        self._pending = dict()
+        self._fingerprints = dict()
+
+        # Counters for how much work the resolver did and saved, and the
+        # paths callers have asked for so far (see resolve_many)
+        self.inspections = 0
+        self.saved = 0
+        self._requested = set()
+
+    @staticmethod
+    def normalise(path):
+        """Returns the key paths are shared under."""
+        return os.path.normpath(path)
+
+    def resolve(self, path):
+        """Returns the AppIdentity for path, inspecting it on first use."""
+        key = self.normalise(path)
+
+        with self._lock:
+            identity = self._identities.get(key)
+            if identity:
+                return identity
+
+            pending = self._pending.get(key)
+            if not pending:
+                self._pending[key] = _PendingInspection()
+
+        if pending:
+            return pending.wait()
+
+        try:
+            # Taken first, so changes made during the inspection are caught
+            # by the next invalidate_changed()
+            fingerprint = _fingerprint_or_none(key)
+            identity = self._inspect(key)
+        except BaseException:
+            exc_info = sys.exc_info()
+            with self._lock:
+                pending = self._pending.pop(key)
+            pending.finish(exc_info=exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        with self._lock:
+            self.inspections += 1
+            self._identities[key] = identity
+            self._fingerprints[key] = fingerprint
+            pending = self._pending.pop(key)
+        pending.finish(identity=identity)
+
+        return identity
+
+    def invalidate(self, paths):
+        """Forgets what is known about paths, so they are inspected again."""
+        with self._lock:
+            for path in paths:
+                key = self.normalise(path)
+                self._identities.pop(key, None)
+                self._fingerprints.pop(key, None)
+                self._requested.discard(key)
+
+    def invalidate_changed(self, paths):
+        """Forgets the paths whose fingerprint (see bundle_fingerprint) has
+        changed since they were inspected, e.g. apps that were updated,
+        re-signed in place or removed, for resolvers that outlive a single
+        build.
+        """
+        with self._lock:
+            inspected = [(path, self._fingerprints[self.normalise(path)])
+                         for path in paths
+                         if self.normalise(path) in self._fingerprints]
+
+        stale = [path for path, fingerprint in inspected
+                 if _fingerprint_or_none(self.normalise(path)) != fingerprint]
+        self.invalidate(stale)
+        return stale
+
+    def _inspect(self, path):
+        with trace_span('inspect', 'inspect', path=path):
+            mimetype = self._get_file_mime_type(path=path)
+            identifiers = self._get_identifier_and_type(
+                app_path=path, mimetype=mimetype)
+            return AppIdentity(
+                path=path,
+                mime_type=mimetype,
+                identifier=identifiers['identifier'],
+                identifier_type=identifiers['identifier_type'],
+                code_requirement=self._get_code_sign_requirements(
+                    path=path, mimetype=mimetype)
+            )
+
+    def identify(self, path):
+        """Returns (mime type, identifiers) for path without running codesign."""
+        mimetype = self._get_file_mime_type(path=path)
+        return mimetype, self._get_identifier_and_type(
+            app_path=path, mimetype=mimetype)
+
+    def cdhashes(self, path):
+        """Returns the CDHashes of every slice of the code path's requirement
+        applies to (the interpreter, for scripts), or an empty list if it is
+        not signed.
+        """
+        if self.resolve(path).mime_type in ['x-python', 'x-shellscript']:
+            path = self._read_shebang(app_path=path)
+
+        return read_cdhash(path, all_slices=True)
+
+    def seed(self, identity):
+        """Records an identity worked out elsewhere (e.g. read back from an
+        existing profile) so its path is not inspected again.
+        """
+        with self._lock:
+            key = self.normalise(identity.path)
+            if key not in self._identities:
+                self._identities[key] = identity
+                self.saved += 1
+
+    def _resolve_worker(self, path):
+        """Worker for resolve_many. Exceptions are returned so they can be
+        re-raised on the calling thread.
+        """
+        try:
+            return self.resolve(path), None
+        except BaseException:
+            return None, sys.exc_info()
+
+    def resolve_many(self, paths, jobs=None, count=True):
+        """Resolves every path with a pool of jobs threads (one per CPU by
+        default) and returns their AppIdentity records in the same order.
+
+        Every request for a path that was already asked for (here or in an
+        earlier call) counts as an inspection saved. With count=False the
+        paths are only inspected ahead of the requests that will need them.
+        """
+        paths = list(paths)
+        pending = list()
+        with self._lock:
+            for path in paths:
+                key = self.normalise(path)
+                if count:
+                    if key in self._requested:
+                        self.saved += 1
+                    else:
+                        self._requested.add(key)
+                if key not in self._identities and key not in pending:
+                    pending.append(key)
+
+        if pending:
+            self._inspect_many(pending, jobs)
+
+        with self._lock:
+            return [self._identities[self.normalise(path)] for path in paths]
+
+    def _inspect_many(self, paths, jobs):
+        """Inspects paths in parallel, re-raising the first failure."""
+        jobs = max(1, min(jobs or cpu_count(), len(paths)))
+        if jobs == 1:
+            results = [self._resolve_worker(path) for path in paths]
+        else:
+            pool = ThreadPool(jobs)
+            try:
+                results = pool.map(self._resolve_worker, paths)
+            finally:
+                pool.close()
+                pool.join()
+
+        # Re-raise the first failure in input order so errors are reported
+        # the same way regardless of the number of jobs.
+        for identity, exc_info in results:
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    def stats(self):
+        """Returns counters of inspections run and inspections saved."""
+        with self._lock:
+            return {
+                'apps': len(self._identities),
+                'inspections': self.inspections,
+                'saved': self.saved,
+            }
+
+    @staticmethod
+    def _get_file_mime_type(path):
+        """Returns the mimetype of a given file."""
+        return sniff_mime_type(path)
+
+    @staticmethod
+    def _read_shebang(app_path):
+        """Returns the contents of the shebang in a script file, as long as env
+        is not in the shebang
+        """
+        with open(app_path, 'r') as textfile:
+            line = textfile.readline().rstrip('\n')
+            if line.startswith('#!') and 'env ' not in line:
+                return line.replace('#!', '')
+            elif line.startswith('#!') and 'env ' in line:
+                raise Exception('Cannot check codesign for shebangs that refer to \'env\'.')
+
+    def _get_code_sign_requirements(self, path, mimetype=None):
+        """Returns the values for the CodeRequirement key."""
+        if os.path.exists(path.rstrip('/')):
+            # Handle situations where path is a script, and shebang is
+            # ['/bin/sh', '/bin/bash', '/usr/bin/python']
+            if mimetype is None:
+                mimetype = self._get_file_mime_type(path=path)
+            if mimetype in ['x-python', 'x-shellscript']:
+                path = self._read_shebang(app_path=path)
+
+            if self._native:
+                requirement = read_designated_requirement(path)
+                if requirement:
+                    return requirement
+
+            if self._cache:
+                cached = self._cache.get(path)
+                if cached:
+                    return cached
+
+            returncode, result, error = self._runner.run(
+                'codesign', ['-dr', '-', path])
+
+            if returncode is 0:
+                # For some reason, part of the output gets dumped to stderr, but the bit we need goes to stdout
+                # Also, there can be multiple lines in the result, so handle this properly
+                # There are circumstances where the codesign 'designated => ' is not the start of the line, so handle these.
+                result = result.rstrip('\n').splitlines()
+                result = [line for line in result if 'designated => ' in line][0]
+                result = result.partition('designated => ')
+                result = result[result.index('designated => ') + 1:][0]
+                # result = [x.rstrip('\n') for x in result.splitlines() if x.startswith('designated => ')][0]
+                if self._cache:
+                    self._cache.set(path, result)
+
+                return result
+
+            elif returncode is 1 and 'not signed' in error:
+                raise UnsignedCodeException(
+                    'App at {} is not signed.'.format(path))
+        else:
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    def _get_identifier_and_type(self, app_path, mimetype=None):
         """Checks file type, and returns appropriate values for `Identifier`and
         `IdentifierType` keys in the final profile payload.
         """
-        mimetype = self._get_file_mime_type(path=app_path)
+        if mimetype is None:
+            mimetype = self._get_file_mime_type(path=app_path)
         if mimetype in ['x-shellscript', 'x-python']:
             identifier = app_path
             identifier_type = 'path'
         else:
             try:
-                identifier = read_plist(os.path.join(app_path.rstrip('/'), 'Contents/Info.plist'))['CFBundleIdentifier']
+                identifier = read_info_plist(os.path.join(app_path.rstrip('/'), 'Contents/Info.plist'))['CFBundleIdentifier']
                 identifier_type = 'bundleID'
             except Exception:
                 identifier = app_path.rstrip('/')
                 identifier_type = 'path'
 
-        return {'identifier': identifier, 'identifier_type': identifier_type}
+        return {'identifier': identifier, 'identifier_type': identifier_type}
+
+
+class RequirementsDatabase(object):
+    """SQLite database of app identities, indexed by path and bundle ID.
+
+    It is filled from `scan` indexes taken on a reference Mac, so profiles
+    can be built on hosts that do not have the apps installed (see
+    DatabaseResolver).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS identities ('
+            'path TEXT PRIMARY KEY, '
+            'mime_type TEXT, '
+            'identifier TEXT NOT NULL, '
+            'identifier_type TEXT NOT NULL, '
+            'code_requirement TEXT NOT NULL)'
+        )
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS identities_identifier '
+            'ON identities (identifier)'
+        )
+        self._db.commit()
+
+    def import_scan(self, f):
+        """Imports the records of a `scan` JSON lines index from the file
+        object f, replacing existing records for the same paths. Records
+        with an error are skipped. Returns the number imported.
+        """
+        rows = list()
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            if record.get('error') or not record.get('code_requirement'):
+                continue
+
+            rows.append((
+                IdentityResolver.normalise(record['path']),
+                record.get('mime_type'),
+                record['identifier'],
+                record['identifier_type'],
+                record['code_requirement']
+            ))
+
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO identities '
+                '(path, mime_type, identifier, identifier_type, '
+                'code_requirement) VALUES (?, ?, ?, ?, ?)', rows
+            )
+            self._db.commit()
+
+        return len(rows)
+
+    def lookup(self, path):
+        """Returns the AppIdentity recorded for path, which may also be a
+        bundle ID, or None if there is no record for it.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT path, mime_type, identifier, identifier_type, '
+                'code_requirement FROM identities WHERE path = ?',
+                (IdentityResolver.normalise(path),)
+            ).fetchone()
+
+            if row is None:
+                row = self._db.execute(
+                    'SELECT path, mime_type, identifier, identifier_type, '
+                    'code_requirement FROM identities WHERE identifier = ? '
+                    "AND identifier_type = 'bundleID' ORDER BY path LIMIT 1",
+                    (path,)
+                ).fetchone()
+
+        if row is None:
+            return None
+
+        return AppIdentity(*[
+            value.encode('utf-8') if isinstance(value, unicode) else value
+            for value in row
+        ])
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM identities').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class DatabaseResolver(IdentityResolver):
+    """An IdentityResolver that looks apps up in a RequirementsDatabase
+    instead of inspecting the filesystem, so it never runs a subprocess.
+    """
+
+    def __init__(self, database):
+        IdentityResolver.__init__(self)
+        self.database = database
+
+    def _inspect(self, path):
+        identity = self.database.lookup(path)
+        if identity is None:
+            raise TCCProfileException(
+                'No record for {} in the requirements database {}.'.format(
+                    path, self.database.path))
+
+        # Key the identity by the path it was asked for, which may be a
+        # bundle ID
+        return identity._replace(path=path)
+
+    def cdhashes(self, path):
+        raise TCCProfileException(
+            'Cannot pin {}: CDHashes are not kept in a requirements '
+            'database.'.format(path))
+
+    def identify(self, path):
+        identity = self.resolve(path)
+        return identity.mime_type, {
+            'identifier': identity.identifier,
+            'identifier_type': identity.identifier_type
+        }
+
+
+class Signer(object):
+    """Signs profiles held in memory. Subclasses implement sign()."""
+
+    def sign(self, data):
+        """Returns data wrapped in a signed CMS (PKCS#7) message."""
+        raise NotImplementedError
+
+
+class SecuritySigner(Signer):
+    """Signs with `security cms -S` using a certificate from the keychain.
+    The profile is passed on stdin and read back from stdout.
+    """
+
+    def __init__(self, certificate_name, runner=None):
+        self.certificate_name = certificate_name
+        self._runner = runner or ToolRunner()
+
+    def sign(self, data):
+        returncode, result, error = self._runner.run(
+            'security', ['cms', '-S', '-N', self.certificate_name],
+            input_data=data)
+        if returncode != 0:
+            raise TCCProfileException(
+                'Signing with {} failed: {}'.format(
+                    self.certificate_name, error.strip()))
+
+        return result
+
+
+CRYPTOGRAPHY_MISSING = (
+    'Signing with --sign-identity needs the cryptography package (pip '
+    'install cryptography).')
+
+
+def _pem_blocks(text):
+    """Returns [(label, DER bytes)] for the PEM blocks in text."""
+    return [(label, ''.join(body.split()).decode('base64'))
+            for label, body in re.findall(
+                r'-----BEGIN ([A-Z0-9 ]+)-----(.*?)-----END \1-----',
+                text, re.DOTALL)]
+
+
+class CMSSigner(Signer):
+    """Signs in-process with an RSA identity, producing the same kind of
+    CMS SignedData (SHA-256, PKCS#1 v1.5, signed attributes, certificates
+    included) as `security cms -S`. Works on any platform, but needs the
+    cryptography package.
+    """
+
+    def __init__(self, certificate, key, chain=None):
+        """certificate and chain are DER encoded certificates, key is a
+        DER encoded PKCS#1 or PKCS#8 RSA private key.
+        """
+        try:
+            from cryptography import x509
+            from cryptography.hazmat.backends import default_backend
+            from cryptography.hazmat.primitives import serialization
+        except ImportError:
+            raise TCCProfileException(CRYPTOGRAPHY_MISSING)
+
+        backend = default_backend()
+        try:
+            self.certificate = x509.load_der_x509_certificate(
+                certificate, backend)
+            self.chain = [x509.load_der_x509_certificate(der, backend)
+                          for der in chain or []]
+            self.key = serialization.load_der_private_key(key, None, backend)
+        except ValueError as err:
+            raise TCCProfileException(
+                'Could not load the signing identity: {}'.format(err))
+
+        if self.key.public_key().public_numbers() != \
+                self.certificate.public_key().public_numbers():
+            raise TCCProfileException(
+                'The private key does not match the signing certificate.')
+
+    @classmethod
+    def from_pem(cls, path, key_path=None):
+        """Loads an identity from PEM files: the first certificate in path is
+        the signer, any others are included as its chain. The private key
+        is read from key_path, or from path itself.
+        """
+        with open(path, 'r') as f:
+            blocks = _pem_blocks(f.read())
+        if key_path:
+            with open(key_path, 'r') as f:
+                blocks.extend(_pem_blocks(f.read()))
+
+        certificates = [der for label, der in blocks if label == 'CERTIFICATE']
+        keys = [der for label, der in blocks
+                if label in ['RSA PRIVATE KEY', 'PRIVATE KEY']]
+        if not certificates or not keys:
+            raise TCCProfileException(
+                'No certificate and unencrypted RSA private key found in '
+                '{}.'.format(' and '.join(filter(None, [path, key_path]))))
+
+        return cls(certificates[0], keys[0], certificates[1:])
+
+    @classmethod
+    def from_pkcs12(cls, path, password=None):
+        """Loads an identity from a PKCS#12 (.p12) file."""
+        try:
+            from cryptography.hazmat.backends import default_backend
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.serialization import pkcs12
+        except ImportError:
+            raise TCCProfileException(CRYPTOGRAPHY_MISSING)
+
+        with open(path, 'rb') as f:
+            key, certificate, chain = pkcs12.load_key_and_certificates(
+                f.read(), password, default_backend())
+
+        der = serialization.Encoding.DER
+        return cls(
+            certificate.public_bytes(der),
+            key.private_bytes(der, serialization.PrivateFormat.PKCS8,
+                              serialization.NoEncryption()),
+            [c.public_bytes(der) for c in chain or []])
+
+    def sign(self, data):
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.serialization import pkcs7
+
+        builder = pkcs7.PKCS7SignatureBuilder().set_data(data).add_signer(
+            self.certificate, self.key, hashes.SHA256())
+        for certificate in self.chain:
+            builder = builder.add_certificate(certificate)
+
+        return builder.sign(serialization.Encoding.DER, [])
+
+
+def signer_from_identity(path, key_path=None, password=None):
+    """Returns a CMSSigner for a PEM or PKCS#12 identity file."""
+    if os.path.splitext(path)[1].lower() in ['.p12', '.pfx']:
+        return CMSSigner.from_pkcs12(path, password)
+
+    return CMSSigner.from_pem(path, key_path)
+
+
+def entry_key(entry):
+    """Returns the canonical key used to de-duplicate Services entries: two
+    entries for the same app(s) and code requirements are the same rule, even
+    if their comments differ.
+    """
+    return (
+        entry.get('Identifier'),
+        entry.get('IdentifierType'),
+        entry.get('CodeRequirement'),
+        entry.get('AEReceiverIdentifier'),
+        entry.get('AEReceiverIdentifierType'),
+        entry.get('AEReceiverCodeRequirement'),
+    )
+
+
+def _intern(value):
+    """Interns str values, so each distinct identifier or code requirement is
+    held once however many entries use it.
+    """
+    return intern(value) if type(value) is str else value
+
+
+class ServiceEntry(object):
+    """One Services entry. Slotted, with interned strings, so profiles with a
+    very large number of entries stay small in memory. It reads like the
+    dict it stands for (get, [], items and comparison with dicts) and is only
+    turned into one, by to_dict, when the profile is serialised.
+
+    Keys that are None are left out of the entry.
+    """
+
+    KEYS = (
+        'Allowed',
+        'CodeRequirement',
+        'Comment',
+        'Identifier',
+        'IdentifierType',
+        'AEReceiverIdentifier',
+        'AEReceiverIdentifierType',
+        'AEReceiverCodeRequirement',
+        'StaticCode',
+    )
+    __slots__ = KEYS
+
+    def __init__(self, **kwargs):
+        for key in self.KEYS:
+            value = kwargs.pop(key, None)
+            # Comments are mostly unique, the rest repeat across entries
+            setattr(self, key, value if key == 'Comment' else _intern(value))
+        if kwargs:
+            raise TypeError('Unknown Services keys: {}'.format(
+                ', '.join(sorted(kwargs))))
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.KEYS else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.KEYS
+                if getattr(self, key) is not None]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (ServiceEntry, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ServiceEntry({!r})'.format(self.to_dict())
+
+
+class LazyServiceEntries(object):
+    """The Services entries of one payload type, produced on demand by
+    calling factory(*args) each time they are iterated over.
+    """
+
+    def __init__(self, factory, *args):
+        self._factory = factory
+        self._args = args
+
+    def __iter__(self):
+        return iter(self._factory(*self._args))
+
+
+class StreamingPlistWriter(plistlib.PlistWriter):
+    """plistlib's XML writer, extended to write any iterable (such as
+    LazyServiceEntries) as an array one item at a time, and ServiceEntry
+    objects as dicts. Byte strings are taken to be UTF-8, as paths and
+    command line arguments are.
+    """
+
+    def writeValue(self, value):
+        if isinstance(value, str):
+            try:
+                value.decode('ascii')
+            except UnicodeDecodeError:
+                # plistlib can only encode non-ASCII text given as unicode
+                value = value.decode('utf-8')
+
+        if isinstance(value, ServiceEntry):
+            self.writeDict(value.to_dict())
+        elif isinstance(value, (str, unicode, bool, int, long, float, dict,
+                              list, tuple, plistlib.Data)) or \
+                hasattr(value, 'timetuple'):
+            plistlib.PlistWriter.writeValue(self, value)
+        else:
+            self.writeIterable(value)
+
+    def writeIterable(self, iterable):
+        # Like plistlib's writeArray, which also writes empty arrays as
+        # <array></array> rather than <array/>
+        self.beginElement('array')
+        for value in iterable:
+            self.writeValue(value)
+        self.endElement('array')
+
+
+def write_plist_stream(root_object, f):
+    """Writes root_object to the file object f as an XML plist, producing
+    the same bytes as plistlib.writePlist but writing as it goes.
+    """
+    writer = StreamingPlistWriter(f)
+    writer.writeln('<plist version="1.0">')
+    writer.writeValue(root_object)
+    writer.writeln('</plist>')
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb'):
+    """Opens a temporary file next to path for writing, and only replaces
+    path with it once the block completes, so a failure part way through
+    leaves any existing file at path as it was.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    f = tempfile.NamedTemporaryFile(
+        mode=mode, dir=directory, prefix='.{}.'.format(name), suffix='.tmp',
+        delete=False)
+    try:
+        yield f
+        f.close()
+        try:
+            os.chmod(f.name, os.stat(path).st_mode & 0o7777)
+        except OSError:
+            os.chmod(f.name, 0o644)
+        os.rename(f.name, path)
+    except BaseException:
+        f.close()
+        os.remove(f.name)
+        raise
+
+
+class PrivacyProfiles(object):
+    # List of Payload types to iterate on because lazy code is good code
+    PAYLOADS = [
+        'AddressBook',
+        'Calendar',
+        'Reminders',
+        'Photos',
+        'Camera',
+        'Microphone',
+        'Accessibility',
+        'PostEvent',
+        'SystemPolicyAllFiles',
+        'SystemPolicySysAdminFiles',
+        'AppleEvents'
+    ]
+
+    def __init__(self, payload_description, payload_name, payload_identifier,
+                 payload_organization, payload_version, sign_cert, filename,
+                 cache=None, runner=None, resolver=None, pin_cdhash=False,
+                 signer=None):
+        """Creates a Privacy Preferences Policy Control Profile for macOS
+        Mojave.
+
+        Pass a RequirementsCache as cache to reuse code requirements from
+        previous runs for apps that have not changed. A ToolRunner passed as
+        runner is used for every external tool call, which allows several
+        profiles to share one limit on concurrent subprocesses. Several
+        profiles can also share an IdentityResolver, so each app is only
+        inspected once across all of them.
+
+        With pin_cdhash, every code requirement is narrowed to the exact
+        build of the app (its CDHash) and validated statically.
+
+        The profile is signed with signer (a Signer) if given, otherwise
+        with `security` if sign_cert names a certificate.
+        """
+        # Init the things to put in the template, and elsewhere
+        self.payload_description = payload_description
+        self.payload_name = payload_name
+        self.payload_identifier = payload_identifier
+        self.payload_organization = payload_organization
+        self.payload_type = 'com.apple.TCC.configuration-profile-policy'
+        self.payload_uuid = str(uuid.uuid1()).upper()  # This is used in the 'PayloadContent' part of the profile
+        self.profile_uuid = str(uuid.uuid1()).upper()  # This is used in the root of the profile
+        self.payload_version = payload_version
+
+        # Basic requirements for this profile to work
+        self.template = {
+            'PayloadContent': [
+                {
+                    'PayloadDescription': self.payload_description,
+                    'PayloadDisplayName': self.payload_name,
+                    'PayloadIdentifier': '{}.{}'.format(self.payload_identifier, self.payload_uuid),  # This needs to be different to the root 'PayloadIdentifier'
+                    'PayloadOrganization': self.payload_organization,
+                    'PayloadType': self.payload_type,
+                    'PayloadUUID': self.payload_uuid,
+                    'PayloadVersion': self.payload_version,
+                    'Services': dict()  # This will be an empty list to house the dicts.
+                }
+            ],
+            'PayloadDescription': self.payload_description,
+            'PayloadDisplayName': self.payload_name,
+            'PayloadIdentifier': self.payload_identifier,
+            'PayloadOrganization': self.payload_organization,
+            'PayloadScope': 'system',  # What's the point in making this a user profile?
+            'PayloadType': 'Configuration',
+            'PayloadUUID': self.profile_uuid,
+            'PayloadVersion': self.payload_version,
+        }
+
+        self._app_lists = dict()
+        self._sign_cert = self._set_sign_profile(sign_cert)
+        self._filename = self._set_filename(filename)
+        self._runner = runner or ToolRunner()
+        self.resolver = resolver or IdentityResolver(
+            cache=cache, runner=self._runner)
+        self._pin_cdhash = pin_cdhash
+        if signer is None and self._sign_cert:
+            signer = SecuritySigner(self._sign_cert, runner=self._runner)
+        self.signer = signer
+
+        # The profile being updated, if any (see load_previous), and the
+        # fingerprints of its apps when it was built
+        self._previous = None
+        self._previous_fingerprints = dict()
+
+        # Fingerprints of the apps this profile is built from, recorded next
+        # to the written profile for a later --update-from
+        self._fingerprints = dict()
+
+        # Note, there's different values for the python codesigns depending on which python is called.
+        # /usr/bin/python is com.apple.python
+        # /System/Library/Frameworks/Python.framework/Resources/Python.app is org.python.python
+        # These different codesign values cause issues with LaunchAgents/LaunchDaemons that don't explicitly call
+        # the interpreter in the ProgramArguments array.
+        # For the time being, strongly recommend any LaunchDaemons/LaunchAgents that launch python scripts to
+        # add in <string>/usr/bin/python</string> to the ProgramArguments array _before_ the <string>/path/to/pythonscript.py</string> line.
+
+    @traced('set_services_dict')
+    def set_services_dict(self, args):
+        if not isinstance(args, dict):
+            arguments = vars(args)
+            app_lists = dict()
+
+            # Build up args to pass to the class init
+            app_lists['AddressBook'] = arguments.get(
+                'address_book_apps_list', False)
+            app_lists['Calendar'] = arguments.get('calendar_apps_list', False)
+            app_lists['Reminders'] = arguments.get('reminders_apps_list', False)
+            app_lists['Photos'] = arguments.get('photos_apps_list', False)
+            app_lists['Camera'] = arguments.get('camera_apps_list', False)
+            app_lists['Microphone'] = arguments.get(
+                'microphone_apps_list', False)
+            app_lists['Accessibility'] = arguments.get(
+                'accessibility_apps_list', False)
+            app_lists['PostEvent'] = arguments.get(
+                'post_event_apps_list', False)
+            app_lists['SystemPolicyAllFiles'] = arguments.get(
+                'allfiles_apps_list', False)
+            app_lists['SystemPolicySysAdminFiles'] = arguments.get(
+                'sysadmin_apps_list', False)
+            app_lists['AppleEvents'] = arguments.get('events_apps_list', False)
+        else:
+            app_lists = args
+
+        # Handle if no payload arguments are supplied,
+        # Can't create an empty profile.
+        if not any(app_lists.keys()):
+            print 'You must provide at least one payload type to create a profile.'
+            raise TCCProfileException
+
+        self._app_lists = app_lists
+
+        # Create payload lists in the services_dict
+        for payload in self.PAYLOADS:
+            if app_lists.get(payload):
+                self.template['PayloadContent'][0]['Services'][payload] = []
+
+    def load_previous(self, path, reuse_requirements=True):
+        """Bases this profile on an existing, unsigned .mobileconfig.
+
+        The existing profile's UUIDs are kept so it is replaced when
+        deployed, entries for apps whose fingerprint (see bundle_fingerprint)
+        is the one recorded when it was built are carried over without
+        re-inspecting them, and report_changes can tell what is different.
+        Without a fingerprints file next to it, or with
+        reuse_requirements=False, every app is inspected again (or taken from
+        the resolver).
+        """
+        try:
+            previous = plistlib.readPlist(path)
+            payload = previous['PayloadContent'][0]
+            payload['Services']
+        except Exception:
+            raise TCCProfileException(
+                'Cannot read the profile at {}. Only unsigned profiles can be '
+                'updated.'.format(path))
+
+        self._previous = previous
+        self._previous_fingerprints = dict()
+        if reuse_requirements:
+            try:
+                with open(fingerprints_path(path)) as f:
+                    self._previous_fingerprints = {
+                        app.encode('utf-8'): str(fingerprint)
+                        for app, fingerprint in json.load(f).items()}
+            except (IOError, OSError, ValueError, AttributeError):
+                pass
+
+        self.profile_uuid = previous['PayloadUUID']
+        self.payload_uuid = payload['PayloadUUID']
+        self.template['PayloadUUID'] = self.profile_uuid
+        self.template['PayloadContent'][0]['PayloadUUID'] = self.payload_uuid
+        self.template['PayloadContent'][0]['PayloadIdentifier'] = \
+            payload['PayloadIdentifier']
+
+    def _previous_services(self):
+        return self._previous['PayloadContent'][0]['Services']
+
+    def _seed_from_previous(self, paths):
+        """Seeds the resolver with the code requirements recorded in the
+        previous profile for every app whose fingerprint has not changed
+        since it was built.
+        """
+        # Pinned entries are seeded with the requirement they were pinned
+        # to, so pinning again appends the current CDHashes rather than
+        # adding to the old ones
+        requirements = dict()
+        for entries in self._previous_services().values():
+            for entry in entries:
+                unpin = unpin_requirement if entry.get('StaticCode') else str
+                requirements[(entry['Identifier'], entry['IdentifierType'])] = \
+                    unpin(entry['CodeRequirement'])
+                if 'AEReceiverIdentifier' in entry:
+                    requirements[(entry['AEReceiverIdentifier'],
+                                  entry['AEReceiverIdentifierType'])] = \
+                        unpin(entry['AEReceiverCodeRequirement'])
+
+        for path in paths:
+            fingerprint = self._fingerprints.get(path)
+            if not fingerprint or \
+                    fingerprint != self._previous_fingerprints.get(path):
+                continue
+
+            mimetype, identifiers = self.resolver.identify(path)
+            requirement = requirements.get(
+                (identifiers['identifier'], identifiers['identifier_type']))
+            if requirement:
+                self.resolver.seed(AppIdentity(
+                    path=path,
+                    mime_type=mimetype,
+                    identifier=identifiers['identifier'],
+                    identifier_type=identifiers['identifier_type'],
+                    code_requirement=str(requirement)
+                ))
+
+    @staticmethod
+    def _entry_key(entry):
+        """Returns what identifies the app(s) a Services entry is for."""
+        return (
+            entry.get('Identifier'),
+            entry.get('IdentifierType'),
+            entry.get('AEReceiverIdentifier'),
+            entry.get('AEReceiverIdentifierType')
+        )
+
+    def report_changes(self, stream=sys.stderr):
+        """Writes the entries added, removed or changed since the previous
+        profile to stream. Returns False if the profile is identical to the
+        previous one.
+        """
+        if self._previous is None:
+            return True
+
+        previous_services = self._previous_services()
+        services = self.template['PayloadContent'][0]['Services']
+
+        for payload in sorted(set(previous_services) | set(services)):
+            old = {self._entry_key(e): e for e in previous_services.get(payload, [])}
+            new = {self._entry_key(e): e for e in services.get(payload, [])}
+
+            for key in sorted(set(old) | set(new)):
+                name = key[0] if not key[2] else '{} -> {}'.format(key[0], key[2])
+                if key not in old:
+                    stream.write('{}: added {}\n'.format(payload, name))
+                elif key not in new:
+                    stream.write('{}: removed {}\n'.format(payload, name))
+                elif old[key] != new[key]:
+                    stream.write('{}: updated {}\n'.format(payload, name))
+
+        if self.template == self._previous:
+            stream.write('Profile is unchanged.\n')
+            return False
+
+        return True
+
+    def _plan_inspections(self):
+        """Returns every unique app path referenced by the services and
+        AppleEvents pairs, in the order they first appear.
+        """
+        paths = list()
+        seen = set()
+
+        for path in self._referenced_paths():
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+
+        return paths
+
+    def _referenced_paths(self):
+        """Yields the app path of every reference in the services and
+        AppleEvents pairs, including repeats.
+        """
+        for payload in self.PAYLOADS:
+            for app in self._app_lists.get(payload) or []:
+                if payload == 'AppleEvents':
+                    if not len(app.split(',')) == 2:
+                        print 'AppleEvents applications must be in the format of /Application/Path/EventSending.app,/Application/Path/EventReceiving.app'
+                        sys.exit(1)
+                    apps = app.split(',')
+                else:
+                    apps = [app]
+
+                for path in apps:
+                    yield path
+
+    @traced('build_profile')
+    def build_profile(self, allow, jobs=None, lazy=False):
+        """Builds the Services entries for every app passed to
+        set_services_dict.
+
+        With lazy=True the apps are still inspected here, but the entries are
+        only assembled as write() streams them out, so they are never all held
+        in memory at once.
+        """
+        # Inspect every app up front, in parallel, then assemble the payloads
+        # in order from the results.
+        paths = self._plan_inspections()
+        # Taken before inspecting, so a change made during the build is seen
+        # by the next --update-from
+        self._fingerprints = app_fingerprints(paths)
+        if self._previous is not None:
+            self._seed_from_previous(paths)
+        # Every reference is requested, so the resolver's stats count each
+        # app referenced more than once as inspections saved
+        self.resolver.resolve_many(self._referenced_paths(), jobs=jobs)
+
+        previous = dict()
+        if self._previous is not None:
+            for payload, entries in self._previous_services().items():
+                previous[payload] = {self._entry_key(e): e for e in entries}
+
+        services = self.template['PayloadContent'][0]['Services']
+        for payload in self.PAYLOADS:
+            if self._app_lists.get(payload):
+                entries = LazyServiceEntries(
+                    self._iter_entries, payload, allow, previous)
+                services[payload] = entries if lazy else list(entries)
+
+    @staticmethod
+    def _app_name(app):
+        """Returns the name used for app in comments: the bundle name for
+        a .app path, the file name for other paths, and bundle IDs (as given
+        with --requirements-db) unchanged.
+        """
+        if '/' not in app:
+            return app
+
+        name = os.path.basename(app.rstrip('/'))
+        if name.endswith('.app'):
+            name = name[:-len('.app')]
+        return name
+
+    def _iter_entries(self, payload, allow, previous):
+        """Yields the de-duplicated Services entries for one payload type."""
+        # Index of the entries yielded so far, see entry_key
+        seen = set()
+
+        for app in self._app_lists[payload]:
+            if payload in ['Camera', 'Microphone']:  # Camera and Microphone payloads can only DENY an app access to that hardware.
+                _allow = False
+                allow_statement = 'Deny'
+            else:
+                _allow = allow
+                allow_statement = 'Allow'
+
+            if payload == 'AppleEvents':  # AppleEvent payload has additional requirements
+                if not len(app.split(',')) == 2:
+                    print 'AppleEvents applications must be in the format of /Application/Path/EventSending.app,/Application/Path/EventReceiving.app'
+                    sys.exit(1)
+                else:
+                    sending_app = app.split(',')[0]
+                    receiving_app = app.split(',')[1]
+                    sending_app_name = self._app_name(sending_app)
+                    receiving_app_name = self._app_name(receiving_app)
+                    codesign_result = self._get_code_sign_requirements(
+                        path=app.split(',')[0])
+                    payload_dict = self._build_payload(
+                        app_path=app, allowed=allow, apple_event=True,
+                        code_requirement=codesign_result,
+                        comment='{} {} to send {} control to {}'.format(
+                            allow_statement, sending_app_name, payload,
+                            receiving_app_name))
+
+            else:
+                app_name = self._app_name(app)
+                codesign_result = self._get_code_sign_requirements(
+                    path=app)
+                payload_dict = self._build_payload(
+                    app_path=app,
+                    allowed=_allow,
+                    apple_event=False,
+                    code_requirement=codesign_result,
+                    comment='{} {} control for {}'.format(
+                        allow_statement,
+                        payload,
+                        app_name
+                    )
+                )
+
+            # Keep entries from the previous profile as they were
+            # (including any hand edits) if nothing about them changed
+            carried = previous.get(payload, {}).get(
+                self._entry_key(payload_dict or {}))
+            if payload_dict and carried and all(carried.get(k) == v for k, v in payload_dict.items() if k != 'Comment'):
+                payload_dict = carried
+
+            key = entry_key(payload_dict) if payload_dict else None
+            if key not in seen:
+                seen.add(key)
+                yield payload_dict
+
+    def build_profile_async(self, allow, jobs=None):
+        """Runs build_profile on a background thread. Returns a ProfileBuild;
+        call its result() to wait for the build and surface any error.
+        """
+        return ProfileBuild(self.build_profile, allow=allow, jobs=jobs)
+
+    @traced('serialize')
+    def to_bytes(self):
+        """Returns the unsigned profile as plist data."""
+        buf = cStringIO.StringIO()
+        write_plist_stream(self.template, buf)
+        return buf.getvalue()
+
+    @traced('write')
+    def write(self):
+        if self._filename and self.signer:
+            # Keep the data in memory, it is needed again for signing
+            data = self.to_bytes()
+            with atomic_write(self._filename) as f:
+                f.write(data)
+
+            self._sign_profile(data)
+        elif self._filename:
+            # Write the plist out to file. Entries may still be built as it
+            # is written, so an error leaves the existing profile in place.
+            with atomic_write(self._filename) as f:
+                write_plist_stream(self.template, f)
+        else:
+            # Print as formatted plist out to stdout
+            write_plist_stream(self.template, sys.stdout)
+
+        if self._filename and self._fingerprints:
+            with atomic_write(fingerprints_path(self._filename), 'w') as f:
+                json.dump(self._fingerprints, f, indent=4, sort_keys=True)
+
+    @staticmethod
+    def _set_sign_profile(sign_cert):
+        if sign_cert and len(sign_cert):
+            return sign_cert[0]
+        else:
+            return False
+
+    @staticmethod
+    def _set_filename(filename):
+        if filename:
+            _filename = os.path.expandvars(os.path.expanduser(filename))
+            if not os.path.splitext(filename)[1] == '.mobileconfig':
+                _filename = filename.replace(os.path.splitext(filename)[1], '.mobileconfig')
+
+            return _filename
+        else:
+            return None
+
+    def _get_code_sign_requirements(self, path):
+        """Returns the values for the CodeRequirement key."""
+        return self.resolver.resolve(path).code_requirement
+
+    def _get_identifier_and_type(self, app_path):
+        """Returns the values for the `Identifier` and `IdentifierType` keys."""
+        identity = self.resolver.resolve(app_path)
+        return {
+            'identifier': identity.identifier,
+            'identifier_type': identity.identifier_type
+        }
+
+    def _build_payload(self, app_path, allowed, apple_event, code_requirement, comment):
+        """Builds an Accessibility payload for the profile."""
+        if type(allowed) is bool and type(code_requirement) is str and type(apple_event) is bool:
+            # Check if building an Apple Event. The sending app and receiving app must be seperated by comma
+            # Example: ['/Applications/Foo.app,/Applications/Bar.app']
+            # The receiving app is the second/last app in the "list" (splits on comma)
+            if apple_event and ',' in app_path and len(app_path.split(',')) == 2:
+                receiving_app = app_path.split(',')[1]
+                app_path = app_path.split(',')[0]
+                receiving_app_identifiers = self._get_identifier_and_type(app_path=receiving_app)
+                receiving_app_identifier = receiving_app_identifiers['identifier']
+                receiving_app_identifier_type = receiving_app_identifiers['identifier_type']
+            elif apple_event and ',' not in app_path and len(app_path.split(',')) == 2:
+                print 'AppleEvents applications must be in the format of /Application/Path/EventSending.app,/Application/Path/EventReceiving.app'
+                sys.exit(1)
+
+            app_identifiers = self._get_identifier_and_type(app_path=app_path)
+            identifier = app_identifiers['identifier']
+            identifier_type = app_identifiers['identifier_type']
+
+            if self._pin_cdhash:
+                code_requirement = self._pin_requirement(app_path, code_requirement)
+
+            # Only return a basic entry, even though the Services needs a dict
+            # supplied, and the 'Accessibility' "payload" is a list of dicts.
+            result = dict(
+                Allowed=allowed,
+                CodeRequirement=code_requirement,
+                Comment=comment,
+                Identifier=identifier,
+                IdentifierType=identifier_type,
+            )
+
+            # If the payload is an AppleEvent type, there are additional
+            # requirements relating to the receiving app.
+            if apple_event:
+                result['AEReceiverIdentifier'] = receiving_app_identifier
+                result['AEReceiverIdentifierType'] = receiving_app_identifier_type
+                result['AEReceiverCodeRequirement'] = self._get_code_sign_requirements(path=receiving_app)
+                if self._pin_cdhash:
+                    result['AEReceiverCodeRequirement'] = self._pin_requirement(
+                        receiving_app, result['AEReceiverCodeRequirement'])
+
+            if self._pin_cdhash:
+                result['StaticCode'] = True
+
+            return ServiceEntry(**result)
+
+    def _pin_requirement(self, path, code_requirement):
+        """Appends the CDHash of the app at path to its code requirement. A
+        universal app is pinned to the CDHash of each of its slices, as the
+        slice that runs depends on the Mac.
+        """
+        cdhashes = self.resolver.cdhashes(path)
+        if not cdhashes:
+            raise TCCProfileException(
+                'Cannot pin {}: it has no CDHash.'.format(path))
+
+        if ' or ' in code_requirement:
+            code_requirement = '({})'.format(code_requirement)
+
+        pin = ' or '.join('cdhash H"{}"'.format(cdhash) for cdhash in cdhashes)
+        if len(cdhashes) > 1:
+            pin = '({})'.format(pin)
+
+        return '{} and {}'.format(code_requirement, pin)
+
+    @traced('_sign_profile')
+    def _sign_profile(self, data):
+        """Signs the profile data, writing it next to the unsigned profile."""
+        signed = self.signer.sign(data)
+        with atomic_write(self._filename.replace('.mobileconfig', '_Signed.mobileconfig')) as f:
+            f.write(signed)
+
+
+def write_profiles(profiles, jobs=None):
+    """Writes several profiles, serialising and signing them concurrently."""
+    pool = ThreadPool(jobs or cpu_count())
+    try:
+        pool.map(lambda profile: profile.write(), profiles)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class SaneUsageFormat(argparse.HelpFormatter):
+    """Makes the help output somewhat more sane. Code used was from Matt Wilkie.
+
+    http://stackoverflow.com/questions/9642692/argparse-help-without-duplicate-allcaps/9643162#9643162
+    """
+
+    def _get_default_metavar_for_positional(self, action):
+        # Python 2's HelpFormatter does not have this
+        return action.dest
+
+    def _format_action_invocation(self, action):
+        if not action.option_strings:
+            default = self._get_default_metavar_for_positional(action)
+            metavar, = self._metavar_formatter(action, default)(1)
+            return metavar
+        else:
+            parts = []
+            # if the Optional doesn't take a value, format is:
+            #    -s, --long
+            if action.nargs == 0:
+                parts.extend(action.option_strings)
+            # if the Optional takes a value, format is:
+            #    -s ARGS, --long ARGS
+            else:
+                default = self._get_default_metavar_for_optional(action)
+                args_string = self._format_args(action, default)
+                for option_string in action.option_strings:
+                    parts.append(option_string)
+                return '{} {}'.format(', '.join(parts), args_string)
+            return ', '.join(parts)
+
+    def _get_default_metavar_for_optional(self, action):
+        return action.dest.upper()
+
+
+def add_inspection_arguments(parser):
+    """Adds the options that control how apps are inspected."""
+    parser.add_argument(
+        '--requirements-db',
+        type=str,
+        dest='requirements_db',
+        metavar='database',
+        help='Look apps up in a requirements database (see the db command) '
+             'instead of inspecting them, so they do not need to be '
+             'installed.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        dest='jobs',
+        metavar='jobs',
+        help='Number of apps to inspect in parallel, which also bounds how '
+             'many codesign calls run at once. Defaults to the number of '
+             'CPUs; as inspecting mostly waits on codesign, more jobs than '
+             'CPUs usually helps.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        dest='verbose',
+        default=False,
+        help='Print how many apps were inspected to stderr.',
+        required=False
+    )
+
+    parser.add_argument(
+        '--always-codesign',
+        action='store_true',
+        dest='always_codesign',
+        default=False,
+        help='Always run codesign instead of reading designated '
+             'requirements from binaries directly.',
+        required=False
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        dest='no_cache',
+        default=False,
+        help='Do not read or write the on-disk code requirements cache.',
+        required=False
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        dest='cache_dir',
+        metavar='cache_dir',
+        help='Directory for the code requirements cache. Defaults to '
+             '~/Library/Caches/tccprofile.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--trace',
+        type=str,
+        dest='trace',
+        metavar='trace_file',
+        help='Write a Chrome trace-event JSON file with the time spent in '
+             'each build phase and every codesign/security call.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--cprofile',
+        type=str,
+        dest='cprofile',
+        metavar='stats_file',
+        help='Profile the run (including its worker threads) with cProfile '
+             'and write the pstats to this file.',
+        required=False,
+    )
+
+
+@contextlib.contextmanager
+def instrumented(args):
+    """Traces and/or profiles the block as the --trace and --cprofile
+    options ask, writing the results when it exits.
+
+    cProfile only sees the thread it is enabled on, so every thread started
+    in the block (e.g. the inspection workers) gets its own profiler, and
+    their stats are merged into one file.
+    """
+    tracer = Tracer() if args.trace else None
+    install_tracer(tracer)
+    profilers = list()
+    if args.cprofile:
+        import cProfile
+        lock = threading.Lock()
+
+        def profile_thread(frame, event, arg):
+            # Called on the new thread's first event; enabling the profiler
+            # replaces this hook
+            profiler = cProfile.Profile()
+            with lock:
+                profilers.append(profiler)
+            profiler.enable()
+
+        threading.setprofile(profile_thread)
+        profile_thread(None, None, None)
+
+    try:
+        yield
+    finally:
+        if profilers:
+            import pstats
+            threading.setprofile(None)
+            profilers[0].disable()
+            with lock:
+                stats = pstats.Stats(profilers[0])
+                for profiler in profilers[1:]:
+                    stats.add(profiler)
+            stats.dump_stats(args.cprofile)
+        if tracer:
+            install_tracer(None)
+            tracer.write(args.trace)
+
+
+def resolver_from_args(args):
+    """Returns the IdentityResolver the inspection options ask for."""
+    if args.requirements_db:
+        if not os.path.exists(args.requirements_db):
+            raise TCCProfileException(
+                'No requirements database at {}'.format(args.requirements_db))
+        return DatabaseResolver(RequirementsDatabase(args.requirements_db))
+
+    return IdentityResolver(
+        cache=None if args.no_cache else RequirementsCache(args.cache_dir),
+        runner=ToolRunner(max_concurrent=args.jobs),
+        native=not args.always_codesign)
+
+
+def add_signing_arguments(parser, keychain=True):
+    """Adds the options for signing written profiles to parser. With keychain
+    False, only the in-process signing options are added.
+    """
+    if not keychain:
+        parser.set_defaults(sign_profile=None)
+    else:
+        parser.add_argument(
+            '-s', '--sign',
+            type=str,
+            nargs=1,
+            dest='sign_profile',
+            metavar='certificate_name',
+            help='Signs a profile using the specified Certificate Name. To '
+                 'list code signing certificate names: /usr/bin/security '
+                 'find-identity -p codesigning -v',
+            required=False,
+        )
+
+    parser.add_argument(
+        '--sign-identity',
+        type=str,
+        dest='sign_identity',
+        metavar='identity_file',
+        help='Signs a profile in-process (on any platform) with a PEM file '
+             'holding a certificate and its RSA private key, or with a '
+             'PKCS#12 file whose password is in TCCPROFILE_IDENTITY_PASSWORD.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--sign-key',
+        type=str,
+        dest='sign_key',
+        metavar='key_file',
+        help='PEM private key for --sign-identity, if it is not in the '
+             'identity file.',
+        required=False,
+    )
+
+
+def signer_from_args(args):
+    """Returns the Signer for --sign-identity, or None."""
+    if not args.sign_identity:
+        return None
+
+    if args.sign_profile:
+        raise TCCProfileException(
+            'Use either --sign or --sign-identity, not both.')
+
+    return signer_from_identity(
+        args.sign_identity, key_path=args.sign_key,
+        password=os.environ.get('TCCPROFILE_IDENTITY_PASSWORD'))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(formatter_class=SaneUsageFormat)
+
+    parser.add_argument(
+        '--ab', '--address-book',
+        type=str,
+        nargs='*',
+        dest='address_book_apps_list',
+        metavar='<app paths>',
+        help='Generate an AddressBook payload for the specified applications.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--cal', '--calendar',
+        type=str,
+        nargs='*',
+        dest='calendar_apps_list',
+        metavar='<app paths>',
+        help='Generate a Calendar payload for the specified applications.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--rem', '--reminders',
+        type=str,
+        nargs='*',
+        dest='reminders_apps_list',
+        metavar='<app paths>',
+        help='Generate a Reminders payload for the specified applications.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--pho', '--photos',
+        type=str,
+        nargs='*',
+        dest='photos_apps_list',
+        metavar='<app paths>',
+        help='Generate a Photos payload for the specified applications.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--cam', '--camera',
+        type=str,
+        nargs='*',
+        dest='camera_apps_list',
+        metavar='<app paths>',
+        help='Generate a Camera payload for the specified applications. '
+             'This will be a DENY payload.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--mic', '--microphone',
+        type=str,
+        nargs='*',
+        dest='microphone_apps_list',
+        metavar='<app paths>',
+        help='Generate a Microphone payload for the specified applications. '
+             'This will be a DENY payload.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--acc', '--accessibility',
+        type=str,
+        nargs='*',
+        dest='accessibility_apps_list',
+        metavar='<app paths>',
+        help='Generate an Accessibility payload for the specified applications.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--pe', '--post-event',
+        type=str,
+        nargs='*',
+        dest='post_event_apps_list',
+        metavar='<app paths>',
+        help='Generate a PostEvent payload for the specified applications to '
+             'allow CoreGraphics APIs to send CGEvents.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--af', '--allfiles',
+        type=str,
+        nargs='*',
+        dest='allfiles_apps_list',
+        metavar='<app paths>',
+        help='Generate an SystemPolicyAllFiles payload for the specified '
+             'applications. This applies to all protected system files.',
+        required=False,
+    )
+
+    parser.add_argument(
+        '--ae', '--appleevents',
+        type=str,
+        nargs='*',
+        dest='events_apps_list',
+        metavar='<app paths>',
+        help='Generate an AppleEvents payload for the specified applications. '
+             'This allows applications to send restricted AppleEvents to '
+             'another process',
+        required=False,
+    )
 
-    def _build_payload(self, app_path, allowed, apple_event, code_requirement, comment):
-        """Builds an Accessibility payload for the profile."""
-        if type(allowed) is bool and type(code_requirement) is str and type(apple_event) is bool:
-            # Check if building an Apple Event. The sending app and receiving app must be seperated by comma
-            # Example: ['/Applications/Foo.app,/Applications/Bar.app']
-            # The receiving app is the second/last app in the "list" (splits on comma)
-            if apple_event and ',' in app_path and len(app_path.split(',')) == 2:
-                receiving_app = app_path.split(',')[1]
-                app_path = app_path.split(',')[0]
-                receiving_app_identifiers = self._get_identifier_and_type(app_path=receiving_app)
-                receiving_app_identifier = receiving_app_identifiers['identifier']
-                receiving_app_identifier_type = receiving_app_identifiers['identifier_type']
-            elif apple_event and ',' not in app_path and len(app_path.split(',')) == 2:
-                print 'AppleEvents applications must be in the format of /Application/Path/EventSending.app,/Application/Path/EventReceiving.app'
-                sys.exit(1)
+    parser.add_argument(
+        '--sf', '--sysadminfiles',
+        type=str,
+        nargs='*',
+        dest='sysadmin_apps_list',
+        metavar='<app paths>',
+        help='Generate an SystemPolicySysAdminFiles payload for the specified '
+             'applications.This applies to some files used in system '
+             'administration.',
+        required=False,
+    )
 
-            app_identifiers = self._get_identifier_and_type(app_path=app_path)
-            identifier = app_identifiers['identifier']
-            identifier_type = app_identifiers['identifier_type']
+    parser.add_argument(
+        '--allow',
+        action='store_true',
+        dest='allow_app',
+        default=False,
+        help='Configure the profile to allow control for all apps provided '
+             'with the --apps command.',
+        required=False
+    )
 
-            # Only return a basic dict, even though the Services needs a dict
-            # supplied, and the 'Accessibility' "payload" is a list of dicts.
-            result = {
-                'Allowed': allowed,
-                'CodeRequirement': code_requirement,
-                'Comment': comment,
-                'Identifier': identifier,
-                'IdentifierType': identifier_type,
-            }
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        dest='payload_filename',
+        metavar='payload_filename',
+        help='Filename to save the profile as.',
+        required=False,
+    )
 
-            # If the payload is an AppleEvent type, there are additional
-            # requirements relating to the receiving app.
-            if apple_event:
-                result['AEReceiverIdentifier'] = receiving_app_identifier
-                result['AEReceiverIdentifierType'] = receiving_app_identifier_type
-                result['AEReceiverCodeRequirement'] = self._get_code_sign_requirements(path=receiving_app)
+    parser.add_argument(
+        '--pd', '--payload-description',
+        type=str,
+        dest='payload_description',
+        metavar='payload_description',
+        help='A short and sweet description of the payload.',
+        required=True,
+    )
+
+    parser.add_argument(
+        '--pi', '--payload-identifier',
+        type=str,
+        dest='payload_identifier',
+        metavar='payload_identifier',
+        help='An identifier to use for the profile. Example: org.foo.bar',
+        required=True,
+    )
+
+    parser.add_argument(
+        '--pn', '--payload-name',
+        type=str,
+        dest='payload_name',
+        metavar='payload_name',
+        help='A short and sweet name for the payload.',
+        required=True,
+    )
+
+    parser.add_argument(
+        '--po', '--payload-org',
+        type=str,
+        dest='payload_org',
+        metavar='payload_org',
+        help='Organization to use for the profile.',
+        required=True,
+    )
+
+    parser.add_argument(
+        '--pv', '--payload-version',
+        type=int,
+        dest='payload_ver',
+        metavar='payload_version',
+        help='Version to use for the profile.',
+        required=True,
+    )
 
-            return result
+    add_signing_arguments(parser)
 
-    def _sign_profile(self, certificate_name, input_file):
-        """Signs the profile."""
-        if self._sign_cert and os.path.exists(input_file) and input_file.endswith('.mobileconfig'):
-            cmd = ['/usr/bin/security', 'cms', '-S', '-N', certificate_name, '-i', input_file, '-o', '{}'.format(input_file.replace('.mobileconfig', '_Signed.mobileconfig'))]
-            subprocess.call(cmd)
+    parser.add_argument(
+        '--update-from',
+        type=str,
+        dest='update_from',
+        metavar='existing_profile',
+        help='Update an existing unsigned profile: keep its UUIDs, only '
+             're-inspect apps modified since it was written, report what '
+             'changed and skip writing if nothing did.',
+        required=False,
+    )
 
+    parser.add_argument(
+        '--pin-cdhash',
+        action='store_true',
+        dest='pin_cdhash',
+        default=False,
+        help='Pin each code requirement to the CDHash of the installed '
+             'build of the app, and set StaticCode. Pinned entries stop '
+             'matching when the app is updated.',
+        required=False,
+    )
 
-class SaneUsageFormat(argparse.HelpFormatter):
-    """Makes the help output somewhat more sane. Code used was from Matt Wilkie.
+    add_inspection_arguments(parser)
 
-    http://stackoverflow.com/questions/9642692/argparse-help-without-duplicate-allcaps/9643162#9643162
+    # parser.add_argument(
+    #     '--lg', '--launch-gui',
+    #     action='store_true',
+    #     default=False,
+    #     dest='launch_gui',
+    #     help='Launch the GUI and populate the provided values passed via the '
+    #          'arguments.',
+    #     required=False
+    # )
+
+    return parser
+
+
+def parse_args(argv=None):
+    return build_parser().parse_args(argv)
+
+
+def profile_from_args(args, resolver):
+    """Returns a PrivacyProfiles instance, with its services set, for parsed
+    arguments.
     """
+    signer = signer_from_args(args)
 
-    def _format_action_invocation(self, action):
-        if not action.option_strings:
-            default = self._get_default_metavar_for_positional(action)
-            metavar, = self._metavar_formatter(action, default)(1)
-            return metavar
+    tcc_profile = PrivacyProfiles(
+        payload_description=args.payload_description,
+        payload_name=args.payload_name,
+        payload_identifier=args.payload_identifier,
+        payload_organization=args.payload_org,
+        payload_version=args.payload_ver,
+        sign_cert=args.sign_profile,
+        filename=args.payload_filename,
+        resolver=resolver,
+        pin_cdhash=args.pin_cdhash,
+        signer=signer
+    )
+
+    if args.update_from:
+        tcc_profile.load_previous(args.update_from)
+
+    # Insert the service dict into the template
+    tcc_profile.set_services_dict(args)
+
+    return tcc_profile
+
+
+def read_manifest(path):
+    """Reads a batch manifest and returns a list with one dict per profile.
+
+    JSON and YAML manifests hold a list of profiles (or a dict with a
+    'profiles' list). CSV manifests have one profile per row, with multiple
+    app paths in a cell separated by ';'.
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.csv':
+        with open(path, 'rb') as f:
+            profiles = list()
+            for row in csv.DictReader(f):
+                profiles.append({k: v for k, v in row.items() if k and v})
+            return profiles
+
+    with open(path, 'r') as f:
+        if extension in ['.yaml', '.yml']:
+            try:
+                import yaml
+            except ImportError:
+                raise TCCProfileException(
+                    'PyYAML is required to read YAML manifests.')
+            manifest = yaml.safe_load(f)
         else:
-            parts = []
-            # if the Optional doesn't take a value, format is:
-            #    -s, --long
-            if action.nargs == 0:
-                parts.extend(action.option_strings)
-            # if the Optional takes a value, format is:
-            #    -s ARGS, --long ARGS
-            else:
-                default = self._get_default_metavar_for_optional(action)
-                args_string = self._format_args(action, default)
-                for option_string in action.option_strings:
-                    parts.append(option_string)
-                return '{} {}'.format(', '.join(parts), args_string)
-            return ', '.join(parts)
+            manifest = json.load(f)
 
-    def _get_default_metavar_for_optional(self, action):
-        return action.dest.upper()
+    if isinstance(manifest, dict):
+        manifest = manifest.get('profiles')
 
+    if not isinstance(manifest, list):
+        raise TCCProfileException(
+            'Manifest {} must contain a list of profiles.'.format(path))
 
-def parse_args():
-    parser = argparse.ArgumentParser(formatter_class=SaneUsageFormat)
+    return manifest
+
+
+def _manifest_str(value):
+    """Returns a manifest value as a byte string, like the command line
+    arguments it stands in for. JSON and YAML give text as unicode, which
+    str() cannot take when it is not ASCII (e.g. /Applications/Café.app).
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def manifest_entry_to_argv(entry, parser):
+    """Converts one manifest profile into the command line arguments
+    parse_args accepts. Keys may be any long option name (with or without
+    the leading dashes) or argument dest, e.g. 'accessibility',
+    '--payload-name' or 'payload_ver'.
+    """
+    actions = dict()
+    for action in parser._actions:
+        for option in action.option_strings:
+            actions[option.lstrip('-')] = action
+            actions[option.lstrip('-').replace('-', '_')] = action
+        actions[action.dest] = action
+
+    argv = list()
+    for key, value in sorted(entry.items()):
+        action = actions.get(key.lstrip('-'))
+        if not action or not action.option_strings:
+            raise TCCProfileException('Unknown manifest field: {}'.format(key))
+
+        option = action.option_strings[-1]
+        if action.nargs == 0:
+            if _manifest_str(value).lower() in ['1', 'true', 'yes']:
+                argv.append(option)
+        elif action.nargs == '*':
+            if not isinstance(value, list):
+                value = [v.strip() for v in _manifest_str(value).split(';')
+                         if v.strip()]
+            argv.append(option)
+            argv.extend(_manifest_str(v) for v in value)
+        else:
+            argv.extend([option, _manifest_str(value)])
+
+    return argv
+
+
+def build_batch_parser():
+    parser = argparse.ArgumentParser(
+        prog='tccprofile.py batch',
+        formatter_class=SaneUsageFormat,
+        description='Build every profile described in a JSON, YAML or CSV '
+                    'manifest in one process, inspecting each app once.'
+    )
+    parser.add_argument('manifest', help='Path to the manifest file.')
+
+    add_inspection_arguments(parser)
+
+    return parser
 
+
+def batch_main(argv):
+    args = build_batch_parser().parse_args(argv)
+    with instrumented(args):
+        profile_parser = build_parser()
+
+        resolver = resolver_from_args(args)
+
+        profiles = list()
+        for index, entry in enumerate(read_manifest(args.manifest)):
+            try:
+                profile_args = profile_parser.parse_args(
+                    manifest_entry_to_argv(entry, profile_parser))
+            except SystemExit:
+                raise TCCProfileException(
+                    'Profile {} in {} is invalid.'.format(index, args.manifest))
+
+            if not profile_args.payload_filename:
+                raise TCCProfileException(
+                    'Profile {} in {} has no output file.'.format(
+                        index, args.manifest))
+
+            profiles.append(
+                (profile_args, profile_from_args(profile_args, resolver)))
+
+        # Inspect the apps of every profile in one pass, so each profile build
+        # only has to assemble and write its payloads.
+        paths = list()
+        for profile_args, tcc_profile in profiles:
+            paths.extend(tcc_profile._plan_inspections())
+        resolver.resolve_many(paths, jobs=args.jobs, count=False)
+
+        changed = list()
+        for profile_args, tcc_profile in profiles:
+            tcc_profile.build_profile(allow=profile_args.allow_app, jobs=args.jobs)
+            if tcc_profile.report_changes():
+                changed.append(tcc_profile)
+
+        # Profiles are signed from memory, so they can be signed side by side
+        write_profiles(changed, jobs=args.jobs)
+
+        if args.verbose:
+            sys.stderr.write(
+                'Built {} profiles. Inspected {inspections} apps, reused results '
+                '{saved} times\n'.format(len(profiles), **resolver.stats()))
+
+
+# Directories `scan` looks in when no roots are given
+SCAN_ROOTS = ['/Applications']
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
+def _list_dir(path):
+    """Yields (name, full path, is_dir, is_symlink) for the entries of a
+    directory, using scandir where available to avoid extra stat calls.
+    """
+    if _scandir:
+        for entry in _scandir(path):
+            yield (entry.name, entry.path,
+                   entry.is_dir(follow_symlinks=False), entry.is_symlink())
+    else:
+        for name in os.listdir(path):
+            full_path = os.path.join(path, name)
+            yield (name, full_path,
+                   os.path.isdir(full_path) and not os.path.islink(full_path),
+                   os.path.islink(full_path))
+
+
+def iter_scan_targets(roots, executables=True):
+    """Walks roots and yields, in sorted order, the path of every .app bundle
+    and (unless executables is False) executable Mach-O binary. App bundles
+    are not descended into and symlinked directories are not followed.
+    """
+    # Items are (path, whether it is an executable to report)
+    stack = [(root.rstrip('/') or '/', False) for root in reversed(roots)]
+    while stack:
+        path, is_executable = stack.pop()
+        if is_executable or path.endswith('.app'):
+            yield path
+            continue
+
+        try:
+            entries = sorted(_list_dir(path), reverse=True)
+        except OSError:
+            continue
+
+        for name, entry_path, is_dir, is_symlink in entries:
+            if is_dir:
+                stack.append((entry_path, False))
+            elif executables and os.access(entry_path, os.X_OK) and \
+                    os.path.isfile(entry_path) and \
+                    sniff_mime_type(entry_path) == 'x-mach-binary':
+                # Either a real executable, or a symlink to one
+                stack.append((entry_path, True))
+
+
+def scan_record(resolver, path):
+    """Returns the index record for path, with any error recorded rather
+    than raised.
+    """
+    record = {'path': path}
+    try:
+        identity = resolver.resolve(path)
+        record.update({
+            'identifier': identity.identifier,
+            'identifier_type': identity.identifier_type,
+            'code_requirement': identity.code_requirement,
+            'mime_type': identity.mime_type,
+        })
+    except Exception as err:
+        record['error'] = str(err)
+
+    return record
+
+
+def build_scan_parser():
+    parser = argparse.ArgumentParser(
+        prog='tccprofile.py scan',
+        formatter_class=SaneUsageFormat,
+        description='Find every app bundle and Mach-O executable under the '
+                    'given roots and write a JSON lines index of their bundle '
+                    'IDs and code requirements.'
+    )
     parser.add_argument(
-        '--ab', '--address-book',
-        type=str,
+        'roots',
         nargs='*',
-        dest='address_book_apps_list',
-        metavar='<app paths>',
-        help='Generate an AddressBook payload for the specified applications.',
-        required=False,
+        metavar='root',
+        help='Directories to scan. Defaults to /Applications.'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        dest='output',
+        metavar='index_file',
+        help='JSON lines file to write. If it already exists, paths it lists '
+             'are skipped and new records are appended, so an interrupted '
+             'scan can be resumed.',
+        required=True,
+    )
+    add_inspection_arguments(parser)
+
+    return parser
+
+
+def scan_main(argv):
+    args = build_scan_parser().parse_args(argv)
+    with instrumented(args):
+        resolver = resolver_from_args(args)
+
+        # Resume from whatever an earlier run already wrote, dropping a last
+        # line cut short by an interruption.
+        done = set()
+        if os.path.exists(args.output):
+            with open(args.output, 'r+') as f:
+                complete = 0
+                for line in iter(f.readline, ''):
+                    if not line.endswith('\n'):
+                        break
+                    complete += len(line)
+                    try:
+                        # json decodes paths to unicode, while the scanned
+                        # paths are the UTF-8 bytes it encoded them from
+                        done.add(json.loads(line)['path'].encode('utf-8'))
+                    except (ValueError, KeyError, AttributeError):
+                        pass
+                f.truncate(complete)
+
+        roots = [os.path.abspath(root) for root in args.roots or SCAN_ROOTS]
+        paths = (path for path in iter_scan_targets(roots) if path not in done)
+
+        pool = ThreadPool(args.jobs or cpu_count())
+        count = 0
+        try:
+            with open(args.output, 'a') as f:
+                for record in pool.imap(lambda path: scan_record(resolver, path),
+                                        paths):
+                    f.write(json.dumps(record, sort_keys=True) + '\n')
+                    f.flush()
+                    count += 1
+        finally:
+            pool.close()
+            pool.join()
+
+        if args.verbose:
+            sys.stderr.write('Indexed {} new paths ({} already indexed)\n'.format(
+                count, len(done)))
+
+
+def build_db_parser():
+    parser = argparse.ArgumentParser(
+        prog='tccprofile.py db',
+        formatter_class=SaneUsageFormat,
+        description='Manage a requirements database for building profiles '
+                    'without the apps installed.'
+    )
+    subparsers = parser.add_subparsers(dest='action')
+
+    import_parser = subparsers.add_parser(
+        'import', help='Import `scan` JSON lines indexes.')
+    import_parser.add_argument('database', help='Database file to update.')
+    import_parser.add_argument('indexes', nargs='+', metavar='index',
+                               help='Index files written by `scan`.')
+
+    lookup_parser = subparsers.add_parser(
+        'lookup', help='Show the records for app paths or bundle IDs.')
+    lookup_parser.add_argument('database', help='Database file to read.')
+    lookup_parser.add_argument('apps', nargs='+', metavar='app',
+                               help='App paths or bundle IDs.')
+
+    return parser
+
+
+def db_main(argv):
+    args = build_db_parser().parse_args(argv)
+    database = RequirementsDatabase(args.database)
+
+    if args.action == 'import':
+        for index in args.indexes:
+            with open(index, 'r') as f:
+                count = database.import_scan(f)
+            sys.stderr.write('Imported {} records from {}\n'.format(
+                count, index))
+        sys.stderr.write('{} holds {} records\n'.format(
+            args.database, len(database)))
+    else:
+        for app in args.apps:
+            identity = database.lookup(app)
+            print(json.dumps(
+                identity._asdict() if identity else {'path': app, 'error': 'not found'},
+                sort_keys=True))
+
+    database.close()
+
+
+# Fields every `serve` profile request needs, see profile_from_request
+SERVE_REQUIRED_FIELDS = [
+    'payload_description', 'payload_name', 'payload_identifier',
+    'payload_organization', 'payload_version', 'services',
+]
+
+
+def _request_str(value):
+    """JSON strings are unicode; the profile code expects utf-8 str."""
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def profile_from_request(request, resolver, signer=None, jobs=None,
+                         allow_signing=True):
+    """Builds the profile a `serve` API request describes and returns its
+    data, signed if the request asks for it.
+
+    Requests hold the PrivacyProfiles arguments plus 'services' (a dict of
+    payload type to app paths, AppleEvents entries as "sender,receiver"),
+    and optionally 'allow' (False by default, as on the command line),
+    'pin_cdhash', and either 'sign_cert' (a keychain
+    certificate name) or 'sign' (use the server's signing identity).
+    Requests to sign are refused unless allow_signing is set.
+    """
+    for field in SERVE_REQUIRED_FIELDS:
+        if field not in request:
+            raise TCCProfileException('Missing field: {}'.format(field))
+
+    services = request['services']
+    if not isinstance(services, dict) or \
+            not set(services) <= set(PrivacyProfiles.PAYLOADS) or \
+            not all(isinstance(apps, list) for apps in services.values()):
+        raise TCCProfileException(
+            'services must map payload types ({}) to lists of app '
+            'paths.'.format(', '.join(PrivacyProfiles.PAYLOADS)))
+    services = {str(payload): [_request_str(app) for app in apps]
+                for payload, apps in services.items()}
+    if any(len(app.split(',')) != 2 for app in services.get('AppleEvents', [])):
+        raise TCCProfileException(
+            'AppleEvents entries must be "/Path/EventSending.app,'
+            '/Path/EventReceiving.app".')
+
+    if (request.get('sign') or request.get('sign_cert')) and \
+            not allow_signing:
+        raise TCCProfileException(
+            'Profiles are only signed for requests on a Unix socket.')
+    if request.get('sign') and signer is None:
+        raise TCCProfileException('This server has no signing identity.')
+    sign_cert = _request_str(request.get('sign_cert'))
+
+    profile = PrivacyProfiles(
+        payload_description=_request_str(request['payload_description']),
+        payload_name=_request_str(request['payload_name']),
+        payload_identifier=_request_str(request['payload_identifier']),
+        payload_organization=_request_str(request['payload_organization']),
+        payload_version=int(request['payload_version']),
+        sign_cert=[sign_cert] if sign_cert else None,
+        filename=None,
+        resolver=resolver,
+        pin_cdhash=bool(request.get('pin_cdhash')),
+        signer=signer if request.get('sign') else None
+    )
+    profile.set_services_dict(services)
+
+    # The resolver lives as long as the server, so apps updated or re-signed
+    # since they were inspected have to be looked at again
+    resolver.invalidate_changed(profile._plan_inspections())
+    profile.build_profile(allow=bool(request.get('allow', False)), jobs=jobs)
+
+    data = profile.to_bytes()
+    if profile.signer:
+        data = profile.signer.sign(data)
+
+    return data
+
+
+def make_server(address, resolver, signer=None, jobs=None, verbose=False):
+    """Returns a threaded HTTP server for the `serve` API, listening on
+    address: a (host, port) tuple or the path of a Unix socket.
+
+    POST /profile builds a profile from a JSON request (see
+    profile_from_request) and GET /stats returns the resolver's counters.
+
+    Anyone who can connect can ask for a signed profile, so signing is only
+    offered on a Unix socket, which is created readable and writable by its
+    owner only. A TCP server refuses requests to sign and cannot be given a
+    signer.
+    """
+    unix = not isinstance(address, tuple)
+    if signer is not None and not unix:
+        raise TCCProfileException(
+            'A signing identity can only be used when serving on a Unix '
+            'socket (--socket).')
+
+    import BaseHTTPServer
+    import SocketServer
+    import socket
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        server_version = 'tccprofile'
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send_json(200, resolver.stats())
+            else:
+                self._send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/profile':
+                self._send_json(404, {'error': 'Not found'})
+                return
+
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length))
+                if not isinstance(request, dict):
+                    raise ValueError('Expected a JSON object')
+                data = profile_from_request(
+                    request, resolver, signer=signer, jobs=jobs,
+                    allow_signing=unix)
+            except (ValueError, TCCProfileException, EnvironmentError) as err:
+                self._send_json(400, {'error': str(err)})
+                return
+            except Exception as err:
+                self.log_error('Building a profile failed: %r', err)
+                self._send_json(500, {'error': str(err)})
+                return
+
+            self._send(200, 'application/x-apple-aspen-config', data)
+
+        def _send_json(self, status, body):
+            self._send(status, 'application/json', json.dumps(body))
+
+        def _send(self, status, content_type, data):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def address_string(self):
+            # Unix socket clients have no address
+            if isinstance(self.client_address, tuple):
+                return self.client_address[0]
+            return 'unix'
+
+        def log_message(self, format, *args):
+            if verbose:
+                BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                    self, format, *args)
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    class UnixServer(Server):
+        address_family = socket.AF_UNIX
+
+        def server_bind(self):
+            # Create the socket without group or other access, rather than
+            # changing its mode after anyone could have connected
+            umask = os.umask(0o177)
+            try:
+                SocketServer.TCPServer.server_bind(self)
+            finally:
+                os.umask(umask)
+            os.chmod(self.server_address, 0o600)
+            self.server_name = 'localhost'
+            self.server_port = 0
+
+    if not unix:
+        return Server(address, Handler)
+
+    # Replace the socket left behind by a server that did not shut down, but
+    # never anything else that happens to be at that path
+    try:
+        if not stat.S_ISSOCK(os.lstat(address).st_mode):
+            raise TCCProfileException(
+                '{} exists and is not a socket.'.format(address))
+        os.remove(address)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    return UnixServer(address, Handler)
+
+
+def build_serve_parser():
+    parser = argparse.ArgumentParser(
+        prog='tccprofile.py serve',
+        formatter_class=SaneUsageFormat,
+        description='Serve profile builds over HTTP, keeping inspection '
+                    'results in memory between requests. Profiles are only '
+                    'signed when serving on a Unix socket.'
     )
 
     parser.add_argument(
-        '--cal', '--calendar',
+        '--socket',
         type=str,
-        nargs='*',
-        dest='calendar_apps_list',
-        metavar='<app paths>',
-        help='Generate a Calendar payload for the specified applications.',
+        dest='socket',
+        metavar='socket_path',
+        help='Listen on this Unix socket instead of TCP.',
         required=False,
     )
 
     parser.add_argument(
-        '--rem', '--reminders',
+        '--host',
         type=str,
-        nargs='*',
-        dest='reminders_apps_list',
-        metavar='<app paths>',
-        help='Generate a Reminders payload for the specified applications.',
+        dest='host',
+        default='127.0.0.1',
+        metavar='host',
+        help='Address to listen on. Defaults to 127.0.0.1.',
         required=False,
     )
 
     parser.add_argument(
-        '--pho', '--photos',
-        type=str,
-        nargs='*',
-        dest='photos_apps_list',
-        metavar='<app paths>',
-        help='Generate a Photos payload for the specified applications.',
+        '--port',
+        type=int,
+        dest='port',
+        default=8765,
+        metavar='port',
+        help='TCP port to listen on. Defaults to 8765; 0 picks a free one.',
         required=False,
     )
 
+    add_signing_arguments(parser, keychain=False)
+
+    add_inspection_arguments(parser)
+
+    return parser
+
+
+def serve_main(argv):
+    args = build_serve_parser().parse_args(argv)
+    resolver = resolver_from_args(args)
+
+    server = make_server(args.socket or (args.host, args.port), resolver,
+                         signer=signer_from_args(args), jobs=args.jobs,
+                         verbose=args.verbose)
+    if args.socket:
+        sys.stderr.write('Serving on {}\n'.format(args.socket))
+    else:
+        sys.stderr.write('Serving on http://{}:{}\n'.format(
+            *server.server_address[:2]))
+    sys.stderr.flush()
+
+    with instrumented(args):
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if args.socket and os.path.exists(args.socket):
+                os.remove(args.socket)
+
+
+def _watch_targets(path):
+    """Returns the files whose changes mean the app at path changed: the
+    path itself and, for bundles, its Info.plist and main executable.
+    """
+    path = path.rstrip('/')
+    targets = [path]
+    info_plist = os.path.join(path, 'Contents/Info.plist')
+    if os.path.isfile(info_plist):
+        targets.append(info_plist)
+        executable = main_executable(path)
+        if executable != path:
+            targets.append(executable)
+
+    return targets
+
+
+def _watch_signature(path):
+    """Returns a cheap summary of the app at path that changes when the app
+    is modified or replaced, or None if it is missing.
+    """
+    signature = list()
+    for target in _watch_targets(path):
+        try:
+            st = os.stat(target)
+        except OSError:
+            return None
+        signature.append((st.st_ino, st.st_size, st.st_mtime))
+
+    return tuple(signature)
+
+
+class PollingWatcher(object):
+    """Watches apps by stat'ing them every interval seconds. Each check is a
+    few stat calls per app, so hundreds of apps cost next to nothing.
+    """
+
+    def __init__(self, paths, interval=5):
+        self.interval = interval
+        self._signatures = dict()
+        self.watch(paths)
+
+    def watch(self, paths):
+        """Starts watching paths, or re-reads their state after a rebuild."""
+        for path in paths:
+            self._signatures[path] = _watch_signature(path)
+
+    def wait(self, timeout=None):
+        """Returns the set of watched paths that changed, waiting up to
+        timeout seconds (forever if None) for at least one.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            changed = set()
+            for path, signature in self._signatures.items():
+                current = _watch_signature(path)
+                if current != signature:
+                    self._signatures[path] = current
+                    changed.add(path)
+
+            if changed:
+                return changed
+
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.time())
+                if delay <= 0:
+                    return changed
+            time.sleep(delay)
+
+
+# inotify(7) event flags
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ONLYDIR = 0x1000000
+IN_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+
+class InotifyWatcher(object):
+    """Watches apps with Linux inotify, through ctypes. The directories
+    holding each app, its Info.plist and its executable are watched, so
+    replacing a whole bundle is noticed as well as edits inside it. Waiting
+    blocks in select, so an idle watcher uses no CPU.
+    """
+
+    def __init__(self, paths):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+
+        self._paths = set()
+        self._directories = dict()  # wd -> directory
+        self._wds = dict()  # directory -> wd
+        # directory -> {file name: app paths}
+        self._interest = dict()
+        self.watch(paths)
+
+    @staticmethod
+    def available():
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            import ctypes
+            import ctypes.util
+            return hasattr(ctypes.CDLL(ctypes.util.find_library('c')),
+                           'inotify_init')
+        except (ImportError, OSError):
+            return False
+
+    def watch(self, paths):
+        """Starts watching paths. Called again after a rebuild, as replaced
+        bundles have new directories.
+        """
+        for path in paths:
+            self._paths.add(path)
+            for target in _watch_targets(path):
+                directory, name = os.path.split(target)
+                self._interest.setdefault(directory, dict()).setdefault(
+                    name, set()).add(path)
+
+                wd = self._libc.inotify_add_watch(
+                    self._fd, directory, IN_WATCH_MASK)
+                if wd >= 0:
+                    self._directories[wd] = directory
+                    self._wds[directory] = wd
+
+    def wait(self, timeout=None):
+        """Returns the set of watched paths that changed, waiting up to
+        timeout seconds (forever if None) for at least one.
+        """
+        import select
+
+        deadline = None if timeout is None else time.time() + timeout
+        changed = set()
+        # Events for other files in the watched directories are skipped
+        while not changed:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+            if not select.select([self._fd], [], [], remaining)[0]:
+                break
+
+            data = os.read(self._fd, 65536)
+            offset = 0
+            while offset + 16 <= len(data):
+                wd, mask, cookie, length = struct.unpack_from(
+                    'iIII', data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip('\0')
+                offset += 16 + length
+
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped, so anything may have changed
+                    return set(self._paths)
+
+                directory = self._directories.get(wd)
+                if directory:
+                    changed.update(self._interest[directory].get(name, ()))
+
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def make_watcher(paths, interval=5):
+    """Returns an InotifyWatcher where inotify is available, otherwise a
+    PollingWatcher.
+    """
+    if InotifyWatcher.available():
+        return InotifyWatcher(paths)
+
+    return PollingWatcher(paths, interval=interval)
+
+
+def wait_for_changes(watcher, debounce):
+    """Waits for watched apps to change, then keeps collecting changes until
+    none have arrived for debounce seconds, so an app update that touches
+    many files triggers one rebuild. Returns the changed paths.
+    """
+    changed = watcher.wait()
+    deadline = time.time() + debounce
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return changed
+
+        more = watcher.wait(remaining)
+        if more:
+            changed |= more
+            deadline = time.time() + debounce
+
+
+def build_watch_parser():
+    parser = build_parser()
+    parser.prog = 'tccprofile.py watch'
+    parser.description = 'Build a profile, then rebuild it whenever one of ' \
+                         'its apps changes.'
+
     parser.add_argument(
-        '--cam', '--camera',
-        type=str,
-        nargs='*',
-        dest='camera_apps_list',
-        metavar='<app paths>',
-        help='Generate a Camera payload for the specified applications. '
-             'This will be a DENY payload.',
+        '--debounce',
+        type=float,
+        dest='debounce',
+        default=2.0,
+        metavar='seconds',
+        help='Wait until apps have stopped changing for this long before '
+             'rebuilding. Defaults to 2 seconds.',
         required=False,
     )
 
     parser.add_argument(
-        '--mic', '--microphone',
-        type=str,
-        nargs='*',
-        dest='microphone_apps_list',
-        metavar='<app paths>',
-        help='Generate a Microphone payload for the specified applications. '
-             'This will be a DENY payload.',
+        '--poll-interval',
+        type=float,
+        dest='poll_interval',
+        default=5.0,
+        metavar='seconds',
+        help='How often to check apps where inotify is not available. '
+             'Defaults to 5 seconds.',
         required=False,
     )
 
-    parser.add_argument(
-        '--acc', '--accessibility',
-        type=str,
-        nargs='*',
-        dest='accessibility_apps_list',
-        metavar='<app paths>',
-        help='Generate an Accessibility payload for the specified applications.',
-        required=False,
+    return parser
+
+
+def watch_main(argv):
+    parser = build_watch_parser()
+    args = parser.parse_args(argv)
+    if not args.payload_filename:
+        parser.error('watch needs an output file (-o)')
+
+    resolver = resolver_from_args(args)
+
+    def rebuild():
+        tcc_profile = profile_from_args(args, resolver)
+        if os.path.exists(tcc_profile._filename):
+            # Keep the UUIDs, and only write when something changed. The
+            # resolver already holds every app that has not just changed, so
+            # nothing is taken from the old profile's requirements.
+            tcc_profile.load_previous(
+                tcc_profile._filename, reuse_requirements=False)
+        tcc_profile.build_profile(allow=args.allow_app, jobs=args.jobs)
+        if tcc_profile.report_changes():
+            tcc_profile.write()
+        return tcc_profile._plan_inspections()
+
+    with instrumented(args):
+        paths = rebuild()
+        watcher = make_watcher(paths, interval=args.poll_interval)
+        sys.stderr.write('Watching {} apps ({})\n'.format(
+            len(paths), type(watcher).__name__))
+
+        try:
+            while True:
+                changed = wait_for_changes(watcher, args.debounce)
+                sys.stderr.write('Changed: {}\n'.format(
+                    ', '.join(sorted(changed))))
+
+                # Only the changed apps are inspected again
+                resolver.invalidate(changed)
+                try:
+                    rebuild()
+                except (TCCProfileException, EnvironmentError) as err:
+                    # e.g. an app removed part way through an update; the
+                    # next change will trigger another attempt
+                    sys.stderr.write('Rebuild failed: {}\n'.format(err))
+                watcher.watch(changed)
+        except KeyboardInterrupt:
+            pass
+
+
+def read_profile(path):
+    """Reads a .mobileconfig, unsigned or signed. The plist inside a signed
+    profile is stored as is, so it is cut out of the CMS data rather than
+    verifying the signature.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    start = data.find('<?xml')
+    end = data.find('</plist>', start)
+    if start == -1 or end == -1:
+        raise TCCProfileException('No profile found in {}.'.format(path))
+
+    try:
+        return plistlib.readPlistFromString(data[start:end + len('</plist>')])
+    except Exception as err:
+        raise TCCProfileException('Cannot read {}: {}'.format(path, err))
+
+
+def find_bundles(roots, bundle_ids):
+    """Walks roots for the .app bundles with the given bundle IDs and returns
+    {bundle ID: path}. The first bundle found for an ID wins, and the walk
+    stops once every ID has been found.
+    """
+    wanted = set(bundle_ids)
+    found = dict()
+    for path in iter_scan_targets(roots, executables=False):
+        if not wanted:
+            break
+        try:
+            bundle_id = read_info_plist(
+                os.path.join(path, 'Contents/Info.plist')).get(
+                    'CFBundleIdentifier')
+        except (EnvironmentError, NSPropertyListSerializationException):
+            continue
+        if bundle_id in wanted:
+            wanted.discard(bundle_id)
+            found[bundle_id] = path
+
+    return found
+
+
+# Profile entry fields checked by verify: (identifier, type, requirement)
+VERIFY_FIELDS = [
+    ('Identifier', 'IdentifierType', 'CodeRequirement'),
+    ('AEReceiverIdentifier', 'AEReceiverIdentifierType',
+     'AEReceiverCodeRequirement'),
+]
+
+
+def verify_profiles(profile_paths, resolver, roots=None, jobs=None):
+    """Compares the code requirements in deployed profiles with the apps
+    installed now and returns a drift report (a dict, see the README).
+
+    Apps referenced by any number of entries and profiles are located and
+    inspected once, in parallel.
+    """
+    # (profile, payload, field, identifier, type, deployed requirement)
+    checks = list()
+    for profile_path in profile_paths:
+        services = read_profile(profile_path)['PayloadContent'][0]['Services']
+        for payload, entries in sorted(services.items()):
+            for entry in entries:
+                for identifier, identifier_type, requirement in VERIFY_FIELDS:
+                    if identifier in entry:
+                        checks.append((
+                            profile_path, payload, requirement,
+                            entry[identifier], entry[identifier_type],
+                            entry.get(requirement)))
+
+    apps = sorted(set((check[3], check[4]) for check in checks))
+    bundles = find_bundles(
+        [os.path.abspath(root) for root in roots or SCAN_ROOTS],
+        [identifier for identifier, identifier_type in apps
+         if identifier_type == 'bundleID'])
+
+    paths = dict()
+    for identifier, identifier_type in apps:
+        path = identifier if identifier_type == 'path' else \
+            bundles.get(identifier)
+        if path:
+            paths[(identifier, identifier_type)] = path
+
+    pool = ThreadPool(jobs or cpu_count())
+    try:
+        records = pool.map(lambda path: scan_record(resolver, path),
+                           sorted(set(paths.values())))
+    finally:
+        pool.close()
+        pool.join()
+    records = {record['path']: record for record in records}
+
+    drift = list()
+    for profile_path, payload, field, identifier, identifier_type, deployed \
+            in checks:
+        path = paths.get((identifier, identifier_type))
+        record = records.get(path, {'error': 'not installed'})
+        installed = record.get('code_requirement')
+        if installed == deployed:
+            continue
+
+        item = {
+            'profile': profile_path,
+            'payload': payload,
+            'field': field,
+            'identifier': identifier,
+            'identifier_type': identifier_type,
+            'path': path,
+            'deployed': deployed,
+            'installed': installed,
+        }
+        if 'error' in record:
+            item['error'] = record['error']
+        drift.append(item)
+
+    return {
+        'profiles': len(profile_paths),
+        'entries': len(checks),
+        'apps': len(apps),
+        'inspected': len(records),
+        'drift': drift,
+    }
+
+
+def build_verify_parser():
+    parser = argparse.ArgumentParser(
+        prog='tccprofile.py verify',
+        formatter_class=SaneUsageFormat,
+        description='Report the deployed code requirements that no longer '
+                    'match the installed apps.'
     )
 
     parser.add_argument(
-        '--pe', '--post-event',
-        type=str,
-        nargs='*',
-        dest='post_event_apps_list',
-        metavar='<app paths>',
-        help='Generate a PostEvent payload for the specified applications to '
-             'allow CoreGraphics APIs to send CGEvents.',
-        required=False,
+        'profiles',
+        nargs='+',
+        metavar='profile',
+        help='.mobileconfig files to check, signed or unsigned.',
     )
 
     parser.add_argument(
-        '--af', '--allfiles',
-        type=str,
+        '--roots',
         nargs='*',
-        dest='allfiles_apps_list',
-        metavar='<app paths>',
-        help='Generate an SystemPolicyAllFiles payload for the specified '
-             'applications. This applies to all protected system files.',
+        dest='roots',
+        metavar='directory',
+        help='Where to look for apps referenced by bundle ID. Defaults to '
+             '/Applications.',
         required=False,
     )
 
     parser.add_argument(
-        '--ae', '--appleevents',
+        '-o', '--output',
         type=str,
-        nargs='*',
-        dest='events_apps_list',
-        metavar='<app paths>',
-        help='Generate an AppleEvents payload for the specified applications. '
-             'This allows applications to send restricted AppleEvents to '
-             'another process',
+        dest='output',
+        metavar='report_file',
+        help='Write the JSON report here instead of stdout.',
         required=False,
     )
 
-    parser.add_argument(
-        '--sf', '--sysadminfiles',
-        type=str,
-        nargs='*',
-        dest='sysadmin_apps_list',
-        metavar='<app paths>',
-        help='Generate an SystemPolicySysAdminFiles payload for the specified '
-             'applications.This applies to some files used in system '
-             'administration.',
-        required=False,
+    add_inspection_arguments(parser)
+
+    return parser
+
+
+def verify_main(argv):
+    args = build_verify_parser().parse_args(argv)
+
+    with instrumented(args):
+        report = verify_profiles(args.profiles, resolver_from_args(args),
+                                 roots=args.roots, jobs=args.jobs)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.verbose:
+        sys.stderr.write(
+            '{} of {} entries in {} profiles have drifted ({} apps '
+            'inspected)\n'.format(len(report['drift']), report['entries'],
+                                  report['profiles'], report['inspected']))
+
+    # Like diff, exit non-zero when there are differences
+    if report['drift']:
+        sys.exit(1)
+
+
+def plist_size(value, level=0):
+    """Returns the size in bytes of value serialised as an XML plist element
+    nested level deep, as write_plist_stream would write it.
+    """
+    buf = cStringIO.StringIO()
+    writer = StreamingPlistWriter(buf, indentLevel=level, writeHeader=0)
+    writer.writeValue(value)
+    return len(buf.getvalue())
+
+
+def _plist_line_size(text, level):
+    return level + len(text) + 1  # Tabs, text and newline
+
+
+# How deep the Services dict and its entries are nested in a profile
+SERVICES_LEVEL = 3
+ENTRY_LEVEL = SERVICES_LEVEL + 2
+
+
+def profile_like(root, filename, identifier, name, services, sign_cert=None,
+                 signer=None):
+    """Returns a PrivacyProfiles that writes a copy of the profile root (as
+    read from a .mobileconfig) with new UUIDs, the given identifier and
+    name, and services as its Services.
+    """
+    content = root['PayloadContent'][0]
+    profile = PrivacyProfiles(
+        payload_description=root.get('PayloadDescription', name),
+        payload_name=name,
+        payload_identifier=identifier,
+        payload_organization=root.get('PayloadOrganization', ''),
+        payload_version=root.get('PayloadVersion', 1),
+        sign_cert=sign_cert,
+        filename=filename,
+        signer=signer
+    )
+
+    # Keep any other keys the source profile has
+    template = dict(root)
+    template.update({
+        'PayloadDisplayName': name,
+        'PayloadIdentifier': identifier,
+        'PayloadUUID': profile.profile_uuid,
+    })
+    template['PayloadContent'] = [dict(content)]
+    template['PayloadContent'][0].update({
+        'PayloadDisplayName': name,
+        'PayloadIdentifier': '{}.{}'.format(identifier, profile.payload_uuid),
+        'PayloadUUID': profile.payload_uuid,
+        'Services': services,
+    })
+    profile.template = template
+
+    return profile
+
+
+def _payload_order(services):
+    """Payload types in PAYLOADS order, then any others."""
+    known = [p for p in PrivacyProfiles.PAYLOADS if p in services]
+    return known + sorted(set(services) - set(known))
+
+
+def merge_services(services_list, stream=sys.stderr):
+    """Merges Services dicts, keeping the first of any entries that are the
+    same rule (see entry_key). Entries for the same rule that disagree on
+    Allowed are reported to stream.
+    """
+    merged = dict()
+    index = dict()  # (payload, entry_key) -> entry kept
+    for services in services_list:
+        for payload in _payload_order(services):
+            for entry in services[payload]:
+                key = (payload, entry_key(entry))
+                kept = index.get(key)
+                if kept is None:
+                    index[key] = entry
+                    merged.setdefault(payload, list()).append(entry)
+                elif kept.get('Allowed') != entry.get('Allowed'):
+                    stream.write(
+                        '{}: conflicting Allowed for {}, keeping the first '
+                        '({})\n'.format(payload, entry.get('Identifier'),
+                                        kept.get('Allowed')))
+
+    return merged
+
+
+def split_services(root, max_bytes, identifier, name):
+    """Packs the Services entries of the profile root into as few chunks as
+    possible whose profiles stay within max_bytes, and returns a list of
+    Services dicts.
+
+    Every entry is measured once. A chunk's size is the size of the profile
+    without services plus the entries and payload type wrappers added to
+    it, so candidates are never re-serialised. identifier and name are the
+    longest ones any chunk will be given.
+    """
+    services = root['PayloadContent'][0]['Services']
+
+    empty = dict(root)
+    empty['PayloadContent'] = [dict(root['PayloadContent'][0], Services={})]
+    empty.update(PayloadIdentifier=identifier, PayloadDisplayName=name)
+    empty['PayloadContent'][0].update(
+        PayloadIdentifier='{}.{}'.format(identifier, root['PayloadUUID']),
+        PayloadDisplayName=name)
+    buf = cStringIO.StringIO()
+    write_plist_stream(empty, buf)
+    base = len(buf.getvalue())
+
+    chunks = list()  # [size, {payload: [entries]}]
+    for payload in _payload_order(services):
+        # <key>, <array> and </array> around a payload type's entries
+        wrapper = plist_size(payload, SERVICES_LEVEL + 1) + \
+            _plist_line_size('<key></key>', SERVICES_LEVEL + 1) - \
+            _plist_line_size('<string></string>', SERVICES_LEVEL + 1) + \
+            _plist_line_size('<array>', SERVICES_LEVEL + 1) + \
+            _plist_line_size('</array>', SERVICES_LEVEL + 1)
+
+        for entry in services[payload]:
+            size = plist_size(entry, ENTRY_LEVEL)
+            if base + wrapper + size > max_bytes:
+                raise TCCProfileException(
+                    'A {} entry for {} does not fit in {} bytes on its '
+                    'own.'.format(payload, entry.get('Identifier'), max_bytes))
+
+            # First fit, keeping entries in order within each chunk
+            for chunk in chunks:
+                cost = size + (0 if payload in chunk[1] else wrapper)
+                if chunk[0] + cost <= max_bytes:
+                    break
+            else:
+                chunk = [base, dict()]
+                chunks.append(chunk)
+                cost = size + wrapper
+
+            chunk[0] += cost
+            chunk[1].setdefault(payload, list()).append(entry)
+
+    return [chunk[1] for chunk in chunks]
+
+
+def build_merge_parser():
+    parser = argparse.ArgumentParser(
+        prog='tccprofile.py merge',
+        formatter_class=SaneUsageFormat,
+        description='Merge the Services of several profiles into one, '
+                    'dropping duplicate entries.'
     )
 
     parser.add_argument(
-        '--allow',
-        action='store_true',
-        dest='allow_app',
-        default=False,
-        help='Configure the profile to allow control for all apps provided '
-             'with the --apps command.',
-        required=False
+        'profiles',
+        nargs='+',
+        metavar='profile',
+        help='Profiles to merge. The first one provides the description, '
+             'organization and version.',
     )
 
     parser.add_argument(
@@ -945,16 +4774,7 @@ def parse_args():
         type=str,
         dest='payload_filename',
         metavar='payload_filename',
-        help='Filename to save the profile as.',
-        required=False,
-    )
-
-    parser.add_argument(
-        '--pd', '--payload-description',
-        type=str,
-        dest='payload_description',
-        metavar='payload_description',
-        help='A short and sweet description of the payload.',
+        help='Filename to save the merged profile as.',
         required=True,
     )
 
@@ -963,8 +4783,9 @@ def parse_args():
         type=str,
         dest='payload_identifier',
         metavar='payload_identifier',
-        help='An identifier to use for the profile. Example: org.foo.bar',
-        required=True,
+        help='Identifier of the merged profile. Defaults to the first '
+             "profile's.",
+        required=False,
     )
 
     parser.add_argument(
@@ -972,91 +4793,165 @@ def parse_args():
         type=str,
         dest='payload_name',
         metavar='payload_name',
-        help='A short and sweet name for the payload.',
-        required=True,
+        help="Name of the merged profile. Defaults to the first profile's.",
+        required=False,
     )
 
-    parser.add_argument(
-        '--po', '--payload-org',
-        type=str,
-        dest='payload_org',
-        metavar='payload_org',
-        help='Organization to use for the profile.',
-        required=True,
+    add_signing_arguments(parser)
+
+    return parser
+
+
+def merge_main(argv):
+    args = build_merge_parser().parse_args(argv)
+
+    roots = [read_profile(path) for path in args.profiles]
+    services = merge_services(
+        [root['PayloadContent'][0]['Services'] for root in roots])
+
+    profile = profile_like(
+        roots[0], args.payload_filename,
+        identifier=args.payload_identifier or roots[0]['PayloadIdentifier'],
+        name=args.payload_name or roots[0]['PayloadDisplayName'],
+        services=services, sign_cert=args.sign_profile,
+        signer=signer_from_args(args))
+    profile.write()
+
+    sys.stderr.write('Merged {} entries from {} profiles\n'.format(
+        sum(len(entries) for entries in services.values()), len(roots)))
+
+
+def build_split_parser():
+    parser = argparse.ArgumentParser(
+        prog='tccprofile.py split',
+        formatter_class=SaneUsageFormat,
+        description='Split a profile into parts that each stay under a size '
+                    'limit.'
     )
 
+    parser.add_argument('profile', help='Profile to split.')
+
     parser.add_argument(
-        '--pv', '--payload-version',
+        '--max-bytes',
         type=int,
-        dest='payload_ver',
-        metavar='payload_version',
-        help='Version to use for the profile.',
+        dest='max_bytes',
         required=True,
+        metavar='bytes',
+        help='Largest size of each (unsigned) part.',
     )
 
     parser.add_argument(
-        '-s', '--sign',
+        '-o', '--output',
         type=str,
-        nargs=1,
-        dest='sign_profile',
-        metavar='certificate_name',
-        help='Signs a profile using the specified Certificate Name. To list '
-             'code signing certificate names: /usr/bin/security find-identity '
-             '-p codesigning -v',
+        dest='payload_filename',
+        metavar='payload_filename',
+        help='Base filename for the parts, which are saved as '
+             '<name>.partN.mobileconfig. Defaults to the input filename.',
         required=False,
     )
 
-    # parser.add_argument(
-    #     '--lg', '--launch-gui',
-    #     action='store_true',
-    #     default=False,
-    #     dest='launch_gui',
-    #     help='Launch the GUI and populate the provided values passed via the '
-    #          'arguments.',
-    #     required=False
-    # )
+    add_signing_arguments(parser)
 
-    return parser.parse_args()
+    return parser
+
+
+def split_main(argv):
+    args = build_split_parser().parse_args(argv)
+    root = read_profile(args.profile)
+    signer = signer_from_args(args)
+
+    identifier = root['PayloadIdentifier']
+    name = root['PayloadDisplayName']
+    # Size chunks for the longest suffixes any part could get
+    most = max(1, sum(len(entries) for entries in
+                      root['PayloadContent'][0]['Services'].values()))
+    chunks = split_services(
+        root, args.max_bytes,
+        identifier='{}.part{}'.format(identifier, most),
+        name='{} ({} of {})'.format(name, most, most))
+
+    base = os.path.splitext(args.payload_filename or args.profile)[0]
+    for number, services in enumerate(chunks, 1):
+        profile = profile_like(
+            root, '{}.part{}.mobileconfig'.format(base, number),
+            identifier='{}.part{}'.format(identifier, number),
+            name='{} ({} of {})'.format(name, number, len(chunks)),
+            services=services, sign_cert=args.sign_profile, signer=signer)
+        profile.write()
+
+    sys.stderr.write('Split {} into {} parts\n'.format(
+        args.profile, len(chunks)))
+
+
+# Sub-commands, selected by the first command line argument
+COMMANDS = {
+    'batch': batch_main,
+    'scan': scan_main,
+    'db': db_main,
+    'serve': serve_main,
+    'watch': watch_main,
+    'verify': verify_main,
+    'merge': merge_main,
+    'split': split_main,
+}
 
 
 def launch_gui(args=None):
-    info = AppKit.NSBundle.mainBundle().infoDictionary()
-    info['LSUIElement'] = True
+    import Tkinter as tk
+
+    try:
+        import AppKit
+    except ImportError:
+        AppKit = None
+
+    if AppKit:
+        info = AppKit.NSBundle.mainBundle().infoDictionary()
+        info['LSUIElement'] = True
 
     print(args)
 
     root = tk.Tk()
-    app = App(root)
-    AppKit.NSApplication.sharedApplication().activateIgnoringOtherApps_(True)
+    app = load_gui()(root)
+    if AppKit:
+        AppKit.NSApplication.sharedApplication().activateIgnoringOtherApps_(True)
     app.mainloop()
 
 
+def build_main(argv):
+    args = parse_args(argv)
+    # if args.launch_gui:
+    #     launch_gui(args)
+
+    with instrumented(args):
+        tcc_profile = profile_from_args(args, resolver_from_args(args))
+
+        # Iterate over the payloads dict to build payloads
+        tcc_profile.build_profile(
+            allow=args.allow_app, jobs=args.jobs, lazy=not args.update_from)
+
+        if tcc_profile.report_changes():
+            tcc_profile.write()
+
+        # After writing, as a lazy build assembles its entries while writing
+        if args.verbose:
+            sys.stderr.write(
+                'Inspected {inspections} apps, reused results {saved} '
+                'times\n'.format(**tcc_profile.resolver.stats()))
+
+
 def main():
     if len(sys.argv) == 1:
         launch_gui()
         sys.exit(0)
-    else:
-        args = parse_args()
-        # if args.launch_gui:
-        #     launch_gui(args)
-
-    tcc_profile = PrivacyProfiles(
-        payload_description=args.payload_description,
-        payload_name=args.payload_name,
-        payload_identifier=args.payload_identifier,
-        payload_organization=args.payload_org,
-        payload_version=args.payload_ver,
-        sign_cert=args.sign_profile,
-        filename=args.payload_filename
-    )
-
-    # Insert the service dict into the template
-    tcc_profile.set_services_dict(args)
-
-    # Iterate over the payloads dict to build payloads
-    tcc_profile.build_profile(allow=args.allow_app)
 
-    tcc_profile.write()
+    try:
+        if sys.argv[1] in COMMANDS:
+            COMMANDS[sys.argv[1]](sys.argv[2:])
+        else:
+            build_main(sys.argv[1:])
+    except TCCProfileException as err:
+        print('{} Exiting.'.format(err))
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Builds compiled code requirements and signed Mach-O files for the tests,
+following the layouts in <mach-o/loader.h>, <mach-o/fat.h> and
+Security.framework's cs_blobs.h / requirement.h.
+
+Run it to regenerate the binaries in tests/fixtures:
+
+    ./tests/macho.py
+
+The code signatures only hold what tccprofile reads (the requirement set and
+CodeDirectories), so they would not pass `codesign --verify`. Each fixture's
+.requirement file holds the line `codesign -dr -` prints for a binary with
+that designated requirement, and its .cdhash file the hash of its strongest
+CodeDirectory, worked out here with hashlib.
+"""
+
+import hashlib
+import os
+import struct
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+CPU_TYPE_X86_64 = 0x01000007
+CPU_TYPE_ARM64 = 0x0100000c
+CPU_TYPE_POWERPC = 18
+
+# Requirement opcodes
+OP_FALSE, OP_TRUE, OP_IDENT, OP_APPLE_ANCHOR, OP_ANCHOR_HASH = range(5)
+OP_INFO_KEY_VALUE, OP_AND, OP_OR, OP_CDHASH, OP_NOT = range(5, 10)
+OP_INFO_KEY_FIELD, OP_CERT_FIELD, OP_TRUSTED_CERT = range(10, 13)
+OP_TRUSTED_CERTS, OP_CERT_GENERIC, OP_APPLE_GENERIC_ANCHOR = range(13, 16)
+OP_ENTITLEMENT_FIELD, OP_CERT_POLICY, OP_NAMED_ANCHOR = range(16, 19)
+OP_NAMED_CODE, OP_PLATFORM, OP_NOTARIZED = range(19, 22)
+
+# Match operations
+MATCH_EXISTS, MATCH_EQUAL, MATCH_CONTAINS, MATCH_BEGINS_WITH = range(4)
+MATCH_ENDS_WITH, MATCH_LESS_THAN, MATCH_GREATER_THAN = range(4, 7)
+MATCH_LESS_EQUAL, MATCH_GREATER_EQUAL, MATCH_ON = range(7, 10)
+MATCH_ABSENT = 14
+
+LEAF, ROOT = 0, -1
+
+# 1.2.840.113635.100.6.2.6 (Developer ID CA) and .6.1.13 (Developer ID leaf)
+OID_DEVELOPER_ID_CA = '\x2a\x86\x48\x86\xf7\x63\x64\x06\x02\x06'
+OID_DEVELOPER_ID_LEAF = '\x2a\x86\x48\x86\xf7\x63\x64\x06\x01\x0d'
+
+
+def word(value):
+    return struct.pack('>I', value)
+
+
+def data(value):
+    """Length-prefixed data, padded to a multiple of 4 bytes."""
+    return word(len(value)) + value + '\0' * (-len(value) % 4)
+
+
+def op(code, *operands):
+    return word(code) + ''.join(operands)
+
+
+def slot(index):
+    return struct.pack('>i', index)
+
+
+def match(operation, value=None):
+    return word(operation) + ('' if value is None else data(value))
+
+
+def requirement(expression):
+    """A Requirement blob holding a compiled expression."""
+    body = word(1) + expression  # Kind: expression
+    return word(0xfade0c00) + word(8 + len(body)) + body
+
+
+def superblob(magic, blobs):
+    """A SuperBlob with [(slot type, blob)]."""
+    header = 12 + 8 * len(blobs)
+    index, payload = '', ''
+    for slot_type, blob in blobs:
+        index += word(slot_type) + word(header + len(payload))
+        payload += blob
+    return word(magic) + word(header + len(payload)) + word(len(blobs)) + \
+        index + payload
+
+
+def code_directory(hash_type, hash_size, page_hashes):
+    """A minimal CodeDirectory blob: the header up to the hash fields
+    followed by the page hashes.
+    """
+    body = struct.pack(
+        '>IIIIIIIBBBBI', 0x20400, 0, 44, 44, 0, len(page_hashes), 0,
+        hash_size, hash_type, 0, 12, 0) + ''.join(page_hashes)
+    return word(0xfade0c02) + word(8 + len(body)) + body
+
+
+def signature(designated, code_directories):
+    """An embedded signature SuperBlob: a requirement set with the
+    designated requirement, and CodeDirectories (primary first).
+    """
+    requirements = superblob(0xfade0c01, [(3, requirement(designated))])
+    slots = [(2, requirements)]
+    for index, directory in enumerate(code_directories):
+        slots.append((0x1000 + index - 1 if index else 0, directory))
+    return superblob(0xfade0cc0, slots)
+
+
+def thin(cputype, signed_blob=None, big_endian=False, is_64=True):
+    """A thin Mach-O image with one load command: LC_CODE_SIGNATURE pointing
+    at signed_blob, or LC_SYMTAB when it is unsigned.
+    """
+    endian = '>' if big_endian else '<'
+    header_size = 32 if is_64 else 28
+    dataoff = header_size + 16
+    if signed_blob is not None:
+        command = struct.pack(endian + 'IIII', 0x1d, 16, dataoff,
+                              len(signed_blob))
+    else:
+        command = struct.pack(endian + 'IIII', 0x2, 16, 0, 0)
+        signed_blob = ''
+
+    magic = 0xfeedfacf if is_64 else 0xfeedface
+    header = struct.pack(endian + 'Iii', magic, cputype, 3)
+    header += struct.pack(endian + 'IIII', 2, 1, len(command), 0)
+    if is_64:
+        header += struct.pack(endian + 'I', 0)
+    return header + command + signed_blob
+
+
+def fat(images, fat64=False):
+    """A universal binary of [(cputype, image)]."""
+    arch_size = 32 if fat64 else 20
+    offset = 8 + arch_size * len(images)
+    archs, body = '', ''
+    for cputype, image in images:
+        offset += -offset % 16
+        body += '\0' * (offset - 8 - arch_size * len(images) - len(body))
+        if fat64:
+            archs += struct.pack('>iiQQII', cputype, 0, offset, len(image),
+                                 4, 0)
+        else:
+            archs += struct.pack('>iiIII', cputype, 0, offset, len(image), 4)
+        body += image
+        offset += len(image)
+    magic = 0xcafebabf if fat64 else 0xcafebabe
+    return struct.pack('>II', magic, len(images)) + archs + body
+
+
+def cdhash(directory, hash_name):
+    return hashlib.new(hash_name, directory).hexdigest()[:40]
+
+
+DEVELOPER_ID = op(OP_AND, op(OP_AND, op(OP_AND,
+    op(OP_IDENT, data('com.example.Thin')),
+    op(OP_APPLE_GENERIC_ANCHOR)),
+    op(OP_CERT_GENERIC, slot(1), data(OID_DEVELOPER_ID_CA),
+       match(MATCH_EXISTS))),
+    op(OP_AND,
+       op(OP_CERT_GENERIC, slot(LEAF), data(OID_DEVELOPER_ID_LEAF),
+          match(MATCH_EXISTS)),
+       op(OP_CERT_FIELD, slot(LEAF), data('subject.OU'),
+          match(MATCH_EQUAL, 'ABCDE12345'))))
+DEVELOPER_ID_TEXT = (
+    'identifier "com.example.Thin" and anchor apple generic and '
+    'certificate 1[field.1.2.840.113635.100.6.2.6] /* exists */ and '
+    'certificate leaf[field.1.2.840.113635.100.6.1.13] /* exists */ and '
+    'certificate leaf[subject.OU] = ABCDE12345')
+
+APP_STORE = op(OP_OR,
+    op(OP_AND, op(OP_IDENT, data('com.example.Fat')), op(OP_APPLE_ANCHOR)),
+    op(OP_AND, op(OP_APPLE_GENERIC_ANCHOR),
+       op(OP_CERT_FIELD, slot(LEAF), data('subject.OU'),
+          match(MATCH_EQUAL, '6B4Q2V9N8T'))))
+APP_STORE_TEXT = (
+    'identifier "com.example.Fat" and anchor apple or anchor apple generic '
+    'and certificate leaf[subject.OU] = "6B4Q2V9N8T"')
+
+
+def fixtures():
+    """Returns {name: (binary, requirement text or None, cdhashes)}, where
+    cdhashes lists the CDHash of each slice.
+    """
+    sha1 = code_directory(1, 20, ['\x11' * 20])
+    sha256 = code_directory(2, 32, ['\x22' * 32])
+    x86_64 = code_directory(2, 32, ['\x33' * 32])
+    arm64 = code_directory(2, 32, ['\x44' * 32])
+
+    return {
+        'thin_signed': (
+            thin(CPU_TYPE_X86_64, signature(DEVELOPER_ID, [sha1, sha256])),
+            DEVELOPER_ID_TEXT, [cdhash(sha256, 'sha256')]),
+        'fat_signed': (
+            fat([(CPU_TYPE_X86_64, thin(
+                    CPU_TYPE_X86_64, signature(APP_STORE, [x86_64]))),
+                 (CPU_TYPE_ARM64, thin(
+                     CPU_TYPE_ARM64, signature(APP_STORE, [arm64])))]),
+            APP_STORE_TEXT,
+            [cdhash(x86_64, 'sha256'), cdhash(arm64, 'sha256')]),
+        'thin_unsigned': (thin(CPU_TYPE_X86_64), None, []),
+    }
+
+
+def main():
+    for name, (binary, text, cdhashes) in sorted(fixtures().items()):
+        path = os.path.join(FIXTURES, name)
+        with open(path, 'wb') as f:
+            f.write(binary)
+        if text is not None:
+            with open(path + '.requirement', 'w') as f:
+                f.write('designated => {}\n'.format(text))
+        if cdhashes:
+            with open(path + '.cdhash', 'w') as f:
+                f.write(''.join(h + '\n' for h in cdhashes))
+
+
+if __name__ == '__main__':
+    main()
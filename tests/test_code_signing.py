@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""Tests for the in-process code signature reader: the requirement
+decompiler, Mach-O slices, designated requirements and CDHashes.
+"""
+
+import os
+import platform
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+from macho import (  # NOQA
+    CPU_TYPE_ARM64, CPU_TYPE_POWERPC, CPU_TYPE_X86_64, FIXTURES, LEAF, ROOT,
+    MATCH_ABSENT, MATCH_BEGINS_WITH, MATCH_CONTAINS, MATCH_ENDS_WITH,
+    MATCH_EQUAL, MATCH_EXISTS, MATCH_GREATER_EQUAL, MATCH_LESS_THAN,
+    MATCH_ON, OID_DEVELOPER_ID_CA, OP_AND, OP_ANCHOR_HASH, OP_APPLE_ANCHOR,
+    OP_APPLE_GENERIC_ANCHOR, OP_CDHASH, OP_CERT_FIELD, OP_CERT_GENERIC,
+    OP_CERT_POLICY, OP_ENTITLEMENT_FIELD, OP_FALSE, OP_IDENT,
+    OP_INFO_KEY_FIELD, OP_INFO_KEY_VALUE, OP_NAMED_ANCHOR, OP_NAMED_CODE,
+    OP_NOT, OP_NOTARIZED, OP_OR, OP_PLATFORM, OP_TRUE, OP_TRUSTED_CERT,
+    data, fat, match, op, slot, thin)
+
+
+def decompile(expression):
+    return tccprofile.RequirementDecompiler(expression, 0).decompile()
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+def read_fixture(name):
+    with open(fixture(name)) as f:
+        return f.read()
+
+
+IDENT = op(OP_IDENT, data('com.example.App'))
+APPLE = op(OP_APPLE_ANCHOR)
+GENERIC = op(OP_APPLE_GENERIC_ANCHOR)
+
+
+class RequirementDecompilerTests(unittest.TestCase):
+
+    def test_and_binds_tighter_than_or(self):
+        self.assertEqual(
+            decompile(op(OP_OR, op(OP_AND, IDENT, APPLE), GENERIC)),
+            'identifier "com.example.App" and anchor apple or '
+            'anchor apple generic')
+        self.assertEqual(
+            decompile(op(OP_AND, IDENT, op(OP_OR, APPLE, GENERIC))),
+            'identifier "com.example.App" and '
+            '(anchor apple or anchor apple generic)')
+
+    def test_nested_and_or_same_level_need_no_parentheses(self):
+        self.assertEqual(
+            decompile(op(OP_AND, op(OP_AND, IDENT, APPLE), GENERIC)),
+            'identifier "com.example.App" and anchor apple and '
+            'anchor apple generic')
+        self.assertEqual(
+            decompile(op(OP_OR, APPLE, op(OP_OR, GENERIC, IDENT))),
+            'anchor apple or anchor apple generic or '
+            'identifier "com.example.App"')
+
+    def test_not(self):
+        self.assertEqual(decompile(op(OP_NOT, op(OP_OR, APPLE, GENERIC))),
+                         '! (anchor apple or anchor apple generic)')
+
+    def test_constants(self):
+        self.assertEqual(decompile(op(OP_TRUE)), 'always')
+        self.assertEqual(decompile(op(OP_FALSE)), 'never')
+        self.assertEqual(decompile(op(OP_NOTARIZED)), 'notarized')
+        self.assertEqual(decompile(op(OP_PLATFORM, slot(1))), 'platform = 1')
+
+    def test_certificate_slots(self):
+        for index, text in [(LEAF, 'leaf'), (ROOT, 'root'), (1, '1'),
+                            (2, '2')]:
+            self.assertEqual(
+                decompile(op(OP_TRUSTED_CERT, slot(index))),
+                'certificate {} trusted'.format(text))
+
+    def test_certificate_hash(self):
+        self.assertEqual(
+            decompile(op(OP_ANCHOR_HASH, slot(ROOT), data('\xab\xcd\x01'))),
+            'certificate root = H"abcd01"')
+
+    def test_certificate_field(self):
+        self.assertEqual(
+            decompile(op(OP_CERT_FIELD, slot(LEAF), data('subject.CN'),
+                         match(MATCH_EQUAL, 'Developer ID Application: '
+                                            'Example (ABCDE12345)'))),
+            'certificate leaf[subject.CN] = "Developer ID Application: '
+            'Example (ABCDE12345)"')
+
+    def test_oids(self):
+        self.assertEqual(
+            decompile(op(OP_CERT_GENERIC, slot(1), data(OID_DEVELOPER_ID_CA),
+                         match(MATCH_EXISTS))),
+            'certificate 1[field.1.2.840.113635.100.6.2.6] /* exists */')
+        # Arcs above 127 span several bytes, and the first byte holds two
+        self.assertEqual(
+            decompile(op(OP_CERT_POLICY, slot(LEAF), data('\x55\x1d\x20'),
+                         match(MATCH_EXISTS))),
+            'certificate leaf[policy.2.5.29.32] /* exists */')
+        self.assertEqual(
+            decompile(op(OP_CERT_GENERIC, slot(LEAF), data('\x88\x37\x03'),
+                         match(MATCH_EXISTS))),
+            'certificate leaf[field.2.999.3] /* exists */')
+
+    def test_simple_data_is_not_quoted(self):
+        self.assertEqual(decompile(op(OP_IDENT, data('Terminal'))),
+                         'identifier Terminal')
+
+    def test_printable_data_is_quoted(self):
+        # Dots, a leading digit, spaces and reserved words all need quotes
+        for value in ['com.apple.Terminal', '6B4Q2V9N8T', 'My App', 'apple',
+                      'anchor']:
+            self.assertEqual(decompile(op(OP_IDENT, data(value))),
+                             'identifier "{}"'.format(value))
+
+    def test_quotes_and_backslashes_are_escaped(self):
+        self.assertEqual(decompile(op(OP_IDENT, data('a"b\\c'))),
+                         r'identifier "a\"b\\c"')
+
+    def test_binary_data_is_hex(self):
+        self.assertEqual(decompile(op(OP_IDENT, data('\x00\xff\x10'))),
+                         'identifier H"00ff10"')
+        self.assertEqual(decompile(op(OP_IDENT, data('caf\xc3\xa9'))),
+                         'identifier H"636166c3a9"')
+
+    def test_cdhash(self):
+        self.assertEqual(decompile(op(OP_CDHASH, data('\x01\x23\x45'))),
+                         'cdhash H"012345"')
+
+    def test_info_key_value(self):
+        self.assertEqual(
+            decompile(op(OP_INFO_KEY_VALUE, data('CFBundleVersion'),
+                         data('1.0'))),
+            'info[CFBundleVersion] = "1.0"')
+
+    def test_info_field_match_operations(self):
+        key = data('CFBundleShortVersionString')
+        for operation, text in [
+                (match(MATCH_EXISTS), ' /* exists */'),
+                (match(MATCH_ABSENT), ' absent '),
+                (match(MATCH_EQUAL, 'x'), ' = x'),
+                (match(MATCH_CONTAINS, 'x'), ' ~ x'),
+                (match(MATCH_BEGINS_WITH, 'x'), ' = x*'),
+                (match(MATCH_ENDS_WITH, 'x'), ' = *x'),
+                (match(MATCH_LESS_THAN, 'x'), ' < x'),
+                (match(MATCH_GREATER_EQUAL, 'x'), ' >= x')]:
+            self.assertEqual(
+                decompile(op(OP_INFO_KEY_FIELD, key, operation)),
+                'info[CFBundleShortVersionString]' + text)
+
+    def test_match_on_timestamp(self):
+        self.assertEqual(
+            decompile(op(OP_INFO_KEY_FIELD, data('date'), struct.pack(
+                '>Iq', MATCH_ON, 1234567890))),
+            'info[date] = <1234567890>')
+
+    def test_entitlement_field(self):
+        self.assertEqual(
+            decompile(op(OP_ENTITLEMENT_FIELD,
+                         data('com.apple.security.app-sandbox'),
+                         match(MATCH_EXISTS))),
+            'entitlement["com.apple.security.app-sandbox"] /* exists */')
+
+    def test_named_anchor_and_code(self):
+        self.assertEqual(decompile(op(OP_NAMED_ANCHOR, data('Example'))),
+                         'anchor apple Example')
+        self.assertEqual(decompile(op(OP_NAMED_CODE, data('Example'))),
+                         '(Example)')
+
+    def test_unknown_opcodes(self):
+        self.assertEqual(decompile(op(0x40000000 | 99)), ' /* opcode 99 */')
+        self.assertEqual(decompile(op(0x80000000 | 99)),
+                         ' false /* opcode 99 */')
+        self.assertRaises(ValueError, decompile, op(99))
+
+
+class MachOSlicesTests(unittest.TestCase):
+
+    def test_thin(self):
+        for big_endian in [False, True]:
+            for is_64 in [False, True]:
+                image = thin(CPU_TYPE_POWERPC, big_endian=big_endian,
+                             is_64=is_64)
+                self.assertEqual(tccprofile._macho_slices(image),
+                                 [(None, 0)])
+
+    def test_fat(self):
+        for fat64 in [False, True]:
+            binary = fat([(CPU_TYPE_X86_64, thin(CPU_TYPE_X86_64)),
+                          (CPU_TYPE_ARM64, thin(CPU_TYPE_ARM64))],
+                         fat64=fat64)
+            slices = tccprofile._macho_slices(binary)
+            self.assertEqual([cputype for cputype, offset in slices],
+                             [CPU_TYPE_X86_64, CPU_TYPE_ARM64])
+            for cputype, offset in slices:
+                self.assertEqual(
+                    struct.unpack('<i', binary[offset + 4:offset + 8])[0],
+                    cputype)
+
+    def test_fixture(self):
+        slices = tccprofile._macho_slices(read_fixture('fat_signed'))
+        self.assertEqual([cputype for cputype, offset in slices],
+                         [CPU_TYPE_X86_64, CPU_TYPE_ARM64])
+
+    def test_not_macho(self):
+        self.assertEqual(tccprofile._macho_slices('#!/bin/sh\n'), [])
+        self.assertEqual(tccprofile._macho_slices('\0' * 16), [])
+
+
+class SignatureReaderTests(unittest.TestCase):
+
+    def setUp(self):
+        self._machine = platform.machine
+        tccprofile._cdhash_cache.clear()
+
+    def tearDown(self):
+        platform.machine = self._machine
+        tccprofile._cdhash_cache.clear()
+
+    def expected_requirement(self, name):
+        line = read_fixture(name + '.requirement').rstrip('\n')
+        return line.partition('designated => ')[2]
+
+    def expected_cdhashes(self, name):
+        return read_fixture(name + '.cdhash').split()
+
+    def test_designated_requirement(self):
+        for name in ['thin_signed', 'fat_signed']:
+            self.assertEqual(
+                tccprofile.read_designated_requirement(fixture(name)),
+                self.expected_requirement(name))
+
+    def test_unsigned(self):
+        self.assertIsNone(
+            tccprofile.read_designated_requirement(fixture('thin_unsigned')))
+        self.assertIsNone(tccprofile.read_cdhash(fixture('thin_unsigned')))
+        self.assertEqual(
+            tccprofile.read_cdhash(fixture('thin_unsigned'), all_slices=True),
+            [])
+
+    def test_not_macho_or_missing(self):
+        for path in [fixture('thin_signed.requirement'),
+                     fixture('missing')]:
+            self.assertIsNone(tccprofile.read_designated_requirement(path))
+            self.assertIsNone(tccprofile.read_cdhash(path))
+
+    def test_cdhash_uses_strongest_code_directory(self):
+        # thin_signed has SHA-1 and SHA-256 CodeDirectories
+        self.assertEqual(tccprofile.read_cdhash(fixture('thin_signed')),
+                         self.expected_cdhashes('thin_signed')[0])
+
+    def test_cdhash_of_host_slice(self):
+        x86_64, arm64 = self.expected_cdhashes('fat_signed')
+        for machine, expected in [('x86_64', x86_64), ('arm64', arm64),
+                                  ('ppc', x86_64)]:
+            tccprofile._cdhash_cache.clear()
+            platform.machine = lambda: machine
+            self.assertEqual(tccprofile.read_cdhash(fixture('fat_signed')),
+                             expected)
+
+    def test_cdhash_of_all_slices(self):
+        self.assertEqual(
+            tccprofile.read_cdhash(fixture('fat_signed'), all_slices=True),
+            self.expected_cdhashes('fat_signed'))
+        self.assertEqual(
+            tccprofile.read_cdhash(fixture('thin_signed'), all_slices=True),
+            self.expected_cdhashes('thin_signed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Tests that the streaming plist writer produces exactly the bytes plistlib
+does, for profiles built eagerly and lazily and for ServiceEntry objects.
+"""
+
+import cStringIO
+import os
+import plistlib
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+
+APPS = 1000
+PAYLOADS = [payload for payload in tccprofile.PrivacyProfiles.PAYLOADS
+            if payload != 'AppleEvents']
+
+
+def plain(value):
+    """Returns value as the types plistlib writes: ServiceEntry objects as
+    dicts, LazyServiceEntries as lists and non-ASCII byte strings as unicode.
+    """
+    if isinstance(value, tccprofile.ServiceEntry):
+        value = value.to_dict()
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, tccprofile.LazyServiceEntries)):
+        return [plain(item) for item in value]
+    if isinstance(value, str):
+        try:
+            value.decode('ascii')
+        except UnicodeDecodeError:
+            return value.decode('utf-8')
+    return value
+
+
+def streamed(value):
+    buf = cStringIO.StringIO()
+    tccprofile.write_plist_stream(value, buf)
+    return buf.getvalue()
+
+
+def app_identity(i):
+    """A synthetic app; some have names that need escaping or are not
+    ASCII, which end up in comments and identifiers.
+    """
+    name = ['App{:04d}', 'R&D <{:04d}>', 'Café {:04d}', 'Приложение {:04d}'][
+        i % 4].format(i)
+    identifier = 'com.example.app{:04d}'.format(i)
+    return tccprofile.AppIdentity(
+        path='/Applications/{}.app'.format(name),
+        mime_type='x-mach-binary', identifier=identifier,
+        identifier_type='bundleID',
+        code_requirement='identifier "{}" and anchor apple generic and '
+                         'certificate leaf[subject.CN] = "R&D <Team>"'.format(
+                             identifier))
+
+
+class PlistWriterTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.identities = [app_identity(i) for i in range(APPS)]
+
+    def build(self, lazy):
+        resolver = tccprofile.IdentityResolver()
+        for identity in self.identities:
+            resolver.seed(identity)
+
+        profile = tccprofile.PrivacyProfiles(
+            payload_description='Apps & <more>', payload_name='Café',
+            payload_identifier='com.example.profile',
+            payload_organization='Example', payload_version=1,
+            sign_cert=None, filename=None, resolver=resolver)
+        profile.set_services_dict(
+            {payload: [identity.path for identity in self.identities]
+             for payload in PAYLOADS})
+        profile.build_profile(allow=True, lazy=lazy)
+        return profile
+
+    def test_eager_profile(self):
+        profile = self.build(lazy=False)
+        services = profile.template['PayloadContent'][0]['Services']
+        self.assertEqual(sum(len(entries) for entries in services.values()),
+                         APPS * len(PAYLOADS))
+        self.assertIsInstance(services['Camera'][0], tccprofile.ServiceEntry)
+
+        self.assertEqual(profile.to_bytes(),
+                         plistlib.writePlistToString(plain(profile.template)))
+
+    def test_lazy_profile(self):
+        profile = self.build(lazy=True)
+        services = profile.template['PayloadContent'][0]['Services']
+        self.assertIsInstance(services['Camera'],
+                              tccprofile.LazyServiceEntries)
+
+        self.assertEqual(profile.to_bytes(),
+                         plistlib.writePlistToString(plain(profile.template)))
+
+    def test_lazy_and_eager_match(self):
+        def without_uuids(profile):
+            # Every build gets new UUIDs
+            return profile.to_bytes().replace(
+                profile.profile_uuid, 'UUID').replace(
+                profile.payload_uuid, 'UUID')
+
+        self.assertEqual(without_uuids(self.build(lazy=True)),
+                         without_uuids(self.build(lazy=False)))
+
+    def test_service_entries(self):
+        entries = [
+            tccprofile.ServiceEntry(
+                Allowed=True, CodeRequirement='anchor apple',
+                Comment='Allow <Mail> & Café', Identifier='com.apple.mail',
+                IdentifierType='bundleID'),
+            tccprofile.ServiceEntry(
+                Allowed=False, CodeRequirement='identifier "a" or cdhash H"00"',
+                Comment=u'Deny Приложение', Identifier='/usr/bin/a > b',
+                IdentifierType='path', AEReceiverIdentifier='com.apple.finder',
+                AEReceiverIdentifierType='bundleID',
+                AEReceiverCodeRequirement='anchor apple', StaticCode=True),
+        ]
+        value = {
+            'Services': {
+                'Accessibility': entries,
+                'Lazy': tccprofile.LazyServiceEntries(lambda: iter(entries)),
+                'Empty': tccprofile.LazyServiceEntries(lambda: iter([])),
+                'Tuple': tuple(entries),
+            },
+            'Data': plistlib.Data('\x00\x01<&>'),
+            'Version': 1,
+            'Ratio': 0.5,
+            'Text': 'Tom & Jerry <tj@example.com> > Café',
+            'EmptyList': [],
+            'EmptyDict': {},
+        }
+
+        self.assertEqual(streamed(value),
+                         plistlib.writePlistToString(plain(value)))
+        self.assertIn('Allow &lt;Mail&gt; &amp; Café', streamed(value))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Tests for sniff_mime_type, which stands in for `file --mime-type`."""
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tccprofile  # NOQA
+from macho import CPU_TYPE_ARM64, CPU_TYPE_POWERPC, CPU_TYPE_X86_64, fat, thin  # NOQA
+
+
+class SniffMimeTypeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def sniff(self, content, name='file'):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return tccprofile.sniff_mime_type(path)
+
+    def test_shebangs(self):
+        for shebang, expected in [
+                ('#!/bin/sh', 'x-shellscript'),
+                ('#!/bin/bash', 'x-shellscript'),
+                ('#!/bin/zsh', 'x-shellscript'),
+                ('#! /bin/sh', 'x-shellscript'),
+                ('#!/usr/bin/python', 'x-python'),
+                ('#!/usr/bin/python2.7', 'x-python'),
+                ('#!/usr/bin/perl', 'x-perl'),
+                ('#!/usr/bin/ruby', 'x-ruby'),
+                ('#!/usr/bin/awk', 'plain')]:
+            self.assertEqual(self.sniff(shebang + '\necho hi\n'), expected,
+                             shebang)
+
+    def test_env_shebangs(self):
+        for shebang, expected in [
+                ('#!/usr/bin/env python', 'x-python'),
+                ('#!/usr/bin/env python3', 'x-python'),
+                ('#!/usr/bin/env bash', 'x-shellscript'),
+                ('#!/usr/bin/env ruby', 'x-ruby'),
+                ('#!/usr/bin/env -S python3 -u', 'x-python'),
+                ('#!/usr/bin/env -i PATH=/bin sh', 'x-shellscript'),
+                ('#!/usr/bin/env', 'plain')]:
+            self.assertEqual(self.sniff(shebang + '\n'), expected, shebang)
+
+    def test_shebangs_with_arguments(self):
+        for shebang, expected in [
+                ('#!/bin/bash -e', 'x-shellscript'),
+                ('#!/bin/sh -x -e', 'x-shellscript'),
+                ('#!/usr/bin/python -u', 'x-python'),
+                ('#!/usr/bin/perl -w', 'x-perl')]:
+            self.assertEqual(self.sniff(shebang + '\n'), expected, shebang)
+
+    def test_shebang_without_newline(self):
+        self.assertEqual(self.sniff('#!/bin/sh'), 'x-shellscript')
+
+    def test_thin_macho(self):
+        for big_endian in [False, True]:
+            for is_64 in [False, True]:
+                image = thin(CPU_TYPE_POWERPC, big_endian=big_endian,
+                             is_64=is_64)
+                self.assertEqual(self.sniff(image), 'x-mach-binary',
+                                 (big_endian, is_64))
+
+    def test_fat_macho(self):
+        for fat64 in [False, True]:
+            binary = fat([(CPU_TYPE_X86_64, thin(CPU_TYPE_X86_64)),
+                          (CPU_TYPE_ARM64, thin(CPU_TYPE_ARM64))],
+                         fat64=fat64)
+            self.assertEqual(self.sniff(binary), 'x-mach-binary', fat64)
+
+        # Big endian slices in a fat file
+        binary = fat([(CPU_TYPE_POWERPC, thin(CPU_TYPE_POWERPC,
+                                              big_endian=True))])
+        self.assertEqual(self.sniff(binary), 'x-mach-binary')
+
+    def test_java_class_is_not_macho(self):
+        # Java class files also start with 0xcafebabe, followed by their
+        # minor and major version (Java 8 here)
+        java = struct.pack('>IHHH', 0xcafebabe, 0, 52, 10) + '\x0a' * 32
+        self.assertEqual(self.sniff(java, 'Main.class'), 'octet-stream')
+        self.assertEqual(self.sniff(java[:8], 'Main.class'), 'octet-stream')
+
+    def test_text_and_binary(self):
+        self.assertEqual(self.sniff('hello\n'), 'plain')
+        self.assertEqual(self.sniff('\x00\x01\x02\x03\x04\x05\x06\x07\x08'),
+                         'octet-stream')
+
+    def test_empty_file(self):
+        self.assertEqual(self.sniff(''), 'x-empty')
+
+    def test_directory(self):
+        os.mkdir(os.path.join(self.tmp, 'Example.app'))
+        for path in ['Example.app', 'Example.app/']:
+            self.assertEqual(
+                tccprofile.sniff_mime_type(os.path.join(self.tmp, path)),
+                'directory')
+        self.assertEqual(tccprofile.sniff_mime_type('/'), 'directory')
+
+    def test_missing_file(self):
+        self.assertIsNone(
+            tccprofile.sniff_mime_type(os.path.join(self.tmp, 'missing')))
+
+    def test_unreadable_file(self):
+        path = os.path.join(self.tmp, 'unreadable')
+        with open(path, 'wb') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(path, 0)
+        if os.access(path, os.R_OK):
+            self.skipTest('running as a user that can read any file')
+
+        self.assertIsNone(tccprofile.sniff_mime_type(path))
+
+
+if __name__ == '__main__':
+    unittest.main()